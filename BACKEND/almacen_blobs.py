@@ -0,0 +1,286 @@
+import logging
+import zlib
+from datetime import datetime
+
+from sqlalchemy import event, select, delete, func, or_
+from sqlalchemy.orm import Session, object_session
+
+from almacenamiento import almacenamiento
+from database import insert_con_conflictos
+from models import db, Blob, Documento, Administrador, Tabla, Alumno, ArchivoPorBorrar, Trabajo
+from trabajos import tarea
+
+logger = logging.getLogger(__name__)
+
+# Filas de archivos_por_borrar que trata cada transacción de la limpieza
+LOTE_LIMPIEZA = 200
+# Blobs a los que se calcula el CRC-32 en cada transacción de rellenar_crc32
+LOTE_CRC = 100
+TAM_BLOQUE = 64 * 1024
+
+
+def clave_blob(sha256):
+    # Dos niveles de subcarpetas para no tener cientos de miles de archivos juntos
+    return f"blobs/{sha256[:2]}/{sha256[2:4]}/{sha256}"
+
+
+def añadir_referencia(sha256, ruta, tamano, crc32=None):
+    """
+    Suma una referencia al blob (creándolo si no existe) dentro de la
+    transacción actual, que queda con la fila bloqueada hasta el commit. El
+    archivo se coloca a continuación con colocar_blob(), antes del commit.
+    """
+    insert = insert_con_conflictos(db.session.get_bind())
+    tabla = Blob.__table__
+    db.session.execute(
+        insert(tabla)
+        .values(sha256=sha256, ruta=ruta, tamano=tamano, referencias=1, crc32=crc32)
+        .on_conflict_do_update(
+            index_elements=["sha256"],
+            set_={"referencias": tabla.c.referencias + 1, "crc32": func.coalesce(tabla.c.crc32, crc32)}
+        )
+    )
+
+
+def colocar_blob(subida, clave):
+    """
+    Entrega el temporal al almacenamiento, o lo descarta si el contenido ya
+    estaba guardado (una resubida idéntica no escribe nada). Se llama con la
+    fila del blob bloqueada por añadir_referencia: liberar_blob() no puede
+    borrar el archivo entre la comprobación y el commit.
+    """
+    alm = almacenamiento()
+    if alm.existe(clave):
+        subida.descartar()
+    else:
+        subida.guardar_en(alm, clave)
+
+
+# Cualquier borrado de un Documento (rutas, cascadas de Tabla o Alumno,
+# sustitución en una resubida) libera su archivo. La referencia se resta en
+# la misma transacción; el blob que se queda en 0 se borra (fila y archivo)
+# después del commit con liberar_blob().
+@event.listens_for(Documento, "after_delete")
+def _liberar_documento(mapper, connection, doc):
+    sesion = object_session(doc)
+    pendientes = sesion.info.setdefault("archivos_a_borrar", []) if sesion is not None else None
+
+    fila = None
+    if doc.sha256:
+        tabla = Blob.__table__
+        fila = connection.execute(
+            tabla.update()
+            .where(tabla.c.sha256 == doc.sha256)
+            .values(referencias=tabla.c.referencias - 1)
+            .returning(tabla.c.referencias)
+        ).first()
+
+    if fila is not None:
+        if fila.referencias <= 0 and pendientes is not None:
+            pendientes.append((doc.sha256, None))
+    elif doc.ruta and pendientes is not None:
+        # Documentos anteriores al almacén por hash: un archivo por documento
+        pendientes.append((None, doc.ruta))
+
+
+@event.listens_for(Session, "after_commit")
+def _borrar_archivos_tras_commit(sesion):
+    pendientes = sesion.info.pop("archivos_a_borrar", None)
+    if pendientes:
+        _borrar_archivos(pendientes)
+
+
+def _borrar_archivos(pendientes):
+    """
+    Libera los blobs (sha256, None) que se quedaron sin referencias y borra
+    los archivos (None, ruta) de documentos anteriores al almacén por hash.
+    """
+    alm = almacenamiento()
+    for sha256, ruta in pendientes:
+        try:
+            if sha256:
+                liberar_blob(sha256)
+            else:
+                alm.borrar(ruta)
+        except Exception as e:
+            logger.error(f"Error borrando archivo {ruta or sha256}: {str(e)}")
+
+
+def _borrar_sin_referencias(conn, condicion):
+    """
+    Borra los blobs de `condicion` que no tienen referencias y sus archivos,
+    dentro de la transacción de `conn`. El DELETE bloquea las filas hasta el
+    commit: una subida del mismo contenido (añadir_referencia) espera y
+    después vuelve a colocar el archivo, y si la subida llegó antes el blob
+    ya no está en 0 y no se borra. Un archivo que no se puede borrar se
+    queda huérfano para reconciliar-archivos.
+    """
+    blobs = Blob.__table__
+    alm = almacenamiento()
+    for blob in conn.execute(
+        delete(blobs)
+        .where(condicion, blobs.c.referencias <= 0)
+        .returning(blobs.c.ruta, blobs.c.miniatura)
+    ).all():
+        for ruta in (blob.ruta, blob.miniatura):
+            if not ruta:
+                continue
+            try:
+                alm.borrar(ruta)
+            except Exception as e:
+                logger.error(f"Error borrando archivo {ruta}: {str(e)}")
+
+
+def liberar_blob(sha256):
+    """ Borra el blob, fila y archivo, si sigue sin referencias. """
+    with db.engine.begin() as conn:
+        _borrar_sin_referencias(conn, Blob.__table__.c.sha256 == sha256)
+
+
+@event.listens_for(Session, "after_rollback")
+def _descartar_tras_rollback(sesion):
+    sesion.info.pop("archivos_a_borrar", None)
+
+
+# Los borrados de Tabla, Alumno y Administrador se llevan sus documentos con
+# ON DELETE CASCADE, sin cargarlos ni pasar por _liberar_documento. Antes de
+# borrar el padre se apuntan sus archivos en archivos_por_borrar, en la misma
+# transacción, con un solo INSERT ... SELECT; la tarea limpiar_archivos los
+# libera después por lotes.
+def apuntar_archivos(connection, sesion, condicion):
+    documentos = Documento.__table__
+    resultado = connection.execute(
+        ArchivoPorBorrar.__table__.insert().from_select(
+            ["sha256", "ruta", "fecha_creacion"],
+            select(documentos.c.sha256, documentos.c.ruta, func.now())
+            .where(condicion, or_(documentos.c.sha256.isnot(None), documentos.c.ruta.isnot(None)))
+            .distinct()
+        )
+    )
+    if not resultado.rowcount:
+        return
+
+    # Siempre un trabajo nuevo: uno ya pendiente puede reclamarlo un worker y
+    # vaciar la cola antes de este commit, y estas filas se quedarían sin
+    # limpiar. Los que encuentren la cola vacía terminan enseguida.
+    connection.execute(Trabajo.__table__.insert().values(
+        tipo="limpiar_archivos", clave="", estado="pendiente", intentos=0, fecha_creacion=datetime.utcnow()
+    ))
+    if sesion is not None:
+        sesion.info["hay_trabajos_nuevos"] = True
+
+
+@event.listens_for(Tabla, "before_delete")
+def _apuntar_archivos_de_tabla(mapper, connection, tabla):
+    apuntar_archivos(connection, object_session(tabla), Documento.__table__.c.tabla_id == tabla.id)
+
+
+@event.listens_for(Alumno, "before_delete")
+def _apuntar_archivos_de_alumno(mapper, connection, alumno):
+    apuntar_archivos(connection, object_session(alumno), Documento.__table__.c.alumno_id == alumno.id)
+
+
+@event.listens_for(Administrador, "before_delete")
+def _apuntar_archivos_de_admin(mapper, connection, admin):
+    tablas = select(Tabla.__table__.c.id).where(Tabla.__table__.c.admin_id == admin.id)
+    apuntar_archivos(connection, object_session(admin), Documento.__table__.c.tabla_id.in_(tablas))
+
+
+def limpiar_lote():
+    """
+    Trata un lote de archivos_por_borrar. No resta referencias (un documento
+    borrado también por el ORM ya restó la suya): las vuelve a contar. Los
+    blobs sin ningún documento se borran con su archivo en la misma
+    transacción, como en liberar_blob(). Devuelve False si la cola estaba
+    vacía.
+    """
+    cola = ArchivoPorBorrar.__table__
+    blobs = Blob.__table__
+    documentos = Documento.__table__
+
+    consulta = select(cola.c.id, cola.c.sha256, cola.c.ruta).order_by(cola.c.id).limit(LOTE_LIMPIEZA)
+    if db.engine.dialect.name == "postgresql":
+        consulta = consulta.with_for_update(skip_locked=True)
+
+    with db.engine.begin() as conn:
+        filas = conn.execute(consulta).all()
+        if not filas:
+            return False
+
+        # Documentos anteriores al almacén por hash: un archivo por documento
+        pendientes = [(None, f.ruta) for f in filas if not f.sha256 and f.ruta]
+        hashes = sorted({f.sha256 for f in filas if f.sha256})
+        if hashes:
+            if db.engine.dialect.name == "postgresql":
+                # Primero los bloqueos: el recuento, en otra sentencia, ya ve
+                # los documentos de las subidas que los tenían
+                conn.execute(select(blobs.c.sha256).where(blobs.c.sha256.in_(hashes))
+                             .order_by(blobs.c.sha256).with_for_update())
+            conn.execute(
+                blobs.update()
+                .where(blobs.c.sha256.in_(hashes))
+                .values(referencias=select(func.count(documentos.c.id))
+                        .where(documentos.c.sha256 == blobs.c.sha256)
+                        .scalar_subquery())
+            )
+            _borrar_sin_referencias(conn, blobs.c.sha256.in_(hashes))
+        conn.execute(delete(cola).where(cola.c.id.in_([f.id for f in filas])))
+
+    _borrar_archivos(pendientes)
+    return True
+
+
+@tarea("limpiar_archivos")
+def limpiar_archivos(clave):
+    lotes = 0
+    while limpiar_lote():
+        lotes += 1
+    if lotes:
+        logger.info(f"Limpieza de archivos: {lotes} lotes")
+
+
+def calcular_crc32(clave):
+    """ CRC-32 del archivo `clave` del almacenamiento, leyéndolo por bloques. """
+    crc = 0
+    f = almacenamiento().abrir(clave)
+    try:
+        while True:
+            bloque = f.read(TAM_BLOQUE)
+            if not bloque:
+                return crc
+            crc = zlib.crc32(bloque, crc)
+    finally:
+        f.close()
+
+
+@tarea("rellenar_crc32")
+def rellenar_crc32(clave):
+    """
+    Calcula Blob.crc32 de los blobs guardados antes de que existiera la
+    columna (las subidas nuevas ya lo traen). Pagina por sha256 para no
+    atascarse con los que no tienen archivo.
+    """
+    blobs = Blob.__table__
+    ultimo = ""
+    rellenados = 0
+    while True:
+        filas = db.session.execute(
+            select(blobs.c.sha256, blobs.c.ruta)
+            .where(blobs.c.crc32.is_(None), blobs.c.sha256 > ultimo)
+            .order_by(blobs.c.sha256)
+            .limit(LOTE_CRC)
+        ).all()
+        if not filas:
+            break
+        for fila in filas:
+            try:
+                crc = calcular_crc32(fila.ruta)
+            except FileNotFoundError:
+                logger.warning(f"Blob {fila.sha256} sin archivo: no se calcula su CRC-32")
+                continue
+            db.session.execute(blobs.update().where(blobs.c.sha256 == fila.sha256).values(crc32=crc))
+            rellenados += 1
+        db.session.commit()
+        ultimo = filas[-1].sha256
+    if rellenados:
+        logger.info(f"CRC-32 calculado para {rellenados} blobs")
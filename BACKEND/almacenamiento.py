@@ -0,0 +1,354 @@
+import os
+import threading
+from abc import ABC, abstractmethod
+from datetime import timezone
+from urllib.parse import quote
+
+from flask import current_app, request, redirect, send_file, Response
+from werkzeug.http import is_resource_modified, http_date
+
+from exportacion_zip import parsear_range
+
+TAM_BLOQUE = 64 * 1024
+
+# asgi.py marca el environ con ENVIRON_ENVIO_ASGI y, si una respuesta trae
+# CABECERA_ENVIO_ASGI ("inicio:fin:ruta"), envía él mismo ese trozo del archivo
+ENVIRON_ENVIO_ASGI = "academia.envio_archivos"
+CABECERA_ENVIO_ASGI = "X-Archivo-Asgi"
+
+
+class Almacenamiento(ABC):
+    """
+    Dónde viven los archivos subidos. Las claves son rutas relativas con "/"
+    (p. ej. "blobs/ab/cd/<sha256>"), que es lo que se guarda en Documento.ruta.
+    Un backend al que le falte algún método abstracto no se puede instanciar.
+    """
+
+    @abstractmethod
+    def guardar(self, clave, ruta_local):
+        """ Mueve un archivo local (temporal) al almacenamiento. """
+
+    @abstractmethod
+    def existe(self, clave):
+        pass
+
+    @abstractmethod
+    def info(self, clave):
+        """ Devuelve (tamaño, mtime) o lanza FileNotFoundError. """
+
+    @abstractmethod
+    def abrir(self, clave, inicio=0, fin=None):
+        """
+        Objeto de solo lectura con read(n) y close(), colocado en el byte
+        `inicio`. Con `fin` el backend puede limitar lo que trae (ambos
+        incluidos); quien lee no debe pasar de ahí.
+        """
+
+    @abstractmethod
+    def borrar(self, clave):
+        pass
+
+    def ruta_local(self, clave):
+        """ Ruta en disco si el backend la tiene; si no, None. """
+        return None
+
+    def url_descarga(self, clave, nombre, mimetype, adjunto=False):
+        """ URL firmada para que el cliente descargue directamente; None si no aplica. """
+        return None
+
+
+class AlmacenamientoLocal(Almacenamiento):
+
+    def __init__(self, base):
+        self.base = base
+
+    def ruta_local(self, clave):
+        if os.path.isabs(clave):
+            # Documentos antiguos: Documento.ruta guardaba la ruta absoluta
+            return clave
+        ruta = os.path.join(self.base, *clave.split("/"))
+        if not os.path.exists(ruta):
+            # Rutas antiguas relativas al directorio del backend ("uploads/...")
+            legado = os.path.join(os.path.dirname(self.base), clave)
+            if os.path.exists(legado):
+                return legado
+        return ruta
+
+    def guardar(self, clave, ruta_local):
+        destino = self.ruta_local(clave)
+        os.makedirs(os.path.dirname(destino), exist_ok=True)
+        os.replace(ruta_local, destino)
+
+    def existe(self, clave):
+        return os.path.exists(self.ruta_local(clave))
+
+    def info(self, clave):
+        st = os.stat(self.ruta_local(clave))
+        return st.st_size, st.st_mtime
+
+    def abrir(self, clave, inicio=0, fin=None):
+        f = open(self.ruta_local(clave), "rb")
+        if inicio:
+            f.seek(inicio)
+        return f
+
+    def borrar(self, clave):
+        ruta = self.ruta_local(clave)
+        if os.path.exists(ruta):
+            os.remove(ruta)
+
+
+class AlmacenamientoS3(Almacenamiento):
+    """
+    Backend para S3 o cualquier servicio compatible (MinIO, etc.; basta con
+    S3_ENDPOINT_URL). Necesita boto3, que solo se importa si se usa.
+    """
+
+    def __init__(self, bucket, prefijo="", endpoint_url=None, region=None,
+                 max_conexiones=20, presignar=True, expira=300):
+        self.bucket = bucket
+        self.prefijo = prefijo.strip("/")
+        self.endpoint_url = endpoint_url
+        self.region = region
+        self.max_conexiones = max_conexiones
+        self.presignar = presignar
+        self.expira = expira
+        self._cliente = None
+        self._cliente_pid = None
+        self._lock = threading.Lock()
+
+    @property
+    def cliente(self):
+        # Un cliente por proceso (los de boto3 son thread-safe y mantienen un
+        # pool de conexiones HTTP); tras un fork de gunicorn se crea otro
+        if self._cliente is None or self._cliente_pid != os.getpid():
+            with self._lock:
+                if self._cliente is None or self._cliente_pid != os.getpid():
+                    import boto3
+                    from botocore.config import Config
+
+                    self._cliente = boto3.client(
+                        "s3",
+                        endpoint_url=self.endpoint_url,
+                        region_name=self.region,
+                        config=Config(
+                            max_pool_connections=self.max_conexiones,
+                            retries={"max_attempts": 3, "mode": "standard"}
+                        )
+                    )
+                    self._cliente_pid = os.getpid()
+        return self._cliente
+
+    def _clave(self, clave):
+        clave = clave.lstrip("/")
+        return f"{self.prefijo}/{clave}" if self.prefijo else clave
+
+    def guardar(self, clave, ruta_local):
+        # upload_file lee el archivo por partes (multipart si es grande)
+        self.cliente.upload_file(ruta_local, self.bucket, self._clave(clave))
+        os.remove(ruta_local)
+
+    def existe(self, clave):
+        try:
+            self.info(clave)
+            return True
+        except FileNotFoundError:
+            return False
+
+    def info(self, clave):
+        from botocore.exceptions import ClientError
+
+        try:
+            cabecera = self.cliente.head_object(Bucket=self.bucket, Key=self._clave(clave))
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+                raise FileNotFoundError(clave)
+            raise
+        return cabecera["ContentLength"], cabecera["LastModified"].timestamp()
+
+    def abrir(self, clave, inicio=0, fin=None):
+        from botocore.exceptions import ClientError
+
+        parametros = {"Bucket": self.bucket, "Key": self._clave(clave)}
+        if inicio or fin is not None:
+            parametros["Range"] = f"bytes={inicio}-{'' if fin is None else fin}"
+        try:
+            objeto = self.cliente.get_object(**parametros)
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+                raise FileNotFoundError(clave)
+            raise
+        return objeto["Body"]
+
+    def borrar(self, clave):
+        self.cliente.delete_object(Bucket=self.bucket, Key=self._clave(clave))
+
+    def url_descarga(self, clave, nombre, mimetype, adjunto=False):
+        if not self.presignar:
+            return None
+        return self.cliente.generate_presigned_url(
+            "get_object",
+            Params={
+                "Bucket": self.bucket,
+                "Key": self._clave(clave),
+                "ResponseContentType": mimetype,
+                "ResponseContentDisposition": disposicion(nombre, adjunto)
+            },
+            ExpiresIn=self.expira
+        )
+
+
+def crear_almacenamiento(app):
+    backend = os.getenv("STORAGE_BACKEND", "local").lower()
+    if backend == "s3":
+        return AlmacenamientoS3(
+            bucket=os.environ["S3_BUCKET"],
+            prefijo=os.getenv("S3_PREFIX", ""),
+            endpoint_url=os.getenv("S3_ENDPOINT_URL") or None,
+            region=os.getenv("S3_REGION") or None,
+            max_conexiones=int(os.getenv("S3_MAX_POOL", "20")),
+            presignar=os.getenv("S3_PRESIGNED", "1") == "1",
+            expira=int(os.getenv("S3_PRESIGN_EXPIRA", "300"))
+        )
+    if backend == "local":
+        return AlmacenamientoLocal(app.config["UPLOAD_FOLDER"])
+    raise Exception(f"STORAGE_BACKEND desconocido: {backend}")
+
+
+def init_app(app):
+    app.extensions["almacenamiento"] = crear_almacenamiento(app)
+
+
+def almacenamiento():
+    return current_app.extensions["almacenamiento"]
+
+
+def disposicion(nombre, adjunto=False):
+    tipo = "attachment" if adjunto else "inline"
+    return f"{tipo}; filename*=UTF-8''{quote(nombre)}"
+
+
+def _leer_en_bloques(archivo, restantes):
+    try:
+        while restantes > 0:
+            bloque = archivo.read(min(TAM_BLOQUE, restantes))
+            if not bloque:
+                break
+            restantes -= len(bloque)
+            yield bloque
+    finally:
+        archivo.close()
+
+
+def respuesta_archivo(clave, nombre, mimetype, adjunto=False, etag=None, modificado=None):
+    """
+    Respuesta Flask para servir un archivo guardado, con validación
+    condicional (If-None-Match, If-Modified-Since) y peticiones Range para
+    los visores de PDF.
+
+    `etag` es el SHA-256 del contenido y `modificado` la fecha de subida: con
+    ellos un 304 se responde sin tocar el almacenamiento. Después, según el
+    backend y ENVIO_ARCHIVOS, se redirige a una URL firmada, se delega en el
+    proxy (X-Accel-Redirect / X-Sendfile), se usa send_file o se envía en
+    streaming. Lanza FileNotFoundError si el archivo no existe.
+    """
+    alm = almacenamiento()
+
+    if modificado is not None and modificado.tzinfo is None:
+        modificado = modificado.replace(tzinfo=timezone.utc)
+
+    cabeceras = {"Cache-Control": "private, no-cache"}
+    if etag:
+        cabeceras["ETag"] = f'"{etag}"'
+    if modificado is not None:
+        cabeceras["Last-Modified"] = http_date(modificado)
+
+    if (etag or modificado) and not is_resource_modified(request.environ, etag=etag, last_modified=modificado):
+        return Response(status=304, headers=cabeceras)
+
+    url = alm.url_descarga(clave, nombre, mimetype, adjunto=adjunto)
+    if url:
+        return redirect(url, code=302)
+
+    ruta = alm.ruta_local(clave)
+    if ruta is not None:
+        if not os.path.exists(ruta):
+            raise FileNotFoundError(clave)
+
+        delegada = _respuesta_delegada(alm, ruta, nombre, mimetype, adjunto, cabeceras)
+        if delegada is not None:
+            return delegada
+
+        if request.environ.get(ENVIRON_ENVIO_ASGI):
+            # Bajo asgi.py: Flask solo resuelve cabeceras y rango, y el
+            # adaptador envía los bytes sin ocupar un hilo por descarga lenta
+            return _respuesta_en_streaming(alm, clave, nombre, mimetype, adjunto, etag, cabeceras, ruta_asgi=ruta)
+
+        respuesta = send_file(
+            ruta, mimetype=mimetype, as_attachment=adjunto, download_name=nombre,
+            etag=etag or True, last_modified=modificado, conditional=True
+        )
+        respuesta.headers["Cache-Control"] = cabeceras["Cache-Control"]
+        respuesta.headers["Accept-Ranges"] = "bytes"
+        return respuesta
+
+    return _respuesta_en_streaming(alm, clave, nombre, mimetype, adjunto, etag, cabeceras)
+
+
+def _respuesta_delegada(alm, ruta, nombre, mimetype, adjunto, cabeceras):
+    """
+    Con ENVIO_ARCHIVOS=x-accel (nginx) o x-sendfile (Apache, lighttpd) el
+    worker solo devuelve cabeceras y el proxy envía los bytes, Range incluido.
+    """
+    modo = current_app.config.get("ENVIO_ARCHIVOS")
+    if modo == "x-accel":
+        relativa = os.path.relpath(ruta, alm.base)
+        if relativa.startswith(".."):
+            # Archivos antiguos fuera de la carpeta de subidas
+            return None
+        interna = current_app.config["X_ACCEL_PREFIJO"].rstrip("/") + "/" + relativa.replace(os.sep, "/")
+        delegacion = {"X-Accel-Redirect": quote(interna)}
+    elif modo == "x-sendfile":
+        delegacion = {"X-Sendfile": ruta}
+    else:
+        return None
+
+    return Response(
+        mimetype=mimetype,
+        headers={**cabeceras, **delegacion, "Content-Disposition": disposicion(nombre, adjunto)}
+    )
+
+
+def _respuesta_en_streaming(alm, clave, nombre, mimetype, adjunto, etag, cabeceras, ruta_asgi=None):
+    tamano, _ = alm.info(clave)
+    cabeceras = {**cabeceras, "Accept-Ranges": "bytes", "Content-Disposition": disposicion(nombre, adjunto)}
+
+    rango = None
+    if_range = request.headers.get("If-Range")
+    if not if_range or (etag and if_range.strip('"') == etag):
+        try:
+            rango = parsear_range(request.headers.get("Range"), tamano)
+        except ValueError:
+            cabeceras["Content-Range"] = f"bytes */{tamano}"
+            return Response(status=416, headers=cabeceras)
+
+    if rango:
+        inicio, fin = rango
+        status = 206
+        cabeceras["Content-Range"] = f"bytes {inicio}-{fin}/{tamano}"
+    else:
+        inicio, fin = 0, tamano - 1
+        status = 200
+    cabeceras["Content-Length"] = str(fin - inicio + 1)
+
+    if ruta_asgi is not None:
+        cabeceras[CABECERA_ENVIO_ASGI] = f"{inicio}:{fin}:{quote(ruta_asgi)}"
+        return Response(status=status, mimetype=mimetype, headers=cabeceras)
+
+    return Response(
+        _leer_en_bloques(alm.abrir(clave, inicio, fin), fin - inicio + 1),
+        status=status,
+        mimetype=mimetype,
+        headers=cabeceras,
+        direct_passthrough=True
+    )
@@ -0,0 +1,254 @@
+import logging
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+import zipfile
+
+from flask import current_app
+
+from almacenamiento import almacenamiento
+from models import db, Blob, Documento
+from trabajos import tarea, encolar
+from eventos import publicar
+from versiones import subir_version
+
+logger = logging.getLogger(__name__)
+
+TAM_CABECERA = 8192
+TAM_BLOQUE = 64 * 1024
+
+TIPOS_PERMITIDOS_POR_DEFECTO = ",".join([
+    "application/pdf",
+    "image/jpeg",
+    "image/png",
+    "image/gif",
+    "image/webp",
+    "image/heic",
+    "application/msword",
+    "application/vnd.oasis.opendocument.text",
+    "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+])
+
+FIRMAS = [
+    (b"%PDF-", "application/pdf"),
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+    (b"\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1", "application/msword"),
+    (b"\x7fELF", "application/x-executable"),
+    (b"MZ", "application/x-dosexec"),
+    (b"#!", "text/x-shellscript"),
+]
+
+PATRON_PAGINA = re.compile(rb"/Type\s*/Page(?![a-zA-Z])")
+PATRON_COUNT = re.compile(rb"/Type\s*/Pages\b[^>]*?/Count\s+(\d+)|/Count\s+(\d+)[^>]*?/Type\s*/Pages\b", re.S)
+
+
+def parsear_tipos(texto):
+    return {t.strip().lower() for t in (texto or "").split(",") if t.strip()}
+
+
+def detectar_mime(ruta):
+    """
+    Tipo real del archivo según su contenido, sin fiarse de la extensión ni
+    del Content-Type que mandó el navegador.
+    """
+    with open(ruta, "rb") as f:
+        cabecera = f.read(TAM_CABECERA)
+
+    if cabecera.startswith(b"PK\x03\x04"):
+        return _mime_zip(ruta)
+    if cabecera[:4] == b"RIFF" and cabecera[8:12] == b"WEBP":
+        return "image/webp"
+    if cabecera[4:8] == b"ftyp" and cabecera[8:12] in (b"heic", b"heix", b"mif1", b"heif"):
+        return "image/heic"
+    for firma, mime in FIRMAS:
+        if cabecera.startswith(firma):
+            return mime
+
+    inicio = cabecera.lstrip()[:64].lower()
+    if b"<?php" in cabecera.lower():
+        return "text/x-php"
+    if inicio.startswith((b"<!doctype html", b"<html", b"<script")):
+        return "text/html"
+    if b"<svg" in cabecera.lower():
+        return "image/svg+xml"
+    if inicio.startswith(b"<?xml"):
+        return "application/xml"
+    try:
+        cabecera.decode("utf-8")
+        return "text/plain"
+    except UnicodeDecodeError:
+        return "application/octet-stream"
+
+
+def _mime_zip(ruta):
+    try:
+        with zipfile.ZipFile(ruta) as z:
+            nombres = z.namelist()
+            if "mimetype" in nombres:
+                # Formato OpenDocument: el primer miembro guarda el tipo
+                return z.read("mimetype").decode("ascii", "replace").strip()
+            if "[Content_Types].xml" in nombres:
+                if any(n.startswith("word/") for n in nombres):
+                    return "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+                if any(n.startswith("xl/") for n in nombres):
+                    return "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+                if any(n.startswith("ppt/") for n in nombres):
+                    return "application/vnd.openxmlformats-officedocument.presentationml.presentation"
+    except zipfile.BadZipFile:
+        pass
+    return "application/zip"
+
+
+def contar_paginas_pdf(ruta):
+    """
+    Usa pypdf si está instalado. Si no, cuenta los objetos /Type /Page leyendo
+    el archivo por bloques, y si no hay ninguno (PDF con object streams
+    comprimidos) toma el /Count mayor del árbol de páginas.
+    """
+    try:
+        from pypdf import PdfReader
+    except ImportError:
+        PdfReader = None
+
+    if PdfReader is not None:
+        try:
+            return len(PdfReader(ruta).pages)
+        except Exception as e:
+            logger.warning(f"pypdf no pudo leer {ruta}: {str(e)}")
+
+    paginas = 0
+    maximo_count = 0
+    resto = b""
+    with open(ruta, "rb") as f:
+        while True:
+            bloque = f.read(TAM_BLOQUE)
+            if not bloque:
+                break
+            datos = resto + bloque
+            # Se solapan los bloques para no partir un marcador por la mitad
+            corte = max(len(datos) - 256, 0)
+            paginas += sum(1 for m in PATRON_PAGINA.finditer(datos) if m.start() < corte)
+            for m in PATRON_COUNT.finditer(datos):
+                maximo_count = max(maximo_count, int(m.group(1) or m.group(2)))
+            resto = datos[corte:]
+    paginas += len(PATRON_PAGINA.findall(resto))
+    return paginas or maximo_count or None
+
+
+def generar_miniatura(ruta, mime, destino, tamano):
+    """
+    Escribe en `destino` un PNG de como mucho `tamano` px de lado. Los PDF
+    necesitan `pdftoppm` (poppler-utils) y las imágenes Pillow; si falta la
+    herramienta no hay miniatura. Devuelve True si se ha generado.
+    """
+    if mime == "application/pdf":
+        pdftoppm = shutil.which("pdftoppm")
+        if not pdftoppm:
+            return False
+        base = destino[:-4] if destino.endswith(".png") else destino
+        subprocess.run(
+            [pdftoppm, "-png", "-singlefile", "-f", "1", "-l", "1", "-scale-to", str(tamano), ruta, base],
+            check=True, timeout=60, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        )
+        return os.path.exists(base + ".png")
+
+    if mime.startswith("image/"):
+        try:
+            from PIL import Image
+        except ImportError:
+            return False
+        with Image.open(ruta) as imagen:
+            imagen.thumbnail((tamano, tamano))
+            if imagen.mode not in ("RGB", "RGBA", "L"):
+                imagen = imagen.convert("RGB")
+            imagen.save(destino, "PNG")
+        return True
+
+    return False
+
+
+def clave_miniatura(sha256):
+    return f"miniaturas/{sha256[:2]}/{sha256}.png"
+
+
+def encolar_analisis(sha256):
+    """ Encola el análisis de un blob recién guardado, si no está ya hecho. """
+    if db.session.query(Blob.mime).filter_by(sha256=sha256).scalar() is None:
+        encolar("analizar_blob", sha256)
+
+
+@tarea("analizar_blob")
+def analizar_blob(sha256):
+    """
+    Detecta el tipo real del contenido y, si no está permitido, borra los
+    documentos que lo usan (el alumno vuelve a verlo pendiente). Si está
+    permitido guarda el número de páginas de los PDF y una miniatura.
+    """
+    blob = db.session.get(Blob, sha256)
+    if blob is None or blob.mime is not None:
+        return
+
+    alm = almacenamiento()
+    ruta = alm.ruta_local(blob.ruta)
+    copia = None
+    directorio_tmp = os.path.join(current_app.config["UPLOAD_FOLDER"], ".tmp")
+    os.makedirs(directorio_tmp, exist_ok=True)
+
+    try:
+        if ruta is None:
+            # Backend remoto: se trabaja sobre una copia local temporal
+            fd, copia = tempfile.mkstemp(dir=directorio_tmp, prefix="analisis_")
+            with os.fdopen(fd, "wb") as destino:
+                origen = alm.abrir(blob.ruta)
+                try:
+                    shutil.copyfileobj(origen, destino, TAM_BLOQUE)
+                finally:
+                    origen.close()
+            ruta = copia
+
+        mime = detectar_mime(ruta)
+        if mime not in current_app.config["TIPOS_PERMITIDOS"]:
+            documentos = Documento.query.filter_by(sha256=sha256).all()
+            logger.warning(
+                f"Contenido rechazado ({mime}) en el blob {sha256}: "
+                f"se eliminan los documentos {[d.id for d in documentos]}"
+            )
+            for doc in documentos:
+                db.session.delete(doc)
+            return
+
+        blob.mime = mime
+        if mime == "application/pdf":
+            blob.paginas = contar_paginas_pdf(ruta)
+
+        fd, png = tempfile.mkstemp(dir=directorio_tmp, prefix="miniatura_", suffix=".png")
+        os.close(fd)
+        try:
+            if generar_miniatura(ruta, mime, png, current_app.config["TAM_MINIATURA"]):
+                clave = clave_miniatura(sha256)
+                alm.guardar(clave, png)
+                blob.miniatura = clave
+        except Exception as e:
+            logger.warning(f"No se pudo generar la miniatura de {sha256}: {str(e)}")
+        finally:
+            if os.path.exists(png):
+                os.remove(png)
+
+        # Blob no es hijo de Tabla: las vistas que lo muestran se versionan a mano
+        for doc in Documento.query.filter_by(sha256=sha256):
+            subir_version(doc.tabla_id)
+            publicar(doc.tabla_id, "documento_actualizado", {
+                "id": doc.id,
+                "alumno_id": str(doc.alumno_id) if doc.alumno_id else None,
+                "mime": blob.mime,
+                "paginas": blob.paginas,
+                "miniatura": bool(blob.miniatura)
+            })
+    finally:
+        if copia and os.path.exists(copia):
+            os.remove(copia)
@@ -4,18 +4,31 @@ from dotenv import load_dotenv
 from pathlib import Path
 import os
 import logging
-from database import db
+from sqlalchemy.engine import make_url
+from werkzeug.middleware.proxy_fix import ProxyFix
+from database import db, init_db
+import auth
+import almacenamiento
+import trabajos
+import eventos
+import versiones
+import metricas
+import perfiles
+import limite_login
+import reconciliacion
 from models import db, Administrador, Alumno, Tabla, Documento
 from routes.admin_routes import admin_bp
 from routes.alumno_routes import alumno_bp
+from subidas import parsear_tamano, parsear_limites
+from analisis_archivos import parsear_tipos, TIPOS_PERMITIDOS_POR_DEFECTO
 
 def create_app():
     load_dotenv(dotenv_path=Path(__file__).resolve().parent / ".env")
 
     uri = os.getenv("SQLALCHEMY_DATABASE_URI")
-    print("📦 URI desde .env:", uri)
 
     app = Flask(__name__)
+    app.logger.info(f"📦 Base de datos: {make_url(uri).render_as_string(hide_password=True) if uri else None}")
     frontend_url = os.getenv("FRONTEND_URL", "https://proyecto-academia.vercel.app")
 
     # Configurar CORS si es necesario más adelante
@@ -24,6 +37,22 @@ def create_app():
     basedir = os.path.abspath(os.path.dirname(__file__))
     app.config['SQLALCHEMY_DATABASE_URI'] = uri
     app.config['UPLOAD_FOLDER'] = os.path.join(basedir, 'uploads')
+    # Límite duro del cuerpo de cualquier petición y límites por tipo de documento
+    app.config['MAX_CONTENT_LENGTH'] = parsear_tamano(os.getenv("MAX_CONTENT_LENGTH", "50M"))
+    app.config['MAX_TAMANO_DOCUMENTO'] = parsear_tamano(os.getenv("MAX_TAMANO_DOCUMENTO", "20M"))
+    app.config['LIMITES_DOCUMENTO'] = parsear_limites(os.getenv("LIMITES_DOCUMENTO", ""))
+    # Tipos reales (según el contenido, no la extensión) que se aceptan como documento
+    app.config['TIPOS_PERMITIDOS'] = parsear_tipos(os.getenv("TIPOS_PERMITIDOS", TIPOS_PERMITIDOS_POR_DEFECTO))
+    app.config['TAM_MINIATURA'] = int(os.getenv("TAM_MINIATURA", "256"))
+    # "x-accel" (nginx) o "x-sendfile" (Apache) para que el proxy envíe los archivos;
+    # con nginx, X_ACCEL_PREFIJO es una location `internal` con alias a UPLOAD_FOLDER
+    app.config['ENVIO_ARCHIVOS'] = os.getenv("ENVIO_ARCHIVOS", "").lower()
+    app.config['X_ACCEL_PREFIJO'] = os.getenv("X_ACCEL_PREFIJO", "/_archivos/")
+    # Proxies delante de la app (nginx, balanceador): su X-Forwarded-For da la
+    # IP real del cliente, que es la que cuenta para el límite de login
+    proxies = int(os.getenv("PROXIES", "0"))
+    if proxies:
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=proxies, x_proto=proxies)
     app.secret_key = "supersecreto"
     app.config.update(
         SESSION_COOKIE_SAMESITE="None",
@@ -31,7 +60,16 @@ def create_app():
         SESSION_COOKIE_HTTPONLY=False
     )
 
-    db.init_app(app)
+    # Desactiva TRACK_MODIFICATIONS y configura el pool (DB_POOL_*)
+    init_db(app)
+    auth.init_app(app)
+    almacenamiento.init_app(app)
+    trabajos.init_app(app)
+    eventos.init_app(app)
+    metricas.init_app(app)
+    perfiles.init_app(app)
+    limite_login.init_app(app)
+    reconciliacion.init_app(app)
 
     # Registro de blueprints
     app.register_blueprint(admin_bp)
@@ -0,0 +1,257 @@
+"""
+Punto de entrada ASGI para servir la app con muchas conexiones lentas:
+
+    uvicorn asgi:app --host 0.0.0.0 --port 5001 --workers 4
+
+Con gunicorn en modo sync cada subida o descarga lenta ocupa un worker
+entero. Aquí el bucle de eventos recibe el cuerpo de la petición sin ocupar
+ningún hilo y la app Flask corre después en un pool de ASGI_HILOS hilos. Las
+respuestas se piden trozo a trozo, así que un hilo no espera a que un
+cliente lento lea, y los archivos locales los envía el propio adaptador
+(ver ENVIRON_ENVIO_ASGI en almacenamiento.py).
+
+Las conexiones SSE (/events) esperan eventos en su propio pool de
+ASGI_HILOS_SSE hilos para no dejar sin hilos al resto de peticiones. Cada
+hilo puede tener una conexión a la base de datos: conviene que el pool de
+SQLAlchemy admita ASGI_HILOS conexiones por proceso.
+"""
+import asyncio
+import contextvars
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from tempfile import SpooledTemporaryFile
+from urllib.parse import unquote
+
+from app import create_app
+from almacenamiento import ENVIRON_ENVIO_ASGI, CABECERA_ENVIO_ASGI, TAM_BLOQUE
+from subidas import ArchivoDemasiadoGrande
+
+# Hasta este tamaño el cuerpo de la petición se queda en memoria; más, a disco
+TAM_CUERPO_EN_MEMORIA = 1024 * 1024
+_FIN = object()
+
+
+class PeticionDemasiadoGrande(Exception):
+    pass
+
+
+class AdaptadorAsgi:
+    """ Sirve una app WSGI como app ASGI con un pool de hilos propio. """
+
+    def __init__(self, app_wsgi, hilos=32, hilos_sse=256, max_cuerpo=None, directorio_tmp=None):
+        self.app_wsgi = app_wsgi
+        self.max_cuerpo = max_cuerpo
+        self.directorio_tmp = directorio_tmp
+        self.pool = ThreadPoolExecutor(max_workers=hilos, thread_name_prefix="asgi")
+        self.pool_sse = ThreadPoolExecutor(max_workers=hilos_sse, thread_name_prefix="asgi-sse")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            return await self._ciclo_de_vida(receive, send)
+        if scope["type"] != "http":
+            return
+
+        try:
+            cuerpo = await self._leer_cuerpo(scope, receive)
+        except PeticionDemasiadoGrande:
+            return await self._responder_413(send)
+        if cuerpo is None:
+            return  # El cliente se fue antes de terminar de enviar
+
+        try:
+            await self._atender(scope, receive, send, cuerpo)
+        finally:
+            cuerpo.close()
+
+    async def _ciclo_de_vida(self, receive, send):
+        while True:
+            mensaje = await receive()
+            if mensaje["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif mensaje["type"] == "lifespan.shutdown":
+                self.pool.shutdown(wait=False)
+                self.pool_sse.shutdown(wait=False)
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def _leer_cuerpo(self, scope, receive):
+        """
+        Recibe el cuerpo entero en el bucle de eventos, sin ocupar un hilo
+        mientras el cliente sube despacio. Corta en cuanto supera max_cuerpo.
+        """
+        declarado = next((v for k, v in scope.get("headers", []) if k == b"content-length"), None)
+        if self.max_cuerpo and declarado and declarado.isdigit() and int(declarado) > self.max_cuerpo:
+            raise PeticionDemasiadoGrande()
+
+        cuerpo = SpooledTemporaryFile(max_size=TAM_CUERPO_EN_MEMORIA, dir=self.directorio_tmp)
+        recibidos = 0
+        try:
+            while True:
+                mensaje = await receive()
+                if mensaje["type"] == "http.disconnect":
+                    cuerpo.close()
+                    return None
+                trozo = mensaje.get("body", b"")
+                recibidos += len(trozo)
+                if self.max_cuerpo and recibidos > self.max_cuerpo:
+                    raise PeticionDemasiadoGrande()
+                cuerpo.write(trozo)
+                if not mensaje.get("more_body"):
+                    break
+        except BaseException:
+            cuerpo.close()
+            raise
+
+        cuerpo.seek(0)
+        return cuerpo
+
+    async def _responder_413(self, send):
+        mensaje = f'{{"error": "{ArchivoDemasiadoGrande(self.max_cuerpo)}"}}'.encode("utf-8")
+        await send({
+            "type": "http.response.start",
+            "status": 413,
+            "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(mensaje)).encode()),
+                        (b"connection", b"close")]
+        })
+        await send({"type": "http.response.body", "body": mensaje})
+
+    async def _atender(self, scope, receive, send, cuerpo):
+        loop = asyncio.get_running_loop()
+        # Todas las llamadas de una petición comparten contexto: Flask guarda
+        # su contexto en contextvars y los generadores lo usan entre trozos
+        contexto = contextvars.copy_context()
+
+        pool = self.pool
+
+        def en_hilo(funcion, *args):
+            return loop.run_in_executor(pool, contexto.run, funcion, *args)
+
+        inicio = {}
+
+        def start_response(status, cabeceras, exc_info=None):
+            if exc_info and inicio.get("enviado"):
+                raise exc_info[1].with_traceback(exc_info[2])
+            inicio.update(status=int(status.split(" ", 1)[0]), cabeceras=cabeceras)
+            return _escritura_no_soportada
+
+        desconectado = asyncio.Event()
+
+        async def vigilar_desconexion():
+            while (await receive())["type"] != "http.disconnect":
+                pass
+            desconectado.set()
+
+        vigilante = asyncio.ensure_future(vigilar_desconexion())
+        respuesta = None
+        try:
+            respuesta = await en_hilo(self.app_wsgi, construir_environ(scope, cuerpo), start_response)
+            iterador = iter(respuesta)
+            # start_response puede llegar con el primer trozo
+            trozo = await en_hilo(next, iterador, _FIN)
+
+            archivo = None
+            cabeceras = []
+            for nombre, valor in inicio["cabeceras"]:
+                if nombre.lower() == CABECERA_ENVIO_ASGI.lower():
+                    archivo = valor
+                    continue
+                if nombre.lower() == "content-type" and valor.startswith("text/event-stream"):
+                    pool = self.pool_sse
+                cabeceras.append((nombre.lower().encode("latin-1"), valor.encode("latin-1")))
+
+            inicio["enviado"] = True
+            await send({"type": "http.response.start", "status": inicio["status"], "headers": cabeceras})
+
+            if archivo is not None:
+                if scope["method"] != "HEAD":
+                    await self._enviar_archivo(archivo, send, en_hilo, desconectado)
+            else:
+                while trozo is not _FIN and not desconectado.is_set():
+                    if trozo:
+                        await send({"type": "http.response.body", "body": trozo, "more_body": True})
+                    trozo = await en_hilo(next, iterador, _FIN)
+
+            await send({"type": "http.response.body", "body": b""})
+        finally:
+            vigilante.cancel()
+            if respuesta is not None and hasattr(respuesta, "close"):
+                # Cierra generadores y ejecuta los teardown de Flask
+                await en_hilo(respuesta.close)
+
+    async def _enviar_archivo(self, valor, send, en_hilo, desconectado):
+        inicio, fin, ruta = valor.split(":", 2)
+        restantes = int(fin) - int(inicio) + 1
+        archivo = await en_hilo(open, unquote(ruta), "rb")
+        try:
+            await en_hilo(archivo.seek, int(inicio))
+            while restantes > 0 and not desconectado.is_set():
+                # Solo la lectura usa un hilo; la espera al cliente, no
+                bloque = await en_hilo(archivo.read, min(TAM_BLOQUE, restantes))
+                if not bloque:
+                    break
+                restantes -= len(bloque)
+                await send({"type": "http.response.body", "body": bloque, "more_body": True})
+        finally:
+            await en_hilo(archivo.close)
+
+
+def _escritura_no_soportada(datos):
+    raise NotImplementedError("write() de WSGI no está soportado")
+
+
+def construir_environ(scope, cuerpo):
+    """ environ WSGI (PEP 3333) para un scope HTTP de ASGI. """
+    raiz = scope.get("root_path", "")
+    ruta = scope["path"]
+    if raiz and ruta.startswith(raiz):
+        ruta = ruta[len(raiz):]
+
+    cuerpo.seek(0, os.SEEK_END)
+    longitud = cuerpo.tell()
+    cuerpo.seek(0)
+
+    servidor = scope.get("server") or ("localhost", 80)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": raiz.encode("utf-8").decode("latin-1"),
+        "PATH_INFO": ruta.encode("utf-8").decode("latin-1"),
+        "QUERY_STRING": scope.get("query_string", b"").decode("latin-1"),
+        "SERVER_PROTOCOL": f"HTTP/{scope.get('http_version', '1.1')}",
+        "SERVER_NAME": servidor[0],
+        "SERVER_PORT": str(servidor[1]),
+        "CONTENT_LENGTH": str(longitud),
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": cuerpo,
+        "wsgi.input_terminated": True,
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": True,
+        "wsgi.run_once": False,
+        ENVIRON_ENVIO_ASGI: True,
+    }
+    if scope.get("client"):
+        environ["REMOTE_ADDR"] = scope["client"][0]
+
+    for nombre, valor in scope.get("headers", []):
+        nombre = nombre.decode("latin-1").upper().replace("-", "_")
+        valor = valor.decode("latin-1")
+        if nombre == "CONTENT_LENGTH":
+            continue
+        clave = "CONTENT_TYPE" if nombre == "CONTENT_TYPE" else f"HTTP_{nombre}"
+        environ[clave] = f"{environ[clave]},{valor}" if clave in environ else valor
+    return environ
+
+
+flask_app = create_app()
+_directorio_tmp = os.path.join(flask_app.config["UPLOAD_FOLDER"], ".tmp")
+os.makedirs(_directorio_tmp, exist_ok=True)
+
+app = AdaptadorAsgi(
+    flask_app,
+    hilos=int(os.getenv("ASGI_HILOS", "32")),
+    hilos_sse=int(os.getenv("ASGI_HILOS_SSE", "256")),
+    max_cuerpo=flask_app.config.get("MAX_CONTENT_LENGTH"),
+    directorio_tmp=_directorio_tmp
+)
@@ -1,9 +1,86 @@
 import jwt
 from flask import request, jsonify
 from functools import wraps
+import hashlib
 import os
+import threading
+import time
+from collections import OrderedDict
+
+ALGORITMO = "HS256"
+
+# Los tokens sin `exp` también se cachean, pero como mucho este tiempo
+TTL_MAXIMO_CACHE = 300
+MAX_TOKENS_CACHE = 4096
+
+SECRET_KEY = None
+
+_cache_tokens = OrderedDict()
+_lock = threading.Lock()
+
+
+def init_app(app):
+    """
+    Lee la clave JWT una sola vez al arrancar (después de cargar el .env).
+    """
+    global SECRET_KEY
+    SECRET_KEY = os.getenv("JWT_SECRET_KEY")
+    app.config["JWT_SECRET_KEY"] = SECRET_KEY
+    limpiar_cache_tokens()
+
+
+def _clave():
+    global SECRET_KEY
+    if SECRET_KEY is None:
+        SECRET_KEY = os.getenv("JWT_SECRET_KEY")
+    return SECRET_KEY
+
+
+def firmar_token(payload):
+    return jwt.encode(payload, _clave(), algorithm=ALGORITMO)
+
+
+def verificar_token(token):
+    """
+    Devuelve el payload de un token válido. Los tokens ya verificados se
+    guardan (por su SHA-256, nunca en claro) hasta su `exp`, así que las
+    peticiones repetidas con el mismo token no vuelven a calcular el HMAC.
+    Lanza las mismas excepciones que jwt.decode.
+    """
+    digest = hashlib.sha256(token.encode()).digest()
+    ahora = time.time()
+
+    with _lock:
+        entrada = _cache_tokens.get(digest)
+        if entrada:
+            payload, caduca, exp = entrada
+            if exp is not None and exp <= ahora:
+                del _cache_tokens[digest]
+                raise jwt.ExpiredSignatureError("Signature has expired")
+            if caduca > ahora:
+                _cache_tokens.move_to_end(digest)
+                return dict(payload)
+            del _cache_tokens[digest]
+
+    payload = jwt.decode(token, _clave(), algorithms=[ALGORITMO])
+
+    exp = payload.get("exp")
+    caduca = ahora + TTL_MAXIMO_CACHE
+    if exp is not None:
+        caduca = min(caduca, exp)
+
+    with _lock:
+        _cache_tokens[digest] = (payload, caduca, exp)
+        while len(_cache_tokens) > MAX_TOKENS_CACHE:
+            _cache_tokens.popitem(last=False)
+
+    return dict(payload)
+
+
+def limpiar_cache_tokens():
+    with _lock:
+        _cache_tokens.clear()
 
-SECRET_KEY = os.getenv("JWT_SECRET_KEY")
 
 def token_requerido(f):
     @wraps(f)
@@ -18,7 +95,7 @@ def token_requerido(f):
             return jsonify({'error': 'Token requerido'}), 401
 
         try:
-            datos = jwt.decode(token, SECRET_KEY, algorithms=["HS256"])
+            datos = verificar_token(token)
             request.usuario_jwt = datos['usuario']
             request.es_superadmin = datos.get('es_superadmin', False)
         except jwt.ExpiredSignatureError:
@@ -0,0 +1,182 @@
+"""
+Prueba de carga de conexiones lentas: abre muchas subidas (o descargas) que
+van a pocos bytes por segundo, como un móvil con mala cobertura, y mientras
+siguen abiertas mide la latencia de peticiones rápidas. Sirve para comparar
+el despliegue sync con el ASGI (asgi.py) en la misma máquina:
+
+    gunicorn -w 4 -b 127.0.0.1:5001 'app:create_app()'
+    uvicorn asgi:app --host 127.0.0.1 --port 5002 --workers 4
+
+    python benchmark_carga.py --url http://127.0.0.1:5001 --lentas 100
+    python benchmark_carga.py --url http://127.0.0.1:5002 --lentas 100
+    python benchmark_carga.py --url http://127.0.0.1:5002 --tipo descarga \\
+        --ruta "/api/admin/documento/7/ver?token=..." --lentas 100
+
+Con --tipo subida se envía un multipart a --ruta (por defecto un alumno
+inventado: basta para ocupar al servidor mientras llega el cuerpo, porque
+Flask solo lo mira cuando lo tiene entero). Sin más dependencias que asyncio.
+"""
+import argparse
+import asyncio
+import socket
+import statistics
+import time
+from urllib.parse import urlsplit
+
+FRONTERA = "----benchmarkcarga"
+
+
+def cuerpo_subida(tamano):
+    cabecera = (
+        f"--{FRONTERA}\r\n"
+        'Content-Disposition: form-data; name="nombre_documento"\r\n\r\nDNI\r\n'
+        f"--{FRONTERA}\r\n"
+        'Content-Disposition: form-data; name="archivo"; filename="prueba.pdf"\r\n'
+        "Content-Type: application/pdf\r\n\r\n"
+    ).encode()
+    cierre = f"\r\n--{FRONTERA}--\r\n".encode()
+    relleno = max(tamano - len(cabecera) - len(cierre), 0)
+    return cabecera + b"%PDF-1.4\n" + b"0" * max(relleno - 9, 0) + cierre
+
+
+async def conectar(url, limite=2 ** 16):
+    partes = urlsplit(url)
+    lector, escritor = await asyncio.open_connection(partes.hostname, partes.port or 80, limit=limite)
+    sock = escritor.get_extra_info("socket")
+    if sock is not None and limite < 2 ** 16:
+        # Buffer de recepción pequeño: el servidor nota de verdad al cliente lento
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, limite)
+    return lector, escritor, partes.hostname
+
+
+async def subida_lenta(url, ruta, cabeceras, tamano, velocidad, hasta, resultado):
+    try:
+        lector, escritor, host = await conectar(url)
+    except OSError:
+        resultado["fallidas"] += 1
+        return
+    resultado["abiertas"] += 1
+    cuerpo = cuerpo_subida(tamano)
+    escritor.write((
+        f"POST {ruta} HTTP/1.1\r\nHost: {host}\r\n{cabeceras}"
+        f"Content-Type: multipart/form-data; boundary={FRONTERA}\r\n"
+        f"Content-Length: {len(cuerpo)}\r\nConnection: close\r\n\r\n"
+    ).encode())
+    paso = max(velocidad // 10, 1)
+    enviados = 0
+    try:
+        while time.monotonic() < hasta and enviados < len(cuerpo):
+            escritor.write(cuerpo[enviados:enviados + paso])
+            await escritor.drain()
+            enviados += paso
+            await asyncio.sleep(0.1)
+        if enviados >= len(cuerpo):
+            await lector.read()
+            resultado["completadas"] += 1
+    except OSError:
+        resultado["cortadas"] += 1
+    finally:
+        escritor.close()
+
+
+async def descarga_lenta(url, ruta, cabeceras, velocidad, hasta, resultado):
+    paso = max(velocidad // 10, 1)
+    try:
+        lector, escritor, host = await conectar(url, limite=max(paso, 1024))
+    except OSError:
+        resultado["fallidas"] += 1
+        return
+    resultado["abiertas"] += 1
+    escritor.write(f"GET {ruta} HTTP/1.1\r\nHost: {host}\r\n{cabeceras}Connection: close\r\n\r\n".encode())
+    try:
+        while time.monotonic() < hasta:
+            if not await lector.read(paso):
+                resultado["completadas"] += 1
+                break
+            await asyncio.sleep(0.1)
+    except OSError:
+        resultado["cortadas"] += 1
+    finally:
+        escritor.close()
+
+
+async def sonda(url, ruta, hasta, timeout, latencias, resultado):
+    while time.monotonic() < hasta:
+        inicio = time.perf_counter()
+        try:
+            lector, escritor, host = await asyncio.wait_for(conectar(url), timeout)
+            escritor.write(f"GET {ruta} HTTP/1.1\r\nHost: {host}\r\nConnection: close\r\n\r\n".encode())
+            await asyncio.wait_for(lector.read(), timeout)
+            escritor.close()
+            latencias.append(time.perf_counter() - inicio)
+        except (asyncio.TimeoutError, OSError):
+            resultado["sondas_sin_respuesta"] += 1
+        await asyncio.sleep(0.05)
+
+
+async def ejecutar(args):
+    cabeceras = "".join(f"{c}\r\n" for c in args.cabecera or [])
+    resultado = {
+        "abiertas": 0, "fallidas": 0, "completadas": 0, "cortadas": 0, "sondas_sin_respuesta": 0
+    }
+    latencias = []
+
+    # Primero se ocupan las conexiones lentas y luego se mide
+    hasta = time.monotonic() + args.segundos + 2
+    if args.tipo == "subida":
+        ruta = args.ruta or "/api/alumno/00000000-0000-0000-0000-000000000000/subir"
+        lentas = [
+            subida_lenta(args.url, ruta, cabeceras, args.tamano, args.velocidad, hasta, resultado)
+            for _ in range(args.lentas)
+        ]
+    else:
+        if not args.ruta:
+            raise SystemExit("--tipo descarga necesita --ruta de un documento existente")
+        lentas = [
+            descarga_lenta(args.url, args.ruta, cabeceras, args.velocidad, hasta, resultado)
+            for _ in range(args.lentas)
+        ]
+    tareas = [asyncio.ensure_future(t) for t in lentas]
+    await asyncio.sleep(2)
+
+    fin_sondas = time.monotonic() + args.segundos
+    await asyncio.gather(*[
+        sonda(args.url, args.sonda, fin_sondas, args.timeout, latencias, resultado)
+        for _ in range(args.sondas)
+    ])
+    await asyncio.gather(*tareas)
+    return resultado, latencias
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Prueba de carga con conexiones lentas")
+    parser.add_argument("--url", default="http://127.0.0.1:5001", help="Servidor a probar")
+    parser.add_argument("--tipo", choices=("subida", "descarga"), default="subida")
+    parser.add_argument("--ruta", help="Ruta de la subida o descarga lenta")
+    parser.add_argument("--cabecera", action="append", help='Cabecera extra, p. ej. "Authorization: Bearer ..."')
+    parser.add_argument("--lentas", type=int, default=50, help="Conexiones lentas simultáneas")
+    parser.add_argument("--velocidad", type=int, default=2048, help="Bytes por segundo de cada conexión lenta")
+    parser.add_argument("--tamano", type=int, default=1024 * 1024, help="Tamaño de cada subida lenta")
+    parser.add_argument("--sonda", default="/", help="Ruta rápida cuya latencia se mide")
+    parser.add_argument("--sondas", type=int, default=4, help="Clientes rápidos en paralelo")
+    parser.add_argument("--segundos", type=float, default=10.0, help="Duración de la medida")
+    parser.add_argument("--timeout", type=float, default=5.0, help="Tiempo máximo de una petición rápida")
+    args = parser.parse_args()
+
+    resultado, latencias = asyncio.run(ejecutar(args))
+
+    print(f"⚙️ {args.url}: {args.lentas} {args.tipo}s lentas a {args.velocidad} B/s")
+    print(f"   conexiones lentas abiertas: {resultado['abiertas']}  fallidas: {resultado['fallidas']}  "
+          f"cortadas por el servidor: {resultado['cortadas']}  terminadas: {resultado['completadas']}")
+    if latencias:
+        latencias.sort()
+        p95 = latencias[min(int(len(latencias) * 0.95), len(latencias) - 1)]
+        print(f"   peticiones rápidas: {len(latencias)} ok, {resultado['sondas_sin_respuesta']} sin respuesta en "
+              f"{args.timeout:g}s | p50 {statistics.median(latencias) * 1000:.1f} ms  "
+              f"p95 {p95 * 1000:.1f} ms  máx {latencias[-1] * 1000:.1f} ms")
+    else:
+        print(f"   peticiones rápidas: ninguna respondida ({resultado['sondas_sin_respuesta']} sin respuesta)")
+
+
+if __name__ == "__main__":
+    main()
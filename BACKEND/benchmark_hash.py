@@ -0,0 +1,56 @@
+"""
+Mide cuántos hashes de contraseña por segundo da esta máquina con cada
+método, para elegir PASSWORD_HASH_METODO según la latencia de login y de
+alta masiva que queramos.
+
+    python benchmark_hash.py
+    python benchmark_hash.py --metodo scrypt:16384:8:1 --metodo pbkdf2:sha256:600000 --segundos 5
+"""
+import argparse
+import time
+
+from werkzeug.security import generate_password_hash, check_password_hash
+
+import passwords
+
+METODOS_POR_DEFECTO = [
+    "scrypt:32768:8:1",
+    "scrypt:16384:8:1",
+    "pbkdf2:sha256:600000",
+    "pbkdf2:sha256:260000",
+]
+
+
+def medir(metodo, segundos):
+    n = 0
+    inicio = time.perf_counter()
+    ultimo = None
+    while time.perf_counter() - inicio < segundos:
+        ultimo = generate_password_hash("ContraseñaDePrueba123", method=metodo, salt_length=passwords.LONGITUD_SALT)
+        n += 1
+    duracion = time.perf_counter() - inicio
+
+    t = time.perf_counter()
+    check_password_hash(ultimo, "ContraseñaDePrueba123")
+    verificacion = time.perf_counter() - t
+
+    return n / duracion, verificacion
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de hashing de contraseñas")
+    parser.add_argument("--metodo", action="append", help="Método de werkzeug a medir (se puede repetir)")
+    parser.add_argument("--segundos", type=float, default=2.0, help="Tiempo de medida por método")
+    args = parser.parse_args()
+
+    metodos = args.metodo or [passwords.prefijo_actual()] + METODOS_POR_DEFECTO
+
+    print(f"⚙️ Método configurado (PASSWORD_HASH_METODO): {passwords.prefijo_actual()}")
+    print(f"{'método':<28} {'hashes/s':>10} {'ms/login':>10}")
+    for metodo in dict.fromkeys(metodos):
+        por_segundo, verificacion = medir(metodo, args.segundos)
+        print(f"{metodo:<28} {por_segundo:>10.1f} {verificacion * 1000:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
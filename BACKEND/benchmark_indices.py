@@ -0,0 +1,132 @@
+"""
+Siembra un conjunto sintético de tablas, alumnos y documentos y mide la
+latencia de las consultas de Documento que usan api_subir_documentos y
+api_documentos_alumno, primero sin índices y después con los declarados en
+models.py.
+
+    python benchmark_indices.py                      # SQLite temporal
+    python benchmark_indices.py --uri postgresql://.../bench --documentos 500000
+
+Usa siempre una base de datos de pruebas: el script borra y recrea el esquema.
+"""
+import argparse
+import os
+import random
+import statistics
+import tempfile
+import time
+import uuid
+
+from sqlalchemy import create_engine, select
+
+from models import db, Tabla, Alumno, Documento, Administrador, estado_enum
+
+DOCS_REQUERIDOS = ["DNI", "Foto", "Matrícula", "Título", "Certificado"]
+
+
+def sembrar(engine, n_tablas, n_documentos):
+    alumnos_por_tabla = max(1, n_documentos // (n_tablas * len(DOCS_REQUERIDOS)))
+    muestras = []
+
+    with engine.begin() as conn:
+        conn.execute(Administrador.__table__.insert(), [{"nombre": "Bench", "usuario": "bench"}])
+        conn.execute(Tabla.__table__.insert(), [
+            {"id": t, "nombre": f"Tabla {t}", "admin_id": 1} for t in range(1, n_tablas + 1)
+        ])
+
+        for t in range(1, n_tablas + 1):
+            alumnos = [uuid.uuid4() for _ in range(alumnos_por_tabla)]
+            conn.execute(Alumno.__table__.insert(), [
+                {"id": a, "nombre": "N", "apellidos": "A", "password_hash": "-",
+                 "tabla_id": t, "credencial": a.hex}
+                for a in alumnos
+            ])
+
+            documentos = [
+                {"nombre": d, "tabla_id": t, "alumno_id": None, "estado": "pendiente",
+                 "nombre_archivo": None}
+                for d in DOCS_REQUERIDOS
+            ]
+            for a in alumnos:
+                for d in DOCS_REQUERIDOS:
+                    documentos.append({
+                        "nombre": d, "tabla_id": t, "alumno_id": a, "estado": "subido",
+                        "nombre_archivo": f"{a.hex}_{d}", "ruta": f"uploads/{t}/{a}/{d}.pdf"
+                    })
+            conn.execute(Documento.__table__.insert(), documentos)
+            muestras.append((t, random.choice(alumnos)))
+
+    return alumnos_por_tabla * n_tablas * len(DOCS_REQUERIDOS), muestras
+
+
+def medir(engine, muestras, repeticiones):
+    doc = Documento.__table__.c
+    tiempos = {"subido (tabla, alumno, nombre)": [], "requeridos (tabla, alumno IS NULL)": []}
+
+    with engine.connect() as conn:
+        for _ in range(repeticiones):
+            for tabla_id, alumno_id in muestras:
+                nombre = random.choice(DOCS_REQUERIDOS)
+
+                t = time.perf_counter()
+                conn.execute(select(Documento.__table__).where(
+                    doc.tabla_id == tabla_id, doc.alumno_id == alumno_id, doc.nombre == nombre
+                )).all()
+                tiempos["subido (tabla, alumno, nombre)"].append(time.perf_counter() - t)
+
+                t = time.perf_counter()
+                conn.execute(select(Documento.__table__).where(
+                    doc.tabla_id == tabla_id, doc.alumno_id.is_(None)
+                )).all()
+                tiempos["requeridos (tabla, alumno IS NULL)"].append(time.perf_counter() - t)
+
+    return {k: (statistics.median(v) * 1000, max(v) * 1000) for k, v in tiempos.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de índices de Documento")
+    parser.add_argument("--uri", help="Base de datos de pruebas (por defecto, SQLite temporal)")
+    parser.add_argument("--tablas", type=int, default=200)
+    parser.add_argument("--documentos", type=int, default=200000)
+    parser.add_argument("--repeticiones", type=int, default=3)
+    args = parser.parse_args()
+
+    uri = args.uri or "sqlite:///" + os.path.join(tempfile.mkdtemp(), "bench.db")
+    engine = create_engine(uri)
+
+    if engine.dialect.name == "postgresql":
+        estado_enum.create(engine, checkfirst=True)
+    db.metadata.drop_all(engine)
+    db.metadata.create_all(engine)
+
+    indices = list(Alumno.__table__.indexes) + list(Documento.__table__.indexes)
+    for indice in indices:
+        indice.drop(bind=engine)
+
+    print(f"🌱 Sembrando {args.tablas} tablas en {engine.url.render_as_string(hide_password=True)}...")
+    total, muestras = sembrar(engine, args.tablas, args.documentos)
+    print(f"🌱 {total} documentos subidos")
+
+    with engine.begin() as conn:
+        if engine.dialect.name == "postgresql":
+            conn.exec_driver_sql("ANALYZE")
+
+    antes = medir(engine, muestras, args.repeticiones)
+
+    for indice in indices:
+        indice.create(bind=engine)
+    with engine.begin() as conn:
+        conn.exec_driver_sql("ANALYZE")
+
+    despues = medir(engine, muestras, args.repeticiones)
+
+    print(f"{'consulta':<36} {'sin índices (ms)':>18} {'con índices (ms)':>18}")
+    for consulta in antes:
+        a_med, a_max = antes[consulta]
+        d_med, d_max = despues[consulta]
+        print(f"{consulta:<36} {a_med:>9.3f} / {a_max:<7.2f} {d_med:>9.3f} / {d_max:<7.2f}")
+    print("(mediana / máximo)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+"""
+Benchmark de humo del despliegue WSGI: arranca gunicorn con
+gunicorn.conf.py para cada número de workers pedido, lanza peticiones
+concurrentes durante unos segundos y muestra peticiones por segundo en
+total y por worker. Usa el .env y la base de datos configurados.
+
+    python benchmark_wsgi.py
+    python benchmark_wsgi.py --workers 1 --workers 2 --workers 4 --threads 4 \\
+        --ruta /api/admin/tablas --cabecera "Authorization: Bearer ..."
+"""
+import argparse
+import http.client
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+
+def puerto_libre():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def esperar_servidor(puerto, segundos=30):
+    limite = time.monotonic() + segundos
+    while time.monotonic() < limite:
+        try:
+            socket.create_connection(("127.0.0.1", puerto), timeout=1).close()
+            return True
+        except OSError:
+            time.sleep(0.2)
+    return False
+
+
+def cargar(puerto, ruta, cabeceras, clientes, segundos):
+    """ `clientes` hilos con conexión keep-alive; devuelve (ok, errores, latencias). """
+    hasta = time.monotonic() + segundos
+    ok = [0] * clientes
+    errores = [0] * clientes
+    latencias = [[] for _ in range(clientes)]
+
+    def cliente(i):
+        conexion = http.client.HTTPConnection("127.0.0.1", puerto, timeout=10)
+        while time.monotonic() < hasta:
+            inicio = time.perf_counter()
+            try:
+                conexion.request("GET", ruta, headers=cabeceras)
+                respuesta = conexion.getresponse()
+                respuesta.read()
+                if respuesta.status >= 500:
+                    errores[i] += 1
+                else:
+                    ok[i] += 1
+                latencias[i].append(time.perf_counter() - inicio)
+            except (OSError, http.client.HTTPException):
+                errores[i] += 1
+                conexion.close()
+                conexion = http.client.HTTPConnection("127.0.0.1", puerto, timeout=10)
+        conexion.close()
+
+    hilos = [threading.Thread(target=cliente, args=(i,)) for i in range(clientes)]
+    for h in hilos:
+        h.start()
+    for h in hilos:
+        h.join()
+    return sum(ok), sum(errores), sorted(l for lista in latencias for l in lista)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de peticiones/s por worker de gunicorn")
+    parser.add_argument("--workers", type=int, action="append", help="Workers a probar (se puede repetir)")
+    parser.add_argument("--threads", type=int, default=int(os.getenv("GUNICORN_THREADS", "4")))
+    parser.add_argument("--ruta", default="/api/alumno/00000000-0000-0000-0000-000000000000/documentos",
+                        help="Ruta a pedir (por defecto una que responde 401 sin token)")
+    parser.add_argument("--cabecera", action="append", help='Cabecera extra, p. ej. "Authorization: Bearer ..."')
+    parser.add_argument("--clientes", type=int, default=16, help="Clientes concurrentes")
+    parser.add_argument("--segundos", type=float, default=5.0)
+    args = parser.parse_args()
+
+    cabeceras = dict(c.split(":", 1) for c in args.cabecera or [])
+    cabeceras = {k.strip(): v.strip() for k, v in cabeceras.items()}
+    directorio = os.path.dirname(os.path.abspath(__file__))
+
+    print(f"⚙️ {args.ruta} | {args.clientes} clientes | {args.threads} hilos por worker")
+    print(f"{'workers':>7} {'pet/s':>9} {'pet/s/worker':>13} {'p50 ms':>8} {'p95 ms':>8} {'errores':>8}")
+    for workers in args.workers or [1, 2]:
+        puerto = puerto_libre()
+        entorno = {
+            **os.environ,
+            "GUNICORN_BIND": f"127.0.0.1:{puerto}",
+            "GUNICORN_WORKERS": str(workers),
+            "GUNICORN_THREADS": str(args.threads),
+            "GUNICORN_ACCESSLOG": "",
+            # Sin reciclar workers a mitad de medida
+            "GUNICORN_MAX_REQUESTS": "0",
+            "LOG_LEVEL": "warning",
+        }
+        servidor = subprocess.Popen(
+            [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "wsgi:app"],
+            cwd=directorio, env=entorno, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        )
+        try:
+            if not esperar_servidor(puerto):
+                print(f"{workers:>7} gunicorn no arrancó")
+                continue
+            # Calentamiento: imports perezosos, conexiones del pool
+            cargar(puerto, args.ruta, cabeceras, args.clientes, 1)
+            ok, errores, latencias = cargar(puerto, args.ruta, cabeceras, args.clientes, args.segundos)
+            por_segundo = ok / args.segundos
+            p50 = latencias[len(latencias) // 2] * 1000 if latencias else 0
+            p95 = latencias[int(len(latencias) * 0.95)] * 1000 if latencias else 0
+            print(f"{workers:>7} {por_segundo:>9.0f} {por_segundo / workers:>13.0f} {p50:>8.1f} {p95:>8.1f} {errores:>8}")
+        finally:
+            servidor.terminate()
+            servidor.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,243 @@
+import heapq
+import threading
+import uuid
+from array import array
+
+from sqlalchemy import event, func, select, tuple_, update
+
+from models import db, Alumno, Tabla
+from utils import normalizar
+
+LIMITE_BUSQUEDA = 100
+LOTE_RELLENO = 1000
+
+
+def nombre_busqueda(nombre, apellidos):
+    """ Lo que se guarda en Alumno.nombre_busqueda: sin tildes, en minúsculas y con espacios simples. """
+    return " ".join(normalizar(f"{nombre or ''} {apellidos or ''}").split())
+
+
+def palabras_busqueda(q):
+    return nombre_busqueda(q, "").split()
+
+
+def _ngramas(texto):
+    """ Bigramas y trigramas: los bigramas sirven para las palabras de dos letras. """
+    return {texto[i:i + n] for n in (2, 3) for i in range(len(texto) - n + 1)}
+
+
+def _ngramas_consulta(palabra):
+    if len(palabra) < 3:
+        return {palabra} if len(palabra) == 2 else set()
+    return {palabra[i:i + 3] for i in range(len(palabra) - 2)}
+
+
+class IndiceNgramas:
+    """
+    Índice de n-gramas en memoria para buscar alumnos en SQLite, que no
+    tiene pg_trgm. Guarda por cada bigrama y trigrama las posiciones de los
+    alumnos que lo contienen (array de enteros, no conjuntos, para que
+    100.000 alumnos ocupen pocos MB). Una búsqueda recorre solo la lista del
+    n-grama menos frecuente de la consulta y comprueba el texto de cada
+    candidato.
+
+    Se mantiene al día con Tabla.version, que sube con cualquier cambio de
+    los alumnos de la tabla, se haga en este proceso o en otro worker: antes
+    de cada búsqueda sincronizar() recarga los alumnos de las tablas cuya
+    versión no es la que tiene el índice (todas, la primera vez).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()  # estructuras del índice
+        self._lock_carga = threading.Lock()  # una sola sincronización a la vez
+        self._entradas = []  # posición -> (nombre_busqueda, id, tabla_id) o None si se quitó
+        self._posiciones = {}  # id del alumno -> posición
+        self._listas = {}  # n-grama -> array de posiciones
+        self._por_tabla = {}  # tabla_id -> ids de sus alumnos
+        self._versiones = {}  # tabla_id -> versión cargada
+
+    def sincronizar(self):
+        with self._lock_carga:
+            versiones = dict(db.session.execute(select(Tabla.id, func.coalesce(Tabla.version, 0))).all())
+            cambiadas = [t for t, v in versiones.items() if self._versiones.get(t) != v]
+            borradas = [t for t in self._versiones if t not in versiones]
+            if not cambiadas and not borradas:
+                return
+
+            # Las versiones se leen antes que los alumnos: un commit que llegue
+            # mientras se cargan sube la versión y se recoge en la siguiente
+            consulta = select(Alumno.id, Alumno.nombre, Alumno.apellidos, Alumno.nombre_busqueda, Alumno.tabla_id)
+            if len(cambiadas) == len(versiones):
+                filas = db.session.execute(consulta.execution_options(yield_per=LOTE_RELLENO)).all()
+            else:
+                filas = []
+                for i in range(0, len(cambiadas), LOTE_RELLENO):
+                    filas.extend(db.session.execute(
+                        consulta.where(Alumno.tabla_id.in_(cambiadas[i:i + LOTE_RELLENO]))
+                    ))
+
+            with self._lock:
+                for tabla_id in borradas:
+                    for alumno_id in self._por_tabla.pop(tabla_id, set()):
+                        self._quitar(alumno_id)
+                vigentes = {f.id for f in filas}
+                for tabla_id in cambiadas:
+                    for alumno_id in self._por_tabla.get(tabla_id, set()) - vigentes:
+                        self._quitar(alumno_id)
+                for f in filas:
+                    self._añadir(f.id, f.nombre_busqueda or nombre_busqueda(f.nombre, f.apellidos), f.tabla_id)
+                self._versiones = versiones
+                # Cada cambio de nombre deja un hueco; si hay más huecos que alumnos se rehace
+                if len(self._entradas) > 2 * len(self._posiciones) + LOTE_RELLENO:
+                    self._compactar()
+
+    def _añadir(self, alumno_id, texto, tabla_id):
+        posicion = self._posiciones.get(alumno_id)
+        if posicion is not None and self._entradas[posicion] == (texto, str(alumno_id), tabla_id):
+            return
+        self._quitar(alumno_id)
+        posicion = len(self._entradas)
+        self._entradas.append((texto, str(alumno_id), tabla_id))
+        self._posiciones[alumno_id] = posicion
+        self._por_tabla.setdefault(tabla_id, set()).add(alumno_id)
+        for ngrama in _ngramas(texto):
+            lista = self._listas.get(ngrama)
+            if lista is None:
+                lista = self._listas[ngrama] = array("I")
+            lista.append(posicion)
+
+    def _quitar(self, alumno_id):
+        # Queda un hueco en las listas; se salta al buscar
+        posicion = self._posiciones.pop(alumno_id, None)
+        if posicion is not None:
+            self._por_tabla.get(self._entradas[posicion][2], set()).discard(alumno_id)
+            self._entradas[posicion] = None
+
+    def _compactar(self):
+        vivos = [(alumno_id, self._entradas[p]) for alumno_id, p in self._posiciones.items()]
+        self._entradas, self._posiciones, self._listas, self._por_tabla = [], {}, {}, {}
+        for alumno_id, (texto, _, tabla_id) in vivos:
+            self._añadir(alumno_id, texto, tabla_id)
+
+    def quitar(self, alumno_ids):
+        """ Alumnos que ya no están en la base de datos (borrados después de sincronizar). """
+        with self._lock:
+            for alumno_id in alumno_ids:
+                self._quitar(alumno_id)
+
+    def buscar(self, palabras, tablas=None, after=None, limit=LIMITE_BUSQUEDA):
+        """
+        Ids de los alumnos cuyo nombre contiene todas las palabras, en orden
+        (nombre_busqueda, id) y a partir del cursor `after`, que es ese mismo
+        par. `tablas` limita a esos tabla_id (None: todas).
+        """
+        self.sincronizar()
+        with self._lock:
+            listas = [self._listas.get(n, ()) for p in palabras for n in _ngramas_consulta(p)]
+            if listas:
+                candidatos = (self._entradas[i] for i in min(listas, key=len))
+            else:
+                # Solo palabras de una letra: se recorre todo
+                candidatos = iter(self._entradas)
+            encontrados = (
+                (e[0], e[1]) for e in candidatos
+                if e is not None
+                and (tablas is None or e[2] in tablas)
+                and (after is None or (e[0], e[1]) > after)
+                and all(p in e[0] for p in palabras)
+            )
+            return [alumno_id for _, alumno_id in heapq.nsmallest(limit, encontrados)]
+
+
+indice_ngramas = IndiceNgramas()
+
+
+def buscar_alumnos(q, admin_id=None, after=None, limit=LIMITE_BUSQUEDA):
+    """
+    Alumnos cuyo nombre y apellidos contienen todas las palabras de `q`, sin
+    distinguir tildes ni mayúsculas. Con admin_id solo los de sus tablas.
+    Pagina por keyset con el id del último alumno devuelto (`after`).
+    """
+    palabras = palabras_busqueda(q)
+    if not palabras:
+        return []
+
+    cursor = None
+    if after is not None:
+        anterior = db.session.execute(
+            select(Alumno.nombre, Alumno.apellidos, Alumno.nombre_busqueda).where(Alumno.id == after)
+        ).first()
+        if anterior is None:
+            return []
+        cursor = (anterior.nombre_busqueda or nombre_busqueda(anterior.nombre, anterior.apellidos), after)
+
+    campos = select(
+        Alumno.id, Alumno.nombre, Alumno.apellidos, Alumno.email, Alumno.tabla_id,
+        Tabla.nombre.label("tabla_nombre"), Alumno.nombre_busqueda
+    ).join(Tabla, Tabla.id == Alumno.tabla_id)
+
+    if db.session.get_bind().dialect.name == "sqlite":
+        tablas = None
+        if admin_id is not None:
+            tablas = set(db.session.execute(select(Tabla.id).where(Tabla.admin_id == admin_id)).scalars())
+        if cursor is not None:
+            cursor = (cursor[0], str(cursor[1]))
+        ids = indice_ngramas.buscar(palabras, tablas, cursor, limit)
+        if not ids:
+            return []
+        filas = db.session.execute(campos.where(Alumno.id.in_([uuid.UUID(i) for i in ids]))).all()
+        # Alumnos borrados entre la sincronización y esta consulta
+        encontrados = {str(f.id) for f in filas}
+        if len(encontrados) < len(ids):
+            indice_ngramas.quitar([uuid.UUID(i) for i in ids if i not in encontrados])
+        orden = {i: n for n, i in enumerate(ids)}
+        filas.sort(key=lambda f: orden[str(f.id)])
+    else:
+        # PostgreSQL: el índice GIN de trigramas resuelve los LIKE '%...%'
+        consulta = campos
+        for palabra in palabras:
+            escapada = palabra.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+            consulta = consulta.where(Alumno.nombre_busqueda.like(f"%{escapada}%", escape="\\"))
+        if admin_id is not None:
+            consulta = consulta.where(Tabla.admin_id == admin_id)
+        if cursor is not None:
+            consulta = consulta.where(tuple_(Alumno.nombre_busqueda, Alumno.id) > cursor)
+        filas = db.session.execute(consulta.order_by(Alumno.nombre_busqueda, Alumno.id).limit(limit)).all()
+
+    return [{
+        "id": str(f.id),
+        "nombre": f.nombre,
+        "apellidos": f.apellidos,
+        "email": f.email,
+        "tabla_id": f.tabla_id,
+        "tabla_nombre": f.tabla_nombre,
+    } for f in filas]
+
+
+def rellenar_nombres_busqueda():
+    """ Calcula nombre_busqueda de los alumnos que aún no lo tienen, por lotes. Devuelve cuántos. """
+    total = 0
+    while True:
+        filas = db.session.execute(
+            select(Alumno.id, Alumno.nombre, Alumno.apellidos)
+            .where(Alumno.nombre_busqueda.is_(None))
+            .limit(LOTE_RELLENO)
+        ).all()
+        if not filas:
+            return total
+        for f in filas:
+            db.session.execute(
+                update(Alumno.__table__)
+                .where(Alumno.__table__.c.id == f.id)
+                .values(nombre_busqueda=nombre_busqueda(f.nombre, f.apellidos))
+            )
+        db.session.commit()
+        total += len(filas)
+
+
+# nombre_busqueda se calcula al guardar. Los INSERT en bloque (importación
+# de alumnos) no pasan por aquí: lo rellenan ellos.
+@event.listens_for(Alumno, "before_insert")
+@event.listens_for(Alumno, "before_update")
+def _calcular_nombre_busqueda(mapper, connection, alumno):
+    alumno.nombre_busqueda = nombre_busqueda(alumno.nombre, alumno.apellidos)
@@ -0,0 +1,100 @@
+import os
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session, object_session
+
+from models import Administrador
+
+# Lo que los endpoints necesitan del admin autenticado. Es inmutable y no
+# está ligado a ninguna sesión de SQLAlchemy, así que se puede compartir
+# entre peticiones sin problemas de instancias "detached".
+AdminActual = namedtuple("AdminActual", ["id", "nombre", "usuario", "es_superadmin"])
+
+
+class CacheAdmins:
+    """
+    Caché LRU con TTL de administradores resueltos, por id. Es local al
+    proceso: cada worker de gunicorn tiene la suya.
+    """
+
+    def __init__(self, ttl=60, max_entradas=1024):
+        self.ttl = ttl
+        self.max_entradas = max_entradas
+        self._datos = OrderedDict()
+        self._lock = threading.Lock()
+        self.aciertos = 0
+        self.fallos = 0
+
+    def obtener(self, admin_id):
+        ahora = time.monotonic()
+        with self._lock:
+            entrada = self._datos.get(admin_id)
+            if entrada and entrada[1] > ahora:
+                self._datos.move_to_end(admin_id)
+                self.aciertos += 1
+                return entrada[0]
+            self.fallos += 1
+
+        admin = Administrador.query.get(admin_id)
+        if not admin:
+            return None
+
+        principal = AdminActual(admin.id, admin.nombre, admin.usuario, bool(admin.es_superadmin))
+        with self._lock:
+            self._datos[admin_id] = (principal, ahora + self.ttl)
+            self._datos.move_to_end(admin_id)
+            while len(self._datos) > self.max_entradas:
+                self._datos.popitem(last=False)
+        return principal
+
+    def invalidar(self, admin_id):
+        with self._lock:
+            self._datos.pop(admin_id, None)
+
+    def limpiar(self):
+        with self._lock:
+            self._datos.clear()
+
+    def estadisticas(self):
+        with self._lock:
+            return {
+                "entradas": len(self._datos),
+                "aciertos": self.aciertos,
+                "fallos": self.fallos,
+                "ttl": self.ttl,
+                "max_entradas": self.max_entradas
+            }
+
+
+cache_admins = CacheAdmins(
+    ttl=int(os.getenv("ADMIN_CACHE_TTL", "60")),
+    max_entradas=int(os.getenv("ADMIN_CACHE_MAX", "1024"))
+)
+
+
+# Cualquier cambio o borrado de un Administrador (contraseña, permisos,
+# api_eliminar_admin...) lo saca de la caché, pero solo cuando el commit ha
+# ido bien; si se invalidara antes, otra petición podría volver a cachear la
+# fila antigua antes de que el cambio fuera visible.
+def _marcar_admin(mapper, connection, admin):
+    sesion = object_session(admin)
+    if sesion is not None:
+        sesion.info.setdefault("admins_modificados", set()).add(admin.id)
+
+
+event.listen(Administrador, "after_update", _marcar_admin)
+event.listen(Administrador, "after_delete", _marcar_admin)
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidar_tras_commit(sesion):
+    for admin_id in sesion.info.pop("admins_modificados", ()):
+        cache_admins.invalidar(admin_id)
+
+
+@event.listens_for(Session, "after_rollback")
+def _descartar_tras_rollback(sesion):
+    sesion.info.pop("admins_modificados", None)
@@ -0,0 +1,143 @@
+from sqlalchemy import select, func, and_
+from sqlalchemy.orm import selectinload, aliased
+from models import db, Tabla, Alumno, Documento
+
+CAMPOS_TABLA = ("id", "nombre", "alumnos", "documentos", "subidos")
+CAMPOS_RESUMEN = (
+    "id", "nombre", "alumnos", "documentos_requeridos",
+    "documentos_subidos", "documentos_pendientes"
+)
+
+
+def query_tablas_completas(campos=None):
+    """
+    Query de Tabla que trae en bloque sus alumnos, todos sus documentos y el
+    análisis de sus archivos. Cuesta siempre 4 consultas (tablas, alumnos,
+    documentos, blobs), da igual cuántas tablas, alumnos o documentos haya.
+    Con `campos` solo se cargan las relaciones que esos campos necesitan.
+    """
+    campos = set(campos or CAMPOS_TABLA)
+    opciones = []
+    if campos & {"alumnos", "subidos"}:
+        opciones.append(selectinload(Tabla.alumnos))
+    if "subidos" in campos:
+        opciones.append(selectinload(Tabla.documentos).selectinload(Documento.blob))
+    elif "documentos" in campos:
+        opciones.append(selectinload(Tabla.documentos))
+    return Tabla.query.options(*opciones)
+
+
+def serializar_tabla(tabla, campos=None):
+    """
+    Convierte una Tabla cargada con query_tablas_completas() en el dict que
+    devuelven las vistas de tabla. No lanza consultas extra: el nombre del
+    alumno de cada documento subido se busca entre los alumnos ya cargados.
+    Con `campos` solo se incluyen (y solo se recorren) esos campos.
+    """
+    campos = set(campos or CAMPOS_TABLA)
+    resultado = {}
+    if "id" in campos:
+        resultado["id"] = tabla.id
+    if "nombre" in campos:
+        resultado["nombre"] = tabla.nombre
+
+    if "alumnos" in campos:
+        resultado["alumnos"] = [
+            {"id": a.id, "nombre": a.nombre, "apellidos": a.apellidos}
+            for a in tabla.alumnos
+        ]
+
+    if "documentos" in campos:
+        resultado["documentos"] = [
+            {"id": d.id, "nombre": d.nombre}
+            for d in tabla.documentos if d.alumno_id is None
+        ]
+
+    if "subidos" in campos:
+        alumnos_por_id = {a.id: a for a in tabla.alumnos}
+        subidos = []
+        for d in tabla.documentos:
+            if d.alumno_id is None:
+                continue
+
+            alumno = alumnos_por_id.get(d.alumno_id)
+            if alumno is None:
+                continue
+            subidos.append({
+                "id": d.id,
+                "nombre": d.nombre,
+                "alumno_id": alumno.id,
+                "alumno_nombre": f"{alumno.nombre} {alumno.apellidos}",
+                "estado": d.estado,
+                "mime": d.blob.mime if d.blob else None,
+                "paginas": d.blob.paginas if d.blob else None,
+                "miniatura": bool(d.blob and d.blob.miniatura)
+            })
+        resultado["subidos"] = subidos
+
+    return resultado
+
+
+def resumen_tablas(admin_id, after=None, limit=None):
+    """
+    Lista las tablas de un admin con sus contadores calculados en SQL, en una
+    sola consulta y sin cargar alumnos ni documentos. Pagina por keyset
+    (id > after), así que el coste no depende de cuántas tablas haya antes.
+    """
+    requerido = aliased(Documento)
+
+    n_alumnos = (
+        select(func.count(Alumno.id))
+        .where(Alumno.tabla_id == Tabla.id)
+        .correlate(Tabla)
+        .scalar_subquery()
+    )
+    n_requeridos = (
+        select(func.count(Documento.id))
+        .where(Documento.tabla_id == Tabla.id, Documento.alumno_id.is_(None))
+        .correlate(Tabla)
+        .scalar_subquery()
+    )
+    # Solo cuentan las subidas que corresponden a un documento requerido vigente
+    n_subidos = (
+        select(func.count(Documento.id))
+        .where(
+            Documento.tabla_id == Tabla.id,
+            Documento.alumno_id.isnot(None),
+            select(requerido.id).where(and_(
+                requerido.tabla_id == Documento.tabla_id,
+                requerido.alumno_id.is_(None),
+                requerido.nombre == Documento.nombre
+            )).exists()
+        )
+        .correlate(Tabla)
+        .scalar_subquery()
+    )
+
+    consulta = (
+        select(
+            Tabla.id, Tabla.nombre,
+            n_alumnos.label("alumnos"),
+            n_requeridos.label("requeridos"),
+            n_subidos.label("subidos")
+        )
+        .where(Tabla.admin_id == admin_id)
+        .order_by(Tabla.id)
+    )
+    if after is not None:
+        consulta = consulta.where(Tabla.id > after)
+    if limit is not None:
+        consulta = consulta.limit(limit)
+
+    resultado = []
+    for fila in db.session.execute(consulta):
+        pendientes = max(fila.alumnos * fila.requeridos - fila.subidos, 0)
+        resultado.append({
+            "id": fila.id,
+            "nombre": fila.nombre,
+            "alumnos": fila.alumnos,
+            "documentos_requeridos": fila.requeridos,
+            "documentos_subidos": fila.subidos,
+            "documentos_pendientes": pendientes
+        })
+    return resultado
@@ -5,7 +5,11 @@ import os
 load_dotenv(dotenv_path=Path(__file__).resolve().parent / ".env")
 
 from app import create_app
-from models import db, Administrador
+from models import db, Administrador, Blob
+from database import actualizar_esquema, actualizar_borrados_en_cascada
+from busqueda_alumnos import rellenar_nombres_busqueda
+from requisitos import preparar_documentos_requeridos
+from trabajos import encolar
 
 # Test de URI
 print("🧪 URI directa desde os.getenv:", os.getenv("SQLALCHEMY_DATABASE_URI"))
@@ -19,6 +23,29 @@ with app.app_context():
     db.create_all()
     print("✅ Tablas creadas correctamente en la base de datos REAL")
 
+    # Los requeridos repetidos impedirían crear su índice único
+    repetidos = preparar_documentos_requeridos()
+    if repetidos:
+        print(f"✅ Eliminados {repetidos} documentos requeridos repetidos")
+
+    # create_all no añade columnas ni índices nuevos a tablas que ya existían
+    actualizar_esquema()
+    print("✅ Columnas e índices comprobados")
+
+    cambiadas = actualizar_borrados_en_cascada()
+    if cambiadas:
+        print(f"✅ Claves ajenas con ON DELETE CASCADE en: {', '.join(cambiadas)}")
+
+    rellenados = rellenar_nombres_busqueda()
+    if rellenados:
+        print(f"✅ Nombres de búsqueda calculados para {rellenados} alumnos")
+
+    # Leer todos los archivos es lento: lo hace un worker en segundo plano
+    if db.session.query(Blob.sha256).filter(Blob.crc32.is_(None)).first():
+        encolar("rellenar_crc32", "")
+        db.session.commit()
+        print("✅ Encolado el cálculo del CRC-32 de los blobs existentes")
+
     # Crear superadmin si no existe
     usuario = os.getenv("SUPERADMIN_USUARIO")
     contrasena = os.getenv("SUPERADMIN_CONTRASENA")
@@ -1,8 +1,148 @@
+import os
+import sqlite3
+
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import DDL, event, inspect
+from sqlalchemy.engine import Engine
+from sqlalchemy.schema import AddConstraint
+from sqlalchemy.dialects import postgresql, sqlite
 from flask import Flask
 
 db = SQLAlchemy()
 
+# El índice de trigramas de la búsqueda de alumnos necesita pg_trgm antes del create_all
+event.listen(
+    db.metadata, "before_create",
+    DDL("CREATE EXTENSION IF NOT EXISTS pg_trgm").execute_if(dialect="postgresql")
+)
+
+@event.listens_for(Engine, "connect")
+def _claves_ajenas_sqlite(conexion, registro):
+    # SQLite no aplica las claves ajenas (ni sus ON DELETE CASCADE) si no se pide
+    if isinstance(conexion, sqlite3.Connection):
+        conexion.execute("PRAGMA foreign_keys=ON")
+
+
+def opciones_engine(uri):
+    """
+    Opciones del pool de conexiones desde el entorno. Cada hilo de cada
+    worker puede tener una conexión abierta: DB_POOL_SIZE + DB_MAX_OVERFLOW
+    debe cubrir los hilos por worker, y workers * (ese total) no pasar del
+    max_connections de PostgreSQL.
+    """
+    opciones = {
+        "pool_pre_ping": os.getenv("DB_POOL_PRE_PING", "1") == "1",
+        "pool_recycle": int(os.getenv("DB_POOL_RECYCLE", "1800")),
+    }
+    if not uri or uri == "sqlite://" or ":memory:" in uri:
+        # SQLite en memoria usa un pool de una conexión por hilo sin tamaño
+        return opciones
+    opciones.update(
+        pool_size=int(os.getenv("DB_POOL_SIZE", "5")),
+        max_overflow=int(os.getenv("DB_MAX_OVERFLOW", "10")),
+        pool_timeout=int(os.getenv("DB_POOL_TIMEOUT", "30")),
+    )
+    return opciones
+
+
 def init_db(app: Flask):
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config.setdefault(
+        'SQLALCHEMY_ENGINE_OPTIONS', opciones_engine(app.config.get('SQLALCHEMY_DATABASE_URI'))
+    )
     db.init_app(app)
+
+
+def insert_con_conflictos(bind):
+    """
+    Devuelve el insert() del dialecto, que admite on_conflict_do_nothing /
+    on_conflict_do_update. Solo PostgreSQL (producción) y SQLite (desarrollo).
+    """
+    dialecto = bind.dialect.name
+    if dialecto == "postgresql":
+        return postgresql.insert
+    if dialecto == "sqlite":
+        return sqlite.insert
+    raise RuntimeError(f"INSERT ... ON CONFLICT no soportado en {dialecto}")
+
+
+def actualizar_esquema():
+    """
+    Añade a las tablas existentes las columnas e índices que create_all no
+    crea por sí solo. Es idempotente; las columnas nuevas deben ser nullable.
+    """
+    inspector = inspect(db.engine)
+    with db.engine.begin() as conn:
+        if db.engine.dialect.name == "postgresql":
+            # Índice de trigramas de la búsqueda de alumnos
+            conn.exec_driver_sql("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        for tabla in db.metadata.sorted_tables:
+            if not inspector.has_table(tabla.name):
+                continue
+            existentes = {c["name"] for c in inspector.get_columns(tabla.name)}
+            for columna in tabla.columns:
+                if columna.name not in existentes:
+                    tipo = columna.type.compile(dialect=db.engine.dialect)
+                    conn.exec_driver_sql(f'ALTER TABLE {tabla.name} ADD COLUMN {columna.name} {tipo}')
+
+    for tabla in db.metadata.sorted_tables:
+        for indice in tabla.indexes:
+            indice.create(bind=db.engine, checkfirst=True)
+
+
+def _ondelete(fk):
+    return (fk or {}).get("options", {}).get("ondelete", "").upper()
+
+
+def actualizar_borrados_en_cascada():
+    """
+    Pasa a ON DELETE CASCADE las claves ajenas que lo declaran en models.py
+    y aún no lo tienen en la base de datos (creada antes). PostgreSQL rehace
+    la restricción; SQLite no puede alterarla y se reconstruye la tabla
+    copiando sus filas. Devuelve los nombres de las tablas cambiadas.
+    """
+    inspector = inspect(db.engine)
+    cambiadas = []
+    for tabla in db.metadata.sorted_tables:
+        if not inspector.has_table(tabla.name):
+            continue
+        existentes = {tuple(fk["constrained_columns"]): fk for fk in inspector.get_foreign_keys(tabla.name)}
+        pendientes = [
+            fk for fk in tabla.foreign_key_constraints
+            if fk.ondelete and _ondelete(existentes.get(tuple(fk.column_keys))) != fk.ondelete.upper()
+        ]
+        if not pendientes:
+            continue
+
+        if db.engine.dialect.name == "postgresql":
+            with db.engine.begin() as conn:
+                for fk in pendientes:
+                    actual = existentes.get(tuple(fk.column_keys))
+                    if actual and actual.get("name"):
+                        conn.exec_driver_sql(f'ALTER TABLE {tabla.name} DROP CONSTRAINT "{actual["name"]}"')
+                    conn.execute(AddConstraint(fk))
+        else:
+            _reconstruir_tabla_sqlite(tabla, inspector)
+        cambiadas.append(tabla.name)
+    return cambiadas
+
+
+def _reconstruir_tabla_sqlite(tabla, inspector):
+    columnas = ", ".join(
+        f'"{c["name"]}"' for c in inspector.get_columns(tabla.name) if c["name"] in tabla.c
+    )
+    antigua = f"{tabla.name}_antigua"
+    with db.engine.connect() as conn:
+        # Sin claves ajenas mientras tanto, y sin que el RENAME cambie las
+        # referencias de las otras tablas a la antigua
+        conn.exec_driver_sql("PRAGMA foreign_keys=OFF")
+        conn.exec_driver_sql("PRAGMA legacy_alter_table=ON")
+        for indice in inspector.get_indexes(tabla.name):
+            conn.exec_driver_sql(f'DROP INDEX IF EXISTS "{indice["name"]}"')
+        conn.exec_driver_sql(f'ALTER TABLE "{tabla.name}" RENAME TO "{antigua}"')
+        tabla.create(conn)
+        conn.exec_driver_sql(f'INSERT INTO "{tabla.name}" ({columnas}) SELECT {columnas} FROM "{antigua}"')
+        conn.exec_driver_sql(f'DROP TABLE "{antigua}"')
+        conn.commit()
+        conn.exec_driver_sql("PRAGMA legacy_alter_table=OFF")
+        conn.exec_driver_sql("PRAGMA foreign_keys=ON")
@@ -2,6 +2,8 @@ from functools import wraps
 from flask import request, jsonify, g 
 import jwt
 from models import Administrador, Alumno
+from cache_admins import cache_admins
+from auth import verificar_token
 import os
 
 # JWT para ADMIN
@@ -16,12 +18,12 @@ def token_required(f):
             return jsonify({'error': 'Token requerido'}), 403
 
         try:
-            data = jwt.decode(token, os.getenv("JWT_SECRET_KEY"), algorithms=["HS256"])
+            data = verificar_token(token)
             admin_id = data.get("id")
             if not admin_id:
                 return jsonify({'error': 'ID no presente en token'}), 403
 
-            current_admin = Administrador.query.get(admin_id)
+            current_admin = cache_admins.obtener(admin_id)
             if not current_admin:
                 return jsonify({'error': 'Admin no encontrado'}), 403
 
@@ -44,7 +46,7 @@ def superadmin_token_required(f):
             return jsonify({'error': 'Token requerido'}), 403
 
         try:
-            data = jwt.decode(token, os.getenv("JWT_SECRET_KEY"), algorithms=["HS256"])
+            data = verificar_token(token)
             if not data.get("es_superadmin"):
                 raise Exception("No eres superadmin")
         except Exception as e:
@@ -66,7 +68,7 @@ def alumno_token_required(f):
             return jsonify({'error': 'Token requerido'}), 403
 
         try:
-            data = jwt.decode(token, os.getenv("JWT_SECRET_KEY"), algorithms=["HS256"])
+            data = verificar_token(token)
             alumno_id_token = str(data.get("alumno_id"))
             alumno_id_url = str(kwargs.get("alumno_id"))
 
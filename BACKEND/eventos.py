@@ -0,0 +1,240 @@
+import json
+import logging
+import os
+import queue
+import select
+import threading
+import time
+
+from sqlalchemy import event, text
+from sqlalchemy.orm import Session, object_session
+
+from models import db, Administrador, Alumno, Documento, Tabla
+
+logger = logging.getLogger(__name__)
+
+CANAL_POSTGRES = "eventos_tablas"
+# NOTIFY admite hasta 8000 bytes; un evento mayor se manda como "recargar"
+MAX_PAYLOAD_NOTIFY = 7500
+MAX_COLA_SUSCRIPCION = 256
+INTERVALO_PING = 15
+
+
+class Suscripcion:
+    """ Cola de eventos de una conexión SSE a una tabla. """
+
+    def __init__(self, tabla_id, filtro=None):
+        self.tabla_id = tabla_id
+        self.filtro = filtro
+        self.cola = queue.Queue(maxsize=MAX_COLA_SUSCRIPCION)
+        self.cerrada = False
+
+    def ofrecer(self, evento):
+        if self.filtro is not None and not self.filtro(evento):
+            return
+        try:
+            self.cola.put_nowait(evento)
+        except queue.Full:
+            # Cliente demasiado lento: se corta y al reconectar recarga la tabla
+            self.cerrada = True
+
+    def siguiente(self, timeout):
+        try:
+            return self.cola.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+class BusEventos:
+    """
+    Pub/sub en memoria por tabla. Los cambios se publican al hacer commit
+    (ver publicar()); con EVENTOS_BACKEND=postgres se reparten con
+    NOTIFY/LISTEN para que lleguen a las conexiones SSE de todos los workers.
+    """
+
+    def __init__(self):
+        self.modo = "local"
+        self._suscripciones = {}
+        self._lock = threading.Lock()
+        self._oyente_pid = None
+        self.enviados = 0
+
+    def suscribir(self, tabla_id, filtro=None):
+        if self.modo == "postgres":
+            self._arrancar_oyente()
+        suscripcion = Suscripcion(tabla_id, filtro)
+        with self._lock:
+            self._suscripciones.setdefault(tabla_id, set()).add(suscripcion)
+        return suscripcion
+
+    def cancelar(self, suscripcion):
+        with self._lock:
+            conjunto = self._suscripciones.get(suscripcion.tabla_id)
+            if conjunto is not None:
+                conjunto.discard(suscripcion)
+                if not conjunto:
+                    del self._suscripciones[suscripcion.tabla_id]
+
+    def entregar(self, evento):
+        """ Reparte un evento entre las suscripciones de este proceso. """
+        with self._lock:
+            suscripciones = list(self._suscripciones.get(evento["tabla_id"], ()))
+        for suscripcion in suscripciones:
+            suscripcion.ofrecer(evento)
+        self.enviados += len(suscripciones)
+
+    def emitir(self, eventos):
+        if self.modo != "postgres":
+            for evento in eventos:
+                self.entregar(evento)
+            return
+
+        with db.engine.begin() as conn:
+            for evento in eventos:
+                payload = json.dumps(evento, default=str)
+                if len(payload.encode("utf-8")) > MAX_PAYLOAD_NOTIFY:
+                    payload = json.dumps({"tabla_id": evento["tabla_id"], "tipo": "recargar", "datos": {}})
+                conn.execute(text("SELECT pg_notify(:canal, :payload)"), {"canal": CANAL_POSTGRES, "payload": payload})
+
+    def estadisticas(self):
+        with self._lock:
+            return {
+                "modo": self.modo,
+                "tablas": len(self._suscripciones),
+                "suscripciones": sum(len(s) for s in self._suscripciones.values()),
+                "enviados": self.enviados
+            }
+
+    def _arrancar_oyente(self):
+        if self._oyente_pid == os.getpid():
+            return
+        with self._lock:
+            if self._oyente_pid == os.getpid():
+                return
+            hilo = threading.Thread(target=self._escuchar, args=(db.engine,), name="eventos-listen", daemon=True)
+            hilo.start()
+            self._oyente_pid = os.getpid()
+
+    def _escuchar(self, engine):
+        # Conexión propia fuera del pool: queda dedicada a LISTEN mientras viva el proceso
+        while True:
+            try:
+                conexion = engine.raw_connection()
+                conexion.detach()
+                dbapi = conexion.driver_connection
+                dbapi.autocommit = True
+                with dbapi.cursor() as cursor:
+                    cursor.execute(f"LISTEN {CANAL_POSTGRES}")
+
+                while True:
+                    if select.select([dbapi], [], [], INTERVALO_PING) == ([], [], []):
+                        continue
+                    dbapi.poll()
+                    while dbapi.notifies:
+                        aviso = dbapi.notifies.pop(0)
+                        self.entregar(json.loads(aviso.payload))
+            except Exception as e:
+                logger.error(f"Error escuchando eventos en PostgreSQL: {str(e)}")
+                time.sleep(5)
+
+
+bus_eventos = BusEventos()
+
+
+def publicar(tabla_id, tipo, datos, sesion=None):
+    """
+    Deja un evento pendiente en la sesión; se emite solo si la transacción
+    hace commit, así nunca se anuncia un cambio que luego se deshizo.
+    """
+    sesion = sesion if sesion is not None else db.session()
+    sesion.info.setdefault("eventos_pendientes", []).append(
+        {"tabla_id": tabla_id, "tipo": tipo, "datos": datos}
+    )
+
+
+def flujo_sse(suscripcion):
+    """ Generador del cuerpo text/event-stream de una suscripción. """
+    try:
+        yield "retry: 3000\n\n"
+        while not suscripcion.cerrada:
+            evento = suscripcion.siguiente(INTERVALO_PING)
+            if evento is None:
+                # Comentario SSE: mantiene viva la conexión a través de proxies
+                yield ": ping\n\n"
+                continue
+            yield f"event: {evento['tipo']}\ndata: {json.dumps(evento['datos'], default=str)}\n\n"
+    finally:
+        bus_eventos.cancelar(suscripcion)
+
+
+def _datos_documento(doc):
+    datos = {"id": doc.id, "nombre": doc.nombre}
+    if doc.alumno_id is not None:
+        datos.update(alumno_id=str(doc.alumno_id), estado=doc.estado)
+    return datos
+
+
+@event.listens_for(Documento, "after_insert")
+def _documento_creado(mapper, connection, doc):
+    tipo = "documento_requerido_añadido" if doc.alumno_id is None else "documento_subido"
+    publicar(doc.tabla_id, tipo, _datos_documento(doc), object_session(doc))
+
+
+@event.listens_for(Documento, "after_update")
+def _documento_actualizado(mapper, connection, doc):
+    if doc.alumno_id is not None:
+        publicar(doc.tabla_id, "documento_actualizado", _datos_documento(doc), object_session(doc))
+
+
+@event.listens_for(Documento, "after_delete")
+def _documento_eliminado(mapper, connection, doc):
+    tipo = "documento_requerido_eliminado" if doc.alumno_id is None else "documento_eliminado"
+    publicar(doc.tabla_id, tipo, _datos_documento(doc), object_session(doc))
+
+
+@event.listens_for(Alumno, "after_insert")
+def _alumno_creado(mapper, connection, alumno):
+    publicar(alumno.tabla_id, "alumno_añadido", {
+        "id": str(alumno.id), "nombre": alumno.nombre, "apellidos": alumno.apellidos
+    }, object_session(alumno))
+
+
+@event.listens_for(Alumno, "after_delete")
+def _alumno_eliminado(mapper, connection, alumno):
+    publicar(alumno.tabla_id, "alumno_eliminado", {"id": str(alumno.id)}, object_session(alumno))
+
+
+@event.listens_for(Tabla, "after_delete")
+def _tabla_eliminada(mapper, connection, tabla):
+    publicar(tabla.id, "tabla_eliminada", {"id": tabla.id}, object_session(tabla))
+
+
+@event.listens_for(Administrador, "before_delete")
+def _tablas_de_admin_eliminadas(mapper, connection, admin):
+    # Sus tablas las borra la base de datos en cascada, sin pasar por el ORM
+    tablas = Tabla.__table__
+    for (tabla_id,) in connection.execute(tablas.select().with_only_columns(tablas.c.id).where(tablas.c.admin_id == admin.id)):
+        publicar(tabla_id, "tabla_eliminada", {"id": tabla_id}, object_session(admin))
+
+
+@event.listens_for(Session, "after_commit")
+def _emitir_tras_commit(sesion):
+    eventos = sesion.info.pop("eventos_pendientes", None)
+    if not eventos:
+        return
+    try:
+        bus_eventos.emitir(eventos)
+    except Exception as e:
+        logger.error(f"Error emitiendo eventos: {str(e)}")
+
+
+@event.listens_for(Session, "after_rollback")
+def _descartar_eventos(sesion):
+    sesion.info.pop("eventos_pendientes", None)
+
+
+def init_app(app):
+    modo = os.getenv("EVENTOS_BACKEND", "local").lower()
+    if modo not in ("local", "postgres"):
+        raise Exception(f"EVENTOS_BACKEND desconocido: {modo}")
+    bus_eventos.modo = modo
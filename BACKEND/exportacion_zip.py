@@ -0,0 +1,274 @@
+import hashlib
+import struct
+import time
+import zlib
+
+# Límites del formato ZIP clásico; por encima se usan los campos ZIP64
+LIMITE_32 = 0xFFFFFFFF
+LIMITE_16 = 0xFFFF
+
+TAM_BLOQUE = 64 * 1024
+
+# Bit 3: tamaños y CRC en el descriptor de datos. Bit 11: nombres en UTF-8
+FLAGS = 0x0008 | 0x0800
+VERSION_ZIP = 20
+VERSION_ZIP64 = 45
+
+
+class EntradaZip:
+    """
+    Un archivo que se incluirá en el ZIP con el nombre `nombre_zip`. El
+    tamaño y la fecha se conocen al construir la entrada para que el tamaño
+    total del ZIP se sepa antes de empezar a enviarlo; `abrir(inicio)`
+    devuelve el contenido desde el byte `inicio` (un objeto con read(n) y
+    close()). Con `crc32` (Blob.crc32) no hace falta leer el archivo para
+    escribir su descriptor y su entrada del directorio central.
+    """
+
+    def __init__(self, nombre_zip, tamano, mtime, abrir, crc32=None):
+        self.nombre_zip = nombre_zip
+        self.nombre_bytes = nombre_zip.encode("utf-8")
+        self.abrir = abrir
+        self.tamano = tamano
+        self.mtime = mtime
+        self.crc32 = crc32
+        self.zip64 = self.tamano >= LIMITE_32
+        self.offset = 0
+
+    def fecha_dos(self):
+        t = time.localtime(self.mtime)
+        if t.tm_year < 1980:
+            return 0, (1 << 5) | 1
+        hora = (t.tm_hour << 11) | (t.tm_min << 5) | (t.tm_sec // 2)
+        fecha = ((t.tm_year - 1980) << 9) | (t.tm_mon << 5) | t.tm_mday
+        return hora, fecha
+
+    def cabecera_local(self):
+        hora, fecha = self.fecha_dos()
+        if self.zip64:
+            extra = struct.pack("<HHQQ", 0x0001, 16, 0, 0)
+            tamanos = (LIMITE_32, LIMITE_32)
+            version = VERSION_ZIP64
+        else:
+            extra = b""
+            tamanos = (0, 0)
+            version = VERSION_ZIP
+        return struct.pack(
+            "<IHHHHHIIIHH", 0x04034B50, version, FLAGS, 0, hora, fecha,
+            0, tamanos[0], tamanos[1], len(self.nombre_bytes), len(extra)
+        ) + self.nombre_bytes + extra
+
+    def descriptor(self, crc):
+        if self.zip64:
+            return struct.pack("<IIQQ", 0x08074B50, crc, self.tamano, self.tamano)
+        return struct.pack("<IIII", 0x08074B50, crc, self.tamano, self.tamano)
+
+    def tamano_descriptor(self):
+        return 24 if self.zip64 else 16
+
+    def entrada_central(self, crc):
+        hora, fecha = self.fecha_dos()
+        extra_campos = []
+        tamano = self.tamano
+        offset = self.offset
+        if self.tamano >= LIMITE_32:
+            extra_campos += [self.tamano, self.tamano]
+            tamano = LIMITE_32
+        if self.offset >= LIMITE_32:
+            extra_campos.append(self.offset)
+            offset = LIMITE_32
+        extra = b""
+        if extra_campos:
+            extra = struct.pack("<HH", 0x0001, 8 * len(extra_campos))
+            extra += struct.pack("<" + "Q" * len(extra_campos), *extra_campos)
+        version = VERSION_ZIP64 if extra else VERSION_ZIP
+        return struct.pack(
+            "<IHHHHHHIIIHHHHHII", 0x02014B50, version, version, FLAGS, 0,
+            hora, fecha, crc, tamano, tamano, len(self.nombre_bytes),
+            len(extra), 0, 0, 0, 0, offset
+        ) + self.nombre_bytes + extra
+
+    def tamano_entrada_central(self):
+        campos = 0
+        if self.tamano >= LIMITE_32:
+            campos += 2
+        if self.offset >= LIMITE_32:
+            campos += 1
+        extra = 4 + 8 * campos if campos else 0
+        return 46 + len(self.nombre_bytes) + extra
+
+
+class ZipEnStreaming:
+    """
+    Genera un ZIP sin compresión (STORED) a partir de archivos guardados sin
+    tenerlo nunca entero en memoria. Como el contenido se guarda tal cual y
+    los tamaños se conocen de antemano, la longitud total y la posición de
+    cada byte son deterministas, lo que permite responder a peticiones Range.
+    """
+
+    def __init__(self, entradas, tam_bloque=TAM_BLOQUE):
+        self.entradas = list(entradas)
+        self.tam_bloque = tam_bloque
+
+        pos = 0
+        for e in self.entradas:
+            e.offset = pos
+            pos += len(e.cabecera_local()) + e.tamano + e.tamano_descriptor()
+        self.inicio_central = pos
+        self.tamano_central = sum(e.tamano_entrada_central() for e in self.entradas)
+        self.tamano_total = pos + self.tamano_central + len(self._fin_central())
+
+    @property
+    def etag(self):
+        h = hashlib.sha256()
+        for e in self.entradas:
+            h.update(e.nombre_bytes)
+            h.update(struct.pack("<Qd", e.tamano, e.mtime))
+        return h.hexdigest()[:32]
+
+    def _necesita_zip64(self):
+        return (
+            len(self.entradas) >= LIMITE_16
+            or self.inicio_central >= LIMITE_32
+            or self.tamano_central >= LIMITE_32
+        )
+
+    def _fin_central(self):
+        n = len(self.entradas)
+        if not self._necesita_zip64():
+            return struct.pack(
+                "<IHHHHIIH", 0x06054B50, 0, 0, n, n,
+                self.tamano_central, self.inicio_central, 0
+            )
+
+        fin_zip64 = struct.pack(
+            "<IQHHIIQQQQ", 0x06064B50, 44, VERSION_ZIP64, VERSION_ZIP64, 0, 0,
+            n, n, self.tamano_central, self.inicio_central
+        )
+        localizador = struct.pack(
+            "<IIQI", 0x07064B50, 0, self.inicio_central + self.tamano_central, 1
+        )
+        fin = struct.pack(
+            "<IHHHHIIH", 0x06054B50, 0, 0, min(n, LIMITE_16), min(n, LIMITE_16),
+            min(self.tamano_central, LIMITE_32), min(self.inicio_central, LIMITE_32), 0
+        )
+        return fin_zip64 + localizador + fin
+
+    def _leer_archivo(self, entrada, desde=0, hasta=None):
+        """ Bytes [desde, hasta) del archivo de `entrada`, en bloques. """
+        hasta = entrada.tamano if hasta is None else hasta
+        leidos = desde
+        f = entrada.abrir(desde)
+        try:
+            while leidos < hasta:
+                bloque = f.read(min(self.tam_bloque, hasta - leidos))
+                if not bloque:
+                    raise IOError(f"El archivo {entrada.nombre_zip} ha cambiado durante la exportación")
+                leidos += len(bloque)
+                yield bloque
+        finally:
+            f.close()
+
+    def _crc(self, entrada):
+        # Solo para archivos sin Blob.crc32 (anteriores a la columna) que no
+        # se han enviado enteros en esta petición
+        if entrada.crc32 is None:
+            crc = 0
+            for bloque in self._leer_archivo(entrada):
+                crc = zlib.crc32(bloque, crc)
+            entrada.crc32 = crc
+        return entrada.crc32
+
+    def generar(self, inicio=0, fin=None):
+        """
+        Devuelve los bytes [inicio, fin] (ambos incluidos) del ZIP en bloques
+        de como mucho `tam_bloque` bytes. Las entradas anteriores a `inicio`
+        no se abren y el primer archivo se lee desde donde empieza el rango,
+        así que reanudar una descarga no relee lo ya enviado.
+        """
+        if fin is None:
+            fin = self.tamano_total - 1
+
+        pos = 0
+
+        def recortar(datos):
+            # Devuelve la parte de `datos` (que empieza en `pos`) dentro del rango
+            a = max(inicio - pos, 0)
+            b = min(fin + 1 - pos, len(datos))
+            return datos[a:b] if a < b else b""
+
+        def en_rango(longitud):
+            return pos + longitud > inicio and pos <= fin
+
+        for e in self.entradas:
+            cabecera = e.cabecera_local()
+            if pos + len(cabecera) + e.tamano + e.tamano_descriptor() <= inicio:
+                pos += len(cabecera) + e.tamano + e.tamano_descriptor()
+                continue
+
+            trozo = recortar(cabecera)
+            if trozo:
+                yield trozo
+            pos += len(cabecera)
+
+            desde = max(inicio - pos, 0)
+            hasta = min(fin + 1 - pos, e.tamano)
+            if desde < hasta:
+                # Si se envía entero y no se conocía, el CRC sale de esta misma lectura
+                calcular = e.crc32 is None and desde == 0 and hasta == e.tamano
+                crc = 0
+                for bloque in self._leer_archivo(e, desde, hasta):
+                    if calcular:
+                        crc = zlib.crc32(bloque, crc)
+                    yield bloque
+                if calcular:
+                    e.crc32 = crc
+            pos += e.tamano
+
+            if en_rango(e.tamano_descriptor()):
+                yield recortar(e.descriptor(self._crc(e)))
+            pos += e.tamano_descriptor()
+
+            if pos > fin:
+                return
+
+        for e in self.entradas:
+            longitud = e.tamano_entrada_central()
+            if en_rango(longitud):
+                yield recortar(e.entrada_central(self._crc(e)))
+            pos += longitud
+
+        trozo = recortar(self._fin_central())
+        if trozo:
+            yield trozo
+
+
+def parsear_range(cabecera, total):
+    """
+    Interpreta una cabecera `Range: bytes=a-b` con un único rango.
+    Devuelve (inicio, fin), None si no hay rango, o lanza ValueError si el
+    rango no es satisfacible.
+    """
+    if not cabecera:
+        return None
+    unidad, _, valor = cabecera.partition("=")
+    if unidad.strip() != "bytes" or "," in valor:
+        return None
+
+    a, _, b = valor.strip().partition("-")
+    try:
+        if a == "":
+            sufijo = int(b)
+            if sufijo <= 0:
+                raise ValueError("Rango vacío")
+            inicio, fin = max(total - sufijo, 0), total - 1
+        else:
+            inicio = int(a)
+            fin = int(b) if b else total - 1
+    except ValueError:
+        raise ValueError("Rango inválido")
+
+    fin = min(fin, total - 1)
+    if inicio > fin or inicio >= total:
+        raise ValueError("Rango no satisfacible")
+    return inicio, fin
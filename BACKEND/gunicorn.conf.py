@@ -0,0 +1,72 @@
+"""
+Configuración de gunicorn (`gunicorn -c gunicorn.conf.py wsgi:app`), toda
+por entorno:
+
+    GUNICORN_BIND      dirección de escucha (por defecto 0.0.0.0:$PORT o :5001)
+    GUNICORN_WORKERS   procesos (por defecto 2 * CPUs + 1)
+    GUNICORN_THREADS   hilos por proceso; con más de 1 se usa el worker gthread
+    GUNICORN_TIMEOUT   segundos antes de matar un worker colgado
+    GUNICORN_PRELOAD   "1" para cargar la app antes de hacer fork
+
+Con varios workers, METRICAS_DIR hace que /metrics sume todos (ver
+metricas.py); se vacía al arrancar gunicorn, y la instantánea de cada
+worker que termina (max_requests los recicla) se suma a muertos.json.
+
+Los hilos comparten el pool de SQLAlchemy del proceso: DB_POOL_SIZE +
+DB_MAX_OVERFLOW (ver database.opciones_engine) debe ser al menos
+GUNICORN_THREADS.
+"""
+import multiprocessing
+import os
+
+from instantaneas_metricas import plegar_instantanea
+
+bind = os.getenv("GUNICORN_BIND", f"0.0.0.0:{os.getenv('PORT', '5001')}")
+workers = int(os.getenv("GUNICORN_WORKERS", multiprocessing.cpu_count() * 2 + 1))
+threads = int(os.getenv("GUNICORN_THREADS", "4"))
+worker_class = "gthread" if threads > 1 else "sync"
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "60"))
+graceful_timeout = 30
+keepalive = 5
+
+# Reciclar workers de vez en cuando acota cualquier fuga de memoria
+max_requests = int(os.getenv("GUNICORN_MAX_REQUESTS", "2000"))
+max_requests_jitter = max_requests // 10
+
+preload_app = os.getenv("GUNICORN_PRELOAD", "0") == "1"
+
+accesslog = os.getenv("GUNICORN_ACCESSLOG", "-") or None
+errorlog = "-"
+loglevel = os.getenv("LOG_LEVEL", "info").lower()
+
+
+def on_starting(server):
+    # Instantáneas de métricas de un arranque anterior: no deben sumarse
+    directorio = os.getenv("METRICAS_DIR")
+    if directorio and os.path.isdir(directorio):
+        for nombre in os.listdir(directorio):
+            if nombre.endswith(".json"):
+                os.remove(os.path.join(directorio, nombre))
+
+
+def post_fork(server, worker):
+    # Con preload_app el engine se creó en el maestro: cada worker abre sus
+    # propias conexiones en vez de heredar los sockets del padre
+    if preload_app:
+        from wsgi import app
+        from database import db
+        with app.app_context():
+            db.engine.dispose(close=False)
+
+
+def worker_exit(server, worker):
+    # Lo último que contó el worker, que solo escribe una instantánea por segundo
+    from metricas import metricas
+    metricas.guardar_instantanea(forzar=True)
+
+
+def child_exit(server, worker):
+    # En el maestro: un archivo menos que leer en cada scrape
+    directorio = os.getenv("METRICAS_DIR")
+    if directorio:
+        plegar_instantanea(directorio, worker.pid)
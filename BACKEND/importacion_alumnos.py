@@ -0,0 +1,168 @@
+import csv
+import io
+import os
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+
+from database import insert_con_conflictos
+from eventos import publicar
+from versiones import subir_version
+from busqueda_alumnos import nombre_busqueda
+from models import db, Alumno
+from passwords import hashear
+from utils import generar_hash_credencial, normalizar
+
+MAX_FILAS_IMPORTACION = 5000
+# Por debajo de esto no compensa repartir el hashing entre procesos
+MIN_FILAS_POOL = 16
+FILAS_POR_INSERT = 500
+
+_pool = None
+_pool_pid = None
+
+
+def _obtener_pool():
+    # El pool se crea perezosamente en cada proceso: los workers de gunicorn
+    # hacen fork después de importar la app y no deben heredar el del padre
+    global _pool, _pool_pid
+    if _pool is None or _pool_pid != os.getpid():
+        _pool = ProcessPoolExecutor(max_workers=int(os.getenv("HASH_WORKERS", os.cpu_count() or 1)))
+        _pool_pid = os.getpid()
+    return _pool
+
+
+def hashear_passwords(passwords):
+    if len(passwords) < MIN_FILAS_POOL:
+        return [hashear(p) for p in passwords]
+    trozo = max(1, len(passwords) // (4 * (os.cpu_count() or 1)))
+    return list(_obtener_pool().map(hashear, passwords, chunksize=trozo))
+
+
+def leer_filas(peticion):
+    """
+    Extrae la lista de {"nombre", "apellidos", "email"} de una petición JSON
+    ({"alumnos": [...]} o una lista) o CSV (fichero `archivo` o cuerpo
+    text/csv, con cabecera nombre,apellidos[,email] o sin ella).
+    Lanza ValueError si el formato no es válido.
+    """
+    if peticion.is_json:
+        datos = peticion.get_json(silent=True)
+        if isinstance(datos, dict):
+            datos = datos.get("alumnos")
+        if not isinstance(datos, list):
+            raise ValueError("Se esperaba una lista de alumnos")
+        return [d if isinstance(d, dict) else {} for d in datos]
+
+    archivo = peticion.files.get("archivo")
+    if archivo:
+        texto = archivo.read().decode("utf-8-sig")
+    elif peticion.mimetype in ("text/csv", "text/plain"):
+        texto = peticion.get_data(as_text=True)
+    else:
+        raise ValueError("Envía JSON o un CSV")
+
+    lineas = [l for l in csv.reader(io.StringIO(texto)) if any(c.strip() for c in l)]
+    if lineas and [c.strip().lower() for c in lineas[0][:2]] == ["nombre", "apellidos"]:
+        cabecera = [c.strip().lower() for c in lineas[0]]
+        lineas = lineas[1:]
+    else:
+        cabecera = ["nombre", "apellidos", "email"]
+
+    return [dict(zip(cabecera, l)) for l in lineas]
+
+
+def _insert_ignorando_duplicados(filas):
+    """
+    INSERT ... ON CONFLICT (credencial) DO NOTHING en bloques. Devuelve los
+    ids realmente insertados, para distinguir los duplicados que haya metido
+    otra petición a la vez.
+    """
+    insert = insert_con_conflictos(db.session.get_bind())
+    insertados = set()
+    for i in range(0, len(filas), FILAS_POR_INSERT):
+        sentencia = (
+            insert(Alumno.__table__)
+            .values(filas[i:i + FILAS_POR_INSERT])
+            .on_conflict_do_nothing(index_elements=["credencial"])
+            .returning(Alumno.__table__.c.id)
+        )
+        insertados.update(db.session.execute(sentencia).scalars())
+    return insertados
+
+
+def importar_alumnos(tabla_id, filas):
+    """
+    Crea en una sola transacción los alumnos de `filas` en la tabla. Devuelve
+    un informe por fila con estado "creado", "duplicado" o "invalido".
+    """
+    informe = []
+    candidatos = {}
+
+    for i, fila in enumerate(filas, start=1):
+        nombre = str(fila.get("nombre") or "").strip()
+        apellidos = str(fila.get("apellidos") or "").strip()
+        email = str(fila.get("email") or "").strip() or None
+        entrada = {"fila": i, "nombre": nombre, "apellidos": apellidos}
+        informe.append(entrada)
+
+        if not nombre or not apellidos:
+            entrada.update(estado="invalido", error="Nombre o apellidos vacíos")
+            continue
+
+        credencial = generar_hash_credencial(normalizar(nombre), normalizar(apellidos))
+        if credencial in candidatos:
+            entrada.update(estado="duplicado", error="Repetido en la importación")
+            continue
+
+        entrada["credencial"] = credencial
+        candidatos[credencial] = {"entrada": entrada, "email": email}
+
+    # Las credenciales que ya existen no se hashean: es la parte cara
+    existentes = set()
+    lista = list(candidatos)
+    for i in range(0, len(lista), FILAS_POR_INSERT):
+        existentes.update(
+            c for (c,) in db.session.query(Alumno.credencial)
+            .filter(Alumno.credencial.in_(lista[i:i + FILAS_POR_INSERT]))
+        )
+    for credencial in existentes:
+        candidatos.pop(credencial)["entrada"].update(estado="duplicado", error="La credencial ya existe")
+
+    nuevos = list(candidatos.values())
+    passwords = [f"{c['entrada']['nombre']}{c['entrada']['apellidos']}" for c in nuevos]
+    hashes = hashear_passwords(passwords)
+
+    filas_insert = []
+    for c, password, password_hash in zip(nuevos, passwords, hashes):
+        c["id"] = uuid.uuid4()
+        c["password"] = password
+        filas_insert.append({
+            "id": c["id"],
+            "nombre": c["entrada"]["nombre"],
+            "apellidos": c["entrada"]["apellidos"],
+            "email": c["email"],
+            "password_hash": password_hash,
+            "tabla_id": tabla_id,
+            "credencial": c["entrada"]["credencial"],
+            "nombre_busqueda": nombre_busqueda(c["entrada"]["nombre"], c["entrada"]["apellidos"])
+        })
+
+    insertados = _insert_ignorando_duplicados(filas_insert) if filas_insert else set()
+    # El INSERT en bloque no pasa por los eventos del ORM: se anuncia aparte
+    if insertados:
+        subir_version(tabla_id)
+        publicar(tabla_id, "alumnos_añadidos", [
+            {"id": str(f["id"]), "nombre": f["nombre"], "apellidos": f["apellidos"]}
+            for f in filas_insert if f["id"] in insertados
+        ])
+    db.session.commit()
+
+    for c in nuevos:
+        if c["id"] in insertados:
+            c["entrada"].update(estado="creado", id=str(c["id"]), ejemplo_password=c["password"])
+        else:
+            c["entrada"].update(estado="duplicado", error="La credencial ya existe")
+
+    for entrada in informe:
+        entrada.pop("credencial", None)
+    return informe
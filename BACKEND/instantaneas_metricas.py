@@ -0,0 +1,83 @@
+"""
+Instantáneas de métricas en METRICAS_DIR, un JSON por worker (ver
+metricas.py). Solo usa la biblioteca estándar: el maestro de gunicorn lo
+importa para plegar las de los workers que terminan.
+"""
+import glob
+import json
+import os
+import tempfile
+
+# Contadores acumulados de los workers que ya terminaron (ver plegar_instantanea)
+ARCHIVO_MUERTOS = "muertos.json"
+
+
+def escribir_instantanea(directorio, nombre, datos):
+    fd, tmp = tempfile.mkstemp(dir=directorio, prefix=".metricas_")
+    with os.fdopen(fd, "w") as f:
+        json.dump(datos, f)
+    os.replace(tmp, os.path.join(directorio, nombre))
+
+
+def _leer(ruta):
+    try:
+        with open(ruta) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def leer_instantaneas(directorio):
+    """
+    Instantáneas de los workers más la de los muertos, sin las que ya están
+    sumadas en esta (su archivo puede seguir ahí un instante).
+    """
+    muertos = _leer(os.path.join(directorio, ARCHIVO_MUERTOS))
+    plegadas = set(muertos["plegadas"]) if muertos else set()
+    instantaneas = [muertos] if muertos else []
+    for ruta in glob.glob(os.path.join(directorio, "*.json")):
+        if os.path.basename(ruta) == ARCHIVO_MUERTOS:
+            continue
+        inst = _leer(ruta)
+        if inst is not None and inst.get("instancia") not in plegadas:
+            instantaneas.append(inst)
+    return instantaneas
+
+
+def plegar_instantanea(directorio, pid):
+    """
+    Suma los contadores e histogramas del worker `pid`, que ya terminó, a
+    muertos.json y borra su instantánea, para que /metrics no lea un archivo
+    más por cada worker reciclado. Lo llama el maestro de gunicorn
+    (child_exit), el único que escribe muertos.json. Sus indicadores no se
+    guardan: solo cuentan los de procesos vivos.
+    """
+    ruta = os.path.join(directorio, f"{pid}.json")
+    inst = _leer(ruta)
+    if inst is None:
+        return
+
+    muertos = _leer(os.path.join(directorio, ARCHIVO_MUERTOS)) or {
+        "pid": 0, "contadores": [], "histogramas": [], "indicadores": [], "plegadas": []
+    }
+    contadores = {(n, tuple(map(tuple, e))): v for n, e, v in muertos["contadores"]}
+    for n, e, v in inst["contadores"]:
+        clave = (n, tuple(map(tuple, e)))
+        contadores[clave] = contadores.get(clave, 0) + v
+    histogramas = {(n, tuple(map(tuple, e))): [c, cu, s, k] for n, e, c, cu, s, k in muertos["histogramas"]}
+    for n, e, cubetas, cuentas, suma, k in inst["histogramas"]:
+        h = histogramas.setdefault((n, tuple(map(tuple, e))), [cubetas, [0] * len(cubetas), 0.0, 0])
+        h[1] = [a + b for a, b in zip(h[1], cuentas)]
+        h[2] += suma
+        h[3] += k
+
+    # Solo hace falta recordar las instantáneas cuyo archivo aún existe
+    vivas = {i.get("instancia") for i in map(_leer, glob.glob(os.path.join(directorio, "*.json"))) if i}
+    escribir_instantanea(directorio, ARCHIVO_MUERTOS, {
+        "pid": 0,
+        "contadores": [[n, list(e), v] for (n, e), v in contadores.items()],
+        "histogramas": [[n, list(e), *h] for (n, e), h in histogramas.items()],
+        "indicadores": [],
+        "plegadas": [i for i in muertos["plegadas"] if i in vivas] + [inst.get("instancia")],
+    })
+    os.remove(ruta)
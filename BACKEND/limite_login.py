@@ -0,0 +1,169 @@
+import math
+import os
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+from flask import current_app, jsonify, request
+from sqlalchemy import case, delete, select
+
+from database import db, insert_con_conflictos
+from metricas import metricas
+from models import CuboLogin
+
+# Cubo de fichas: caben `capacidad` intentos seguidos y se recupera uno cada
+# periodo / capacidad segundos
+Limite = namedtuple("Limite", ["capacidad", "periodo"])
+
+# Cada cuánto (s) borra cada proceso los cubos que ya estarían llenos
+INTERVALO_LIMPIEZA = 300
+
+
+def parsear_limite(valor):
+    """ "10/60" -> 10 intentos seguidos, recuperados del todo en 60 s. """
+    capacidad, periodo = valor.split("/")
+    limite = Limite(int(capacidad), float(periodo))
+    if limite.capacidad < 1 or limite.periodo <= 0:
+        raise ValueError(f"Límite de login no válido: {valor}")
+    return limite
+
+
+def _recarga(limite):
+    return limite.capacidad / limite.periodo
+
+
+class LimitadorMemoria:
+    """
+    Cubos en memoria del proceso, LRU acotado a `max_claves`. Con varios
+    workers cada uno lleva su cuenta: el límite real es workers veces el
+    configurado.
+    """
+
+    def __init__(self, max_claves=100000):
+        self.max_claves = max_claves
+        self._cubos = OrderedDict()
+        self._lock = threading.Lock()
+
+    def consumir(self, clave, limite):
+        """ Gasta una ficha; devuelve 0 si se pudo o los segundos que faltan para tenerla. """
+        ahora = time.monotonic()
+        recarga = _recarga(limite)
+        with self._lock:
+            fichas, actualizado = self._cubos.get(clave, (limite.capacidad, ahora))
+            fichas = min(limite.capacidad, fichas + (ahora - actualizado) * recarga)
+            if fichas >= 1:
+                self._cubos[clave] = (fichas - 1, ahora)
+                espera = 0.0
+            else:
+                self._cubos[clave] = (fichas, ahora)
+                espera = (1 - fichas) / recarga
+            self._cubos.move_to_end(clave)
+            while len(self._cubos) > self.max_claves:
+                self._cubos.popitem(last=False)
+        return espera
+
+    def limpiar(self):
+        with self._lock:
+            self._cubos.clear()
+
+
+class LimitadorBD:
+    """
+    Cubos en la tabla cubos_login, compartidos por todos los workers. Cada
+    intento es un único INSERT ... ON CONFLICT DO UPDATE ... WHERE que
+    rellena y gasta la ficha de forma atómica; si no hay ficha no se
+    actualiza ninguna fila. Va en su propia conexión y transacción, al
+    margen de la sesión de la petición.
+    """
+
+    def __init__(self, olvido):
+        # Pasado este tiempo sin intentos cualquier cubo está lleno y sobra
+        self.olvido = olvido
+        self._ultima_limpieza = 0.0
+
+    def consumir(self, clave, limite):
+        ahora = time.time()
+        recarga = _recarga(limite)
+        tabla = CuboLogin.__table__
+        rellenas = tabla.c.fichas + (ahora - tabla.c.actualizado) * recarga
+        rellenas = case((rellenas > limite.capacidad, limite.capacidad), else_=rellenas)
+
+        with db.engine.begin() as conn:
+            insert = insert_con_conflictos(conn)(tabla).values(
+                clave=clave, fichas=limite.capacidad - 1, actualizado=ahora
+            )
+            consulta = insert.on_conflict_do_update(
+                index_elements=[tabla.c.clave],
+                set_={"fichas": rellenas - 1, "actualizado": ahora},
+                where=rellenas >= 1,
+            ).returning(tabla.c.clave)
+            if conn.execute(consulta).first() is not None:
+                espera = 0.0
+            else:
+                fila = conn.execute(
+                    select(tabla.c.fichas, tabla.c.actualizado).where(tabla.c.clave == clave)
+                ).first()
+                fichas = min(limite.capacidad, fila.fichas + (ahora - fila.actualizado) * recarga)
+                espera = max(1 - fichas, 0) / recarga
+
+            if ahora - self._ultima_limpieza > INTERVALO_LIMPIEZA:
+                self._ultima_limpieza = ahora
+                conn.execute(delete(tabla).where(tabla.c.actualizado < ahora - self.olvido))
+        return espera
+
+    def limpiar(self):
+        with db.engine.begin() as conn:
+            conn.execute(delete(CuboLogin.__table__))
+
+
+def ip_cliente():
+    # Detrás de un proxy, PROXIES (ver app.py) hace que remote_addr sea la del cliente
+    return request.remote_addr or "desconocida"
+
+
+def comprobar_login(tipo, cuenta):
+    """
+    Gasta una ficha del cubo de la IP y otra del de la cuenta (usuario o
+    hash de la credencial) antes de comprobar nada. Devuelve None si se
+    puede seguir o la respuesta 429 si no.
+    """
+    config = current_app.config
+    if not config["LOGIN_LIMITE"]:
+        return None
+    limitador = current_app.extensions["limite_login"]
+
+    comprobaciones = [("ip", f"{tipo}:ip:{ip_cliente()}", config["LOGIN_LIMITE_IP"])]
+    if cuenta:
+        comprobaciones.append(("cuenta", f"{tipo}:cuenta:{cuenta}", config["LOGIN_LIMITE_CUENTA"]))
+
+    for motivo, clave, limite in comprobaciones:
+        espera = limitador.consumir(clave[:255], limite)
+        if espera:
+            metricas.incrementar("academia_login_rechazados_total", {"tipo": tipo, "motivo": motivo})
+            segundos = max(1, math.ceil(espera))
+            respuesta = jsonify({"error": f"Demasiados intentos, vuelve a probar en {segundos} s"})
+            respuesta.headers["Retry-After"] = str(segundos)
+            return respuesta, 429
+    return None
+
+
+def init_app(app):
+    """
+    Limita los intentos de /api/login y /api/login_alumno por IP
+    (LOGIN_LIMITE_IP) y por cuenta (LOGIN_LIMITE_CUENTA), en formato
+    "intentos/segundos". LOGIN_LIMITE_BACKEND: "memoria" (por proceso) o
+    "bd" (compartido entre workers). LOGIN_LIMITE=0 lo desactiva.
+    """
+    app.config["LOGIN_LIMITE"] = os.getenv("LOGIN_LIMITE", "1") == "1"
+    app.config["LOGIN_LIMITE_IP"] = parsear_limite(os.getenv("LOGIN_LIMITE_IP", "30/60"))
+    app.config["LOGIN_LIMITE_CUENTA"] = parsear_limite(os.getenv("LOGIN_LIMITE_CUENTA", "5/60"))
+
+    backend = os.getenv("LOGIN_LIMITE_BACKEND", "memoria").lower()
+    if backend == "memoria":
+        limitador = LimitadorMemoria(int(os.getenv("LOGIN_LIMITE_MAX_CLAVES", "100000")))
+    elif backend == "bd":
+        olvido = max(app.config["LOGIN_LIMITE_IP"].periodo, app.config["LOGIN_LIMITE_CUENTA"].periodo)
+        limitador = LimitadorBD(olvido)
+    else:
+        raise Exception(f"LOGIN_LIMITE_BACKEND desconocido: {backend}")
+    app.extensions["limite_login"] = limitador
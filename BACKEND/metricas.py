@@ -0,0 +1,278 @@
+import os
+import threading
+import time
+import uuid
+
+from flask import g, request, has_request_context, current_app, Response, jsonify
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from instantaneas_metricas import escribir_instantanea, leer_instantaneas
+
+# Cubetas de los histogramas de duración, en segundos
+CUBETAS_DURACION = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+CUBETAS_CONSULTAS = (1, 2, 5, 10, 20, 50, 100, 250)
+
+# Consultas hechas fuera de una petición (trabajos en segundo plano, scripts)
+ENDPOINT_FONDO = "_fondo"
+# Como mucho una instantánea a disco por segundo y proceso (modo multiproceso)
+INTERVALO_INSTANTANEA = 1.0
+
+DEFINICIONES = {
+    "academia_http_peticiones_total": ("counter", "Peticiones HTTP atendidas"),
+    "academia_http_duracion_segundos": ("histogram", "Tiempo hasta tener la respuesta (sin el envío del cuerpo en streaming)"),
+    "academia_http_peticion_bytes_total": ("counter", "Bytes recibidos en el cuerpo de las peticiones (subidas)"),
+    "academia_http_respuesta_bytes_total": ("counter", "Bytes de las respuestas con longitud conocida (descargas)"),
+    "academia_sql_consultas_total": ("counter", "Consultas SQL ejecutadas"),
+    "academia_sql_duracion_segundos_total": ("counter", "Tiempo total en consultas SQL"),
+    "academia_sql_consultas_por_peticion": ("histogram", "Consultas SQL por petición"),
+    "academia_cache_aciertos_total": ("counter", "Aciertos de las cachés en memoria"),
+    "academia_cache_fallos_total": ("counter", "Fallos de las cachés en memoria"),
+    "academia_sse_suscripciones": ("gauge", "Conexiones SSE abiertas"),
+    "academia_login_rechazados_total": ("counter", "Intentos de login rechazados por límite, antes de comprobar la contraseña"),
+}
+
+
+class Metricas:
+    """
+    Contadores e histogramas en memoria del proceso. Con METRICAS_DIR cada
+    proceso deja una instantánea en ese directorio y /metrics suma las de
+    todos los workers, así Prometheus ve un único valor aunque cada scrape
+    caiga en un worker distinto.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.contadores = {}
+        self.histogramas = {}
+        self.directorio = None
+        self._ultima_instantanea = 0.0
+        self._instancia = (None, None)
+
+    def incrementar(self, nombre, etiquetas, valor=1):
+        clave = (nombre, tuple(sorted(etiquetas.items())))
+        with self._lock:
+            self.contadores[clave] = self.contadores.get(clave, 0) + valor
+
+    def observar(self, nombre, etiquetas, valor, cubetas=CUBETAS_DURACION):
+        clave = (nombre, tuple(sorted(etiquetas.items())))
+        with self._lock:
+            h = self.histogramas.get(clave)
+            if h is None:
+                h = self.histogramas[clave] = {"cubetas": list(cubetas), "cuentas": [0] * len(cubetas), "suma": 0.0, "n": 0}
+            for i, limite in enumerate(h["cubetas"]):
+                if valor <= limite:
+                    h["cuentas"][i] += 1
+                    break
+            h["suma"] += valor
+            h["n"] += 1
+
+    def id_instancia(self):
+        # Distinto en cada proceso (también tras un fork): el pid se reutiliza
+        pid, instancia = self._instancia
+        if pid != os.getpid():
+            self._instancia = pid, instancia = os.getpid(), uuid.uuid4().hex
+        return instancia
+
+    def instantanea(self):
+        with self._lock:
+            return {
+                "pid": os.getpid(),
+                "instancia": self.id_instancia(),
+                "contadores": [[n, list(e), v] for (n, e), v in self.contadores.items()],
+                "histogramas": [
+                    [n, list(e), h["cubetas"], list(h["cuentas"]), h["suma"], h["n"]]
+                    for (n, e), h in self.histogramas.items()
+                ],
+                "indicadores": [[n, list(e), v] for n, e, v in _indicadores()],
+            }
+
+    def guardar_instantanea(self, forzar=False):
+        if not self.directorio:
+            return
+        ahora = time.monotonic()
+        if not forzar and ahora - self._ultima_instantanea < INTERVALO_INSTANTANEA:
+            return
+        self._ultima_instantanea = ahora
+        escribir_instantanea(self.directorio, f"{os.getpid()}.json", self.instantanea())
+
+    def texto_prometheus(self):
+        if self.directorio:
+            self.guardar_instantanea(forzar=True)
+            instantaneas = leer_instantaneas(self.directorio)
+        else:
+            instantaneas = [self.instantanea()]
+        return _formatear(instantaneas)
+
+
+metricas = Metricas()
+
+
+def _proceso_vivo(pid):
+    try:
+        os.kill(pid, 0)
+        return True
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+
+
+def _indicadores():
+    """ Valores que se leen en el momento de los demás módulos. """
+    from cache_admins import cache_admins
+    from versiones import cache_respuestas
+    from eventos import bus_eventos
+
+    resultado = []
+    for nombre_cache, cache in (("admins", cache_admins), ("respuestas", cache_respuestas)):
+        resultado.append(("academia_cache_aciertos_total", (("cache", nombre_cache),), cache.aciertos))
+        resultado.append(("academia_cache_fallos_total", (("cache", nombre_cache),), cache.fallos))
+    resultado.append(("academia_sse_suscripciones", (), bus_eventos.estadisticas()["suscripciones"]))
+    return resultado
+
+
+def _etiquetas(pares, extra=()):
+    pares = list(pares) + list(extra)
+    if not pares:
+        return ""
+    escapar = lambda v: str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    return "{" + ",".join(f'{k}="{escapar(v)}"' for k, v in pares) + "}"
+
+
+def _formatear(instantaneas):
+    """ Suma las instantáneas de los procesos y las escribe en formato texto de Prometheus. """
+    valores = {}
+    histogramas = {}
+    for inst in instantaneas:
+        for nombre, etiquetas, valor in inst["contadores"]:
+            clave = (nombre, tuple(map(tuple, etiquetas)))
+            valores[clave] = valores.get(clave, 0) + valor
+        # Los indicadores de un worker que ya no existe no cuentan
+        if inst["indicadores"] and (len(instantaneas) == 1 or _proceso_vivo(inst["pid"])):
+            for nombre, etiquetas, valor in inst["indicadores"]:
+                clave = (nombre, tuple(map(tuple, etiquetas)))
+                valores[clave] = valores.get(clave, 0) + valor
+        for nombre, etiquetas, cubetas, cuentas, suma, n in inst["histogramas"]:
+            clave = (nombre, tuple(map(tuple, etiquetas)))
+            h = histogramas.setdefault(clave, {"cubetas": cubetas, "cuentas": [0] * len(cubetas), "suma": 0.0, "n": 0})
+            h["cuentas"] = [a + b for a, b in zip(h["cuentas"], cuentas)]
+            h["suma"] += suma
+            h["n"] += n
+
+    lineas = []
+    for nombre, (tipo, ayuda) in DEFINICIONES.items():
+        lineas.append(f"# HELP {nombre} {ayuda}")
+        lineas.append(f"# TYPE {nombre} {tipo}")
+        if tipo == "histogram":
+            for (n, etiquetas), h in sorted(histogramas.items()):
+                if n != nombre:
+                    continue
+                acumulado = 0
+                for limite, cuenta in zip(h["cubetas"], h["cuentas"]):
+                    acumulado += cuenta
+                    lineas.append(f"{nombre}_bucket{_etiquetas(etiquetas, [('le', limite)])} {acumulado}")
+                lineas.append(f"{nombre}_bucket{_etiquetas(etiquetas, [('le', '+Inf')])} {h['n']}")
+                lineas.append(f"{nombre}_sum{_etiquetas(etiquetas)} {h['suma']}")
+                lineas.append(f"{nombre}_count{_etiquetas(etiquetas)} {h['n']}")
+        else:
+            for (n, etiquetas), valor in sorted(valores.items()):
+                if n == nombre:
+                    lineas.append(f"{nombre}{_etiquetas(etiquetas)} {valor}")
+    return "\n".join(lineas) + "\n"
+
+
+# --- SQL: número y duración de las consultas de cada endpoint ---
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _antes_de_consulta(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("inicio_consultas", []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _despues_de_consulta(conn, cursor, statement, parameters, context, executemany):
+    inicios = conn.info.get("inicio_consultas")
+    if not inicios:
+        return
+    duracion = time.perf_counter() - inicios.pop()
+
+    if has_request_context():
+        acumulado = g.get("metricas_sql")
+        if acumulado is not None:
+            acumulado[0] += 1
+            acumulado[1] += duracion
+            return
+        # Respuesta en streaming: la petición ya se contabilizó
+        etiquetas = {"endpoint": request.endpoint or "sin_ruta"}
+    else:
+        etiquetas = {"endpoint": ENDPOINT_FONDO}
+    metricas.incrementar("academia_sql_consultas_total", etiquetas)
+    metricas.incrementar("academia_sql_duracion_segundos_total", etiquetas, duracion)
+
+
+# --- Peticiones: tiempo, bytes y SQL por endpoint ---
+
+def _empezar_peticion():
+    g.metricas_inicio = time.perf_counter()
+    g.metricas_sql = [0, 0.0]
+
+
+def _terminar_peticion(respuesta):
+    inicio = g.get("metricas_inicio")
+    if inicio is None:
+        return respuesta
+    duracion = time.perf_counter() - inicio
+    # La regla y no la URL: así los ids no disparan el número de series
+    endpoint = request.endpoint or "sin_ruta"
+    metodo = request.method
+
+    metricas.incrementar("academia_http_peticiones_total", {
+        "endpoint": endpoint, "metodo": metodo, "estado": str(respuesta.status_code)
+    })
+    metricas.observar("academia_http_duracion_segundos", {"endpoint": endpoint, "metodo": metodo}, duracion)
+
+    if request.content_length:
+        metricas.incrementar("academia_http_peticion_bytes_total", {"endpoint": endpoint}, request.content_length)
+    if respuesta.content_length:
+        metricas.incrementar("academia_http_respuesta_bytes_total", {"endpoint": endpoint}, respuesta.content_length)
+
+    consultas, tiempo_sql = g.pop("metricas_sql", (0, 0.0))
+    etiquetas = {"endpoint": endpoint}
+    metricas.incrementar("academia_sql_consultas_total", etiquetas, consultas)
+    metricas.incrementar("academia_sql_duracion_segundos_total", etiquetas, tiempo_sql)
+    metricas.observar("academia_sql_consultas_por_peticion", etiquetas, consultas, CUBETAS_CONSULTAS)
+
+    metricas.guardar_instantanea()
+
+    if duracion >= current_app.config["PETICION_LENTA"]:
+        current_app.logger.warning(
+            f"Petición lenta: {metodo} {endpoint} {duracion * 1000:.0f} ms, "
+            f"{consultas} consultas SQL ({tiempo_sql * 1000:.0f} ms)"
+        )
+    return respuesta
+
+
+def ver_metricas():
+    token = current_app.config.get("METRICAS_TOKEN")
+    if token and request.headers.get("Authorization", "") != f"Bearer {token}":
+        return jsonify({"error": "Token requerido"}), 401
+    return Response(metricas.texto_prometheus(), mimetype="text/plain; version=0.0.4")
+
+
+def init_app(app):
+    """
+    Mide cada petición y expone /metrics en formato de Prometheus.
+    METRICAS_TOKEN protege /metrics con un Bearer; METRICAS_DIR (un
+    directorio compartido por los workers) agrega todos los procesos;
+    PETICION_LENTA_MS deja en el log las peticiones que tarden más.
+    """
+    app.config["METRICAS_TOKEN"] = os.getenv("METRICAS_TOKEN", "")
+    app.config["PETICION_LENTA"] = int(os.getenv("PETICION_LENTA_MS", "1000")) / 1000
+
+    metricas.directorio = os.getenv("METRICAS_DIR") or None
+    if metricas.directorio:
+        os.makedirs(metricas.directorio, exist_ok=True)
+
+    app.before_request(_empezar_peticion)
+    app.after_request(_terminar_peticion)
+    app.add_url_rule("/metrics", "metricas", ver_metricas, methods=["GET"])
@@ -1,7 +1,7 @@
 from datetime import datetime
 import uuid
-from werkzeug.security import generate_password_hash, check_password_hash
 from database import db
+from passwords import hashear, comprobar_password
 from sqlalchemy.dialects.postgresql import UUID, ENUM
 
 # ENUM preexistente en PostgreSQL
@@ -17,7 +17,10 @@ class Administrador(db.Model):
     password_hash = db.Column(db.String(512))
     es_superadmin = db.Column(db.Boolean, default=False)
 
-    tablas = db.relationship('Tabla', backref='administrador', cascade='all, delete-orphan')
+    # passive_deletes: los hijos los borra la base de datos (ON DELETE CASCADE)
+    # sin cargarlos; los archivos se apuntan antes en almacen_blobs.py
+    tablas = db.relationship('Tabla', backref='administrador', cascade='all, delete-orphan', passive_deletes=True)
+    plantillas = db.relationship('Plantilla', backref='administrador', cascade='all, delete-orphan', passive_deletes=True)
 
     @property
     def password(self):
@@ -25,10 +28,10 @@ class Administrador(db.Model):
 
     @password.setter
     def password(self, password):
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = hashear(password)
 
     def check_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        return comprobar_password(self, password)
 
 
 class Tabla(db.Model):
@@ -38,10 +41,12 @@ class Tabla(db.Model):
     nombre = db.Column(db.String(100), nullable=False)
     descripcion = db.Column(db.Text)
     fecha_creacion = db.Column(db.DateTime, default=datetime.utcnow)
-    admin_id = db.Column(db.Integer, db.ForeignKey('administradores.id'), nullable=False)
+    admin_id = db.Column(db.Integer, db.ForeignKey('administradores.id', ondelete='CASCADE'), nullable=False)
+    # Sube con cada cambio de la tabla o de sus alumnos y documentos (versiones.py)
+    version = db.Column(db.Integer, default=1)
 
-    alumnos = db.relationship('Alumno', backref='tabla', cascade='all, delete-orphan')
-    documentos = db.relationship("Documento", backref="tabla", cascade="all, delete-orphan")
+    alumnos = db.relationship('Alumno', backref='tabla', cascade='all, delete-orphan', passive_deletes=True)
+    documentos = db.relationship("Documento", backref="tabla", cascade="all, delete-orphan", passive_deletes=True)
 
 
 class Alumno(db.Model):
@@ -52,16 +57,29 @@ class Alumno(db.Model):
     email = db.Column(db.String(100), nullable=True)
     apellidos = db.Column(db.String(100), nullable=False)
     password_hash = db.Column(db.String(512), nullable=False)
-    tabla_id = db.Column(db.Integer, db.ForeignKey('tablas.id'), nullable=False)
+    tabla_id = db.Column(db.Integer, db.ForeignKey('tablas.id', ondelete='CASCADE'), nullable=False)
     credencial = db.Column(db.String(64), unique=True)
-
-    documentos = db.relationship('Documento', backref='alumno', cascade='all, delete-orphan')
+    # Nombre y apellidos normalizados para buscar (ver busqueda_alumnos.py)
+    nombre_busqueda = db.Column(db.String(160))
+
+    __table_args__ = (
+        db.Index('ix_alumnos_tabla_id', 'tabla_id'),
+        # Orden y paginación de la búsqueda; en SQLite también las búsquedas por prefijo
+        db.Index('ix_alumnos_nombre_busqueda', 'nombre_busqueda', 'id'),
+        # LIKE '%...%' en PostgreSQL (extensión pg_trgm)
+        db.Index(
+            'ix_alumnos_nombre_busqueda_trgm', 'nombre_busqueda',
+            postgresql_using='gin', postgresql_ops={'nombre_busqueda': 'gin_trgm_ops'}
+        ).ddl_if(dialect='postgresql'),
+    )
+
+    documentos = db.relationship('Documento', backref='alumno', cascade='all, delete-orphan', passive_deletes=True)
 
     def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = hashear(password)
 
     def check_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        return comprobar_password(self, password)
 
 
 class Documento(db.Model):
@@ -74,9 +92,133 @@ class Documento(db.Model):
     nombre_archivo = db.Column(db.String(255), unique=True)
     ruta = db.Column(db.String(512))
     estado = db.Column(estado_enum, default='pendiente')
-
-    tabla_id = db.Column(db.Integer, db.ForeignKey('tablas.id'), nullable=False)
-    alumno_id = db.Column(UUID(as_uuid=True), db.ForeignKey('alumnos.id'))
+    sha256 = db.Column(db.String(64))
+    tamano = db.Column(db.BigInteger)
+
+    tabla_id = db.Column(db.Integer, db.ForeignKey('tablas.id', ondelete='CASCADE'), nullable=False)
+    alumno_id = db.Column(UUID(as_uuid=True), db.ForeignKey('alumnos.id', ondelete='CASCADE'))
+
+    __table_args__ = (
+        # Documentos subidos de un alumno: api_subir_documentos, api_documentos_alumno
+        db.Index('ix_documentos_tabla_alumno_nombre', 'tabla_id', 'alumno_id', 'nombre'),
+        # Documentos de un alumno sin tabla (alumno.documentos, borrados en cascada)
+        db.Index('ix_documentos_alumno_id', 'alumno_id'),
+        # Documentos requeridos de una tabla (alumno_id IS NULL): uno por
+        # nombre, y sin nombre_archivo porque no tienen archivo
+        db.Index(
+            'uq_documentos_requeridos', 'tabla_id', 'nombre', unique=True,
+            postgresql_where=db.text('alumno_id IS NULL'),
+            sqlite_where=db.text('alumno_id IS NULL')
+        ),
+    )
+
+    # Análisis del contenido (tipo real, páginas, miniatura); sin FK porque
+    # los documentos anteriores al almacén por hash no tienen fila en blobs
+    blob = db.relationship(
+        'Blob',
+        primaryjoin='foreign(Documento.sha256) == Blob.sha256',
+        viewonly=True
+    )
 
     def es_requerido(self):
         return self.alumno_id is None
+
+
+class Plantilla(db.Model):
+    """
+    Lista reutilizable de documentos requeridos de un admin, que se aplica
+    de una vez a varias tablas (ver requisitos.py).
+    """
+    __tablename__ = 'plantillas'
+
+    id = db.Column(db.Integer, primary_key=True)
+    nombre = db.Column(db.String(100), nullable=False)
+    admin_id = db.Column(db.Integer, db.ForeignKey('administradores.id', ondelete='CASCADE'), nullable=False)
+    fecha_creacion = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.Index('ix_plantillas_admin_id', 'admin_id'),
+    )
+
+    documentos = db.relationship(
+        'PlantillaDocumento', backref='plantilla', cascade='all, delete-orphan', passive_deletes=True,
+        order_by='PlantillaDocumento.orden'
+    )
+
+
+class PlantillaDocumento(db.Model):
+    __tablename__ = 'plantilla_documentos'
+
+    id = db.Column(db.Integer, primary_key=True)
+    plantilla_id = db.Column(db.Integer, db.ForeignKey('plantillas.id', ondelete='CASCADE'), nullable=False)
+    nombre = db.Column(db.String(255), nullable=False)
+    orden = db.Column(db.Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        db.UniqueConstraint('plantilla_id', 'nombre', name='uq_plantilla_documentos_nombre'),
+    )
+
+class Blob(db.Model):
+    """
+    Contenido de un archivo subido, guardado una sola vez por su SHA-256.
+    `referencias` cuenta los Documento que apuntan a él.
+    """
+    __tablename__ = 'blobs'
+
+    sha256 = db.Column(db.String(64), primary_key=True)
+    ruta = db.Column(db.String(512), nullable=False)
+    tamano = db.Column(db.BigInteger)
+    referencias = db.Column(db.Integer, nullable=False, default=0)
+    fecha_creacion = db.Column(db.DateTime, default=datetime.utcnow)
+    # CRC-32 del contenido: la exportación ZIP lo necesita sin releer el archivo
+    crc32 = db.Column(db.BigInteger)
+    # Rellenados en segundo plano por la tarea "analizar_blob"
+    mime = db.Column(db.String(100))
+    paginas = db.Column(db.Integer)
+    miniatura = db.Column(db.String(512))
+
+
+class ArchivoPorBorrar(db.Model):
+    """
+    Cola de archivos de documentos borrados en cascada por la base de datos,
+    que ya no pasan por el ORM. La vacía por lotes la tarea
+    "limpiar_archivos" (ver almacen_blobs.py).
+    """
+    __tablename__ = 'archivos_por_borrar'
+
+    id = db.Column(db.Integer, primary_key=True)
+    sha256 = db.Column(db.String(64))
+    ruta = db.Column(db.String(512))
+    fecha_creacion = db.Column(db.DateTime, default=datetime.utcnow)
+
+class Trabajo(db.Model):
+    """
+    Tarea en segundo plano (ver trabajos.py). Las que terminan bien se borran;
+    quedan las pendientes, las que están en curso y las fallidas.
+    """
+    __tablename__ = 'trabajos'
+
+    id = db.Column(db.Integer, primary_key=True)
+    tipo = db.Column(db.String(50), nullable=False)
+    clave = db.Column(db.String(255), nullable=False)
+    estado = db.Column(db.String(20), nullable=False, default='pendiente')
+    intentos = db.Column(db.Integer, nullable=False, default=0)
+    error = db.Column(db.Text)
+    fecha_creacion = db.Column(db.DateTime, default=datetime.utcnow)
+    fecha_inicio = db.Column(db.DateTime)
+
+    __table_args__ = (
+        db.Index('ix_trabajos_estado_id', 'estado', 'id'),
+    )
+
+
+class CuboLogin(db.Model):
+    """
+    Cubo de fichas de limite_login.py con backend "bd": compartido por todos
+    los workers. `actualizado` es un timestamp Unix.
+    """
+    __tablename__ = 'cubos_login'
+
+    clave = db.Column(db.String(255), primary_key=True)
+    fichas = db.Column(db.Float, nullable=False)
+    actualizado = db.Column(db.Float, nullable=False, index=True)
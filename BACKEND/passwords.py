@@ -0,0 +1,83 @@
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import current_app, has_app_context
+from werkzeug.security import generate_password_hash, check_password_hash
+
+# Método de werkzeug, p. ej. "scrypt:32768:8:1" o "pbkdf2:sha256:600000".
+# Cambiarlo no obliga a migrar: los hashes antiguos se actualizan solos en el
+# siguiente login correcto (ver comprobar_password).
+METODO_HASH = os.getenv("PASSWORD_HASH_METODO", "scrypt")
+LONGITUD_SALT = int(os.getenv("PASSWORD_SALT_LENGTH", "16"))
+
+logger = logging.getLogger(__name__)
+
+_prefijo_actual = None
+_rehash_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="rehash")
+_rehash_pendientes = set()
+_rehash_lock = threading.Lock()
+
+
+def hashear(password):
+    return generate_password_hash(password, method=METODO_HASH, salt_length=LONGITUD_SALT)
+
+
+def prefijo_actual():
+    # werkzeug completa los parámetros por defecto ("scrypt" -> "scrypt:32768:8:1"),
+    # así que la forma canónica se obtiene generando un hash una vez por proceso
+    global _prefijo_actual
+    if _prefijo_actual is None:
+        _prefijo_actual = hashear("").split("$", 1)[0]
+    return _prefijo_actual
+
+
+def necesita_rehash(password_hash):
+    return password_hash.split("$", 1)[0] != prefijo_actual()
+
+
+def comprobar_password(instancia, password):
+    """
+    Comprueba la contraseña de un Alumno o Administrador. Si es correcta pero
+    el hash se generó con parámetros antiguos, programa en segundo plano su
+    sustitución por uno nuevo; la respuesta del login no espera al rehash.
+    """
+    if not instancia.password_hash or not check_password_hash(instancia.password_hash, password):
+        return False
+
+    if necesita_rehash(instancia.password_hash) and has_app_context():
+        _programar_rehash(
+            current_app._get_current_object(),
+            instancia.__table__, instancia.id, instancia.password_hash, password
+        )
+    return True
+
+
+def _programar_rehash(app, tabla, id_fila, hash_antiguo, password):
+    clave = (tabla.name, str(id_fila))
+    with _rehash_lock:
+        if clave in _rehash_pendientes:
+            return
+        _rehash_pendientes.add(clave)
+    _rehash_pool.submit(_rehash, app, tabla, id_fila, hash_antiguo, password, clave)
+
+
+def _rehash(app, tabla, id_fila, hash_antiguo, password, clave):
+    from database import db
+
+    try:
+        nuevo = hashear(password)
+        with app.app_context():
+            # Solo se sustituye si nadie ha cambiado la contraseña mientras tanto
+            db.session.execute(
+                tabla.update()
+                .where(tabla.c.id == id_fila, tabla.c.password_hash == hash_antiguo)
+                .values(password_hash=nuevo)
+            )
+            db.session.commit()
+    except Exception as e:
+        logger.error(f"Error actualizando hash de {clave}: {str(e)}")
+    finally:
+        with _rehash_lock:
+            _rehash_pendientes.discard(clave)
@@ -0,0 +1,156 @@
+import cProfile
+import io
+import json
+import os
+import pstats
+import re
+import time
+import uuid
+
+from flask import g, request, current_app
+
+from auth import verificar_token
+
+PATRON_ID = re.compile(r"^\d{8}-\d{6}-\d{6}-[0-9a-f]{6}$")
+ORDENES = ("cumulative", "tottime", "calls", "ncalls")
+
+
+def _pide_perfil():
+    """
+    Se perfila si la petición lo pide (cabecera X-Perfilar: 1 o ?perfilar=1)
+    y viene con un token de superadmin, en Authorization o en ?token=.
+    """
+    if request.headers.get("X-Perfilar") != "1" and request.args.get("perfilar") != "1":
+        return False
+    token = request.headers.get("Authorization", "").replace("Bearer ", "") or request.args.get("token")
+    if not token:
+        return False
+    try:
+        return bool(verificar_token(token).get("es_superadmin"))
+    except Exception:
+        return False
+
+
+def _empezar():
+    if not _pide_perfil():
+        return
+    perfil = cProfile.Profile()
+    try:
+        perfil.enable()
+    except ValueError:
+        # Otro perfilador activo en este proceso (Python 3.12+): se deja pasar
+        return
+    g.perfil = perfil
+    g.perfil_inicio = time.perf_counter()
+    # Lo que interesa es el trabajo real, no un acierto de caché o un 304
+    g.sin_cache_respuestas = True
+
+
+def _terminar(respuesta):
+    perfil = g.pop("perfil", None)
+    if perfil is None:
+        return respuesta
+    inicio = g.pop("perfil_inicio")
+    id_perfil, ahora = nuevo_id_perfil()
+    datos = {
+        "metodo": request.method,
+        "ruta": request.path,
+        "endpoint": request.endpoint,
+        "estado": respuesta.status_code,
+        "streaming": respuesta.is_streamed,
+    }
+    app = current_app._get_current_object()
+
+    def cerrar():
+        perfil.disable()
+        datos["duracion_ms"] = round((time.perf_counter() - inicio) * 1000, 1)
+        try:
+            with app.app_context():
+                guardar_perfil(perfil, datos, id_perfil, ahora)
+        except OSError as e:
+            app.logger.error(f"No se pudo guardar el perfil: {str(e)}")
+
+    respuesta.headers["X-Perfil"] = id_perfil
+    if respuesta.is_streamed:
+        # El cuerpo (panel completo, ZIP) aún no se ha generado: se sigue
+        # perfilando hasta que el servidor termine de enviarlo
+        respuesta.call_on_close(cerrar)
+    else:
+        cerrar()
+    return respuesta
+
+
+def nuevo_id_perfil():
+    """ (id, instante) de un perfil nuevo; el id empieza por la fecha. """
+    ahora = time.time()
+    fecha = time.strftime("%Y%m%d-%H%M%S", time.localtime(ahora))
+    return f"{fecha}-{int(ahora * 1e6) % 1000000:06d}-{uuid.uuid4().hex[:6]}", ahora
+
+
+def guardar_perfil(perfil, datos, id_perfil, ahora):
+    """
+    Escribe el .prof (formato pstats) y sus datos en PERFILES_DIR y borra los
+    más antiguos para no pasar de PERFILES_MAX.
+    """
+    directorio = current_app.config["PERFILES_DIR"]
+    os.makedirs(directorio, exist_ok=True)
+
+    perfil.dump_stats(os.path.join(directorio, f"{id_perfil}.prof"))
+    with open(os.path.join(directorio, f"{id_perfil}.json"), "w") as f:
+        json.dump({"id": id_perfil, "fecha": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(ahora)), **datos}, f)
+
+    # El id empieza por la fecha: ordenar por nombre es ordenar por antigüedad
+    ids = sorted(n[:-5] for n in os.listdir(directorio) if n.endswith(".prof"))
+    for viejo in ids[:-current_app.config["PERFILES_MAX"]]:
+        for extension in (".prof", ".json"):
+            try:
+                os.remove(os.path.join(directorio, viejo + extension))
+            except FileNotFoundError:
+                pass
+
+
+def listar_perfiles():
+    directorio = current_app.config["PERFILES_DIR"]
+    if not os.path.isdir(directorio):
+        return []
+    perfiles = []
+    for nombre in sorted(os.listdir(directorio), reverse=True):
+        if not nombre.endswith(".json"):
+            continue
+        try:
+            with open(os.path.join(directorio, nombre)) as f:
+                datos = json.load(f)
+            datos["tamano"] = os.path.getsize(os.path.join(directorio, nombre[:-5] + ".prof"))
+        except (OSError, ValueError):
+            continue
+        perfiles.append(datos)
+    return perfiles
+
+
+def ruta_perfil(id_perfil):
+    """ Ruta del .prof, o None si el id no es válido o ya no existe. """
+    if not PATRON_ID.match(id_perfil):
+        return None
+    ruta = os.path.join(current_app.config["PERFILES_DIR"], f"{id_perfil}.prof")
+    return ruta if os.path.exists(ruta) else None
+
+
+def resumen_perfil(ruta, orden="cumulative", limite=40):
+    salida = io.StringIO()
+    pstats.Stats(ruta, stream=salida).strip_dirs().sort_stats(orden).print_stats(limite)
+    return salida.getvalue()
+
+
+def init_app(app):
+    """
+    PERFILADO=1 activa el perfilado a petición de un superadmin (ver
+    _pide_perfil). Los perfiles se guardan en PERFILES_DIR, como mucho
+    PERFILES_MAX; se consultan en /api/superadmin/perfiles.
+    """
+    app.config["PERFILADO"] = os.getenv("PERFILADO", "0") == "1"
+    app.config["PERFILES_DIR"] = os.getenv("PERFILES_DIR", os.path.join(app.instance_path, "perfiles"))
+    app.config["PERFILES_MAX"] = int(os.getenv("PERFILES_MAX", "50"))
+
+    if app.config["PERFILADO"]:
+        app.before_request(_empezar)
+        app.after_request(_terminar)
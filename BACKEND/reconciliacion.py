@@ -0,0 +1,215 @@
+"""
+Reconciliación de UPLOAD_FOLDER con la base de datos:
+
+    flask --app app:create_app reconciliar-archivos            # solo informa
+    flask --app app:create_app reconciliar-archivos --borrar   # borra
+
+Busca archivos huérfanos (en disco pero sin Documento ni Blob que los
+nombre, incluidos los temporales de subidas fallidas en .tmp) y filas
+colgantes (Documento subido cuyo archivo ya no existe). Con --borrar se
+eliminan los huérfanos y los documentos colgantes más antiguos que
+--min-edad (por el ORM, así se liberan sus blobs y se avisa por SSE).
+
+La memoria no depende del número de archivos: el árbol se recorre en orden
+y las rutas de la base de datos llegan ordenadas por cursores de servidor,
+así que se comparan como en un merge join sin guardar ninguno de los dos
+lados. Los listados de directorios se piden por adelantado a un pool de
+hilos.
+"""
+import heapq
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import select
+
+from almacenamiento import almacenamiento, AlmacenamientoLocal
+from models import db, Blob, Documento
+
+LOTE = 1000
+
+
+def _listar(directorio):
+    """
+    Entradas de un directorio ordenadas como sus rutas completas: un
+    subdirectorio "a" va como "a/", así "a-b" queda antes que "a/x" igual que
+    al comparar las rutas como cadenas.
+    """
+    entradas = []
+    try:
+        with os.scandir(directorio) as it:
+            for e in it:
+                if e.is_dir(follow_symlinks=False):
+                    entradas.append((e.name + "/", e.path, None))
+                elif e.is_file(follow_symlinks=False):
+                    st = e.stat(follow_symlinks=False)
+                    entradas.append((e.name, e.path, (st.st_size, st.st_mtime)))
+    except FileNotFoundError:
+        pass
+    entradas.sort()
+    return entradas
+
+
+def recorrer(base, pool):
+    """
+    (ruta, tamaño, mtime) de todos los archivos bajo `base`, en orden de
+    cadena. Cada directorio encarga al pool el listado de todos sus
+    subdirectorios antes de recorrerlos.
+    """
+    def visitar(futuro):
+        entradas = futuro.result()
+        pendientes = {ruta: pool.submit(_listar, ruta) for _, ruta, st in entradas if st is None}
+        for _, ruta, st in entradas:
+            if st is None:
+                yield from visitar(pendientes.pop(ruta))
+            else:
+                yield ruta, st[0], st[1]
+
+    yield from visitar(pool.submit(_listar, base))
+
+
+def _flujo(conn, columna, condicion, prefijo):
+    """ Valores de `columna` ordenados por bytes, con `prefijo` delante (no cambia el orden). """
+    consulta = select(columna).where(columna.isnot(None), condicion).order_by(columna.collate(_orden_binario(conn)))
+    for (valor,) in conn.execution_options(stream_results=True, yield_per=LOTE).execute(consulta):
+        yield prefijo + valor
+
+
+def _orden_binario(conn):
+    return "C" if conn.dialect.name == "postgresql" else "BINARY"
+
+
+def referencias(conn, base):
+    """
+    Todas las rutas absolutas que nombra la base de datos, ordenadas y sin
+    repetir. Cada forma de Documento.ruta va en su propio cursor porque se
+    convierte en ruta absoluta con un prefijo distinto (ver
+    AlmacenamientoLocal.ruta_local); las relativas antiguas pueden estar
+    bajo UPLOAD_FOLDER o bajo su directorio padre y cuentan las dos.
+    """
+    ruta = Documento.__table__.c.ruta
+    absoluta = ruta.like("/%")
+    flujos = [
+        _flujo(conn, ruta, absoluta, ""),
+        _flujo(conn, ruta, ~absoluta, base + os.sep),
+        _flujo(conn, ruta, ~absoluta & ~ruta.like("blobs/%"), os.path.dirname(base) + os.sep),
+        _flujo(conn, Blob.__table__.c.ruta, True, base + os.sep),
+        _flujo(conn, Blob.__table__.c.miniatura, True, base + os.sep),
+    ]
+    anterior = None
+    for valor in heapq.merge(*flujos):
+        if valor != anterior:
+            yield valor
+            anterior = valor
+
+
+def buscar_huerfanos(conn, base, pool):
+    """ (ruta, tamaño, mtime) de los archivos que la base de datos no nombra. """
+    refs = referencias(conn, base)
+    ref = next(refs, None)
+    for ruta, tamano, mtime in recorrer(base, pool):
+        while ref is not None and ref < ruta:
+            ref = next(refs, None)
+        if ref != ruta:
+            yield ruta, tamano, mtime
+
+
+def buscar_colgantes(pool, antes_de):
+    """
+    Lotes de (id, ruta) de documentos subidos antes de `antes_de` cuyo
+    archivo no está en el almacenamiento. Pagina por id con consultas
+    cortas en vez de un cursor abierto, así se puede borrar cada lote
+    antes de pedir el siguiente (SQLite no deja escribir mientras se lee).
+    """
+    alm = almacenamiento()
+    documentos = Documento.__table__
+    consulta = (
+        select(documentos.c.id, documentos.c.ruta)
+        .where(
+            documentos.c.alumno_id.isnot(None),
+            documentos.c.ruta.isnot(None),
+            # La fila se guarda antes que el archivo: una subida en curso no cuenta
+            documentos.c.fecha_creacion < antes_de,
+        )
+        .order_by(documentos.c.id)
+        .limit(LOTE)
+    )
+    ultimo = None
+    while True:
+        pagina = consulta if ultimo is None else consulta.where(documentos.c.id > ultimo)
+        lote = db.session.execute(pagina).all()
+        db.session.commit()
+        if not lote:
+            return
+        ultimo = lote[-1].id
+        existen = pool.map(lambda fila: alm.existe(fila.ruta), lote)
+        colgantes = [(fila.id, fila.ruta) for fila, existe in zip(lote, existen) if not existe]
+        if colgantes:
+            yield colgantes
+
+
+def borrar_documentos(ids):
+    """ Por el ORM: se restan las referencias de los blobs y se publican los eventos. """
+    for doc in Documento.query.filter(Documento.id.in_(ids)).all():
+        db.session.delete(doc)
+    db.session.commit()
+
+
+@click.command("reconciliar-archivos")
+@click.option("--dry-run/--borrar", "simulacion", default=True,
+              help="Solo informar (por defecto) o borrar huérfanos y filas colgantes")
+@click.option("--min-edad", default=24.0, show_default=True,
+              help="Horas: los huérfanos y documentos más recientes no se tocan (subidas en curso)")
+@click.option("--hilos", default=8, show_default=True, help="Hilos para listar directorios y comprobar archivos")
+@click.option("--verbose", "-v", is_flag=True, help="Lista cada archivo y cada fila")
+@with_appcontext
+def reconciliar_archivos(simulacion, min_edad, hilos, verbose):
+    """ Archivos huérfanos en UPLOAD_FOLDER y documentos sin archivo. """
+    limite = time.time() - min_edad * 3600
+    huerfanos = recientes = bytes_huerfanos = 0
+
+    colgantes = 0
+    with ThreadPoolExecutor(max_workers=hilos) as pool:
+        if isinstance(almacenamiento(), AlmacenamientoLocal):
+            base = os.path.abspath(current_app.config["UPLOAD_FOLDER"])
+            with db.engine.connect() as conn:
+                for ruta, tamano, mtime in buscar_huerfanos(conn, base, pool):
+                    if mtime > limite:
+                        recientes += 1
+                        continue
+                    huerfanos += 1
+                    bytes_huerfanos += tamano
+                    if verbose:
+                        click.echo(f"huérfano {ruta} ({tamano} B)")
+                    if not simulacion:
+                        try:
+                            os.remove(ruta)
+                        except OSError as e:
+                            click.echo(f"⚠️ No se pudo borrar {ruta}: {str(e)}", err=True)
+        else:
+            click.echo("ℹ️ Almacenamiento remoto: solo se buscan filas colgantes")
+
+        # Cada lote se borra antes de pedir el siguiente: no se acumulan ids
+        antes_de = datetime.utcnow() - timedelta(seconds=min_edad * 3600)
+        for lote in buscar_colgantes(pool, antes_de):
+            colgantes += len(lote)
+            if verbose:
+                for id_doc, ruta in lote:
+                    click.echo(f"colgante documento {id_doc}: {ruta}")
+            if not simulacion:
+                borrar_documentos([id_doc for id_doc, _ in lote])
+
+    accion = "encontrados" if simulacion else "borrados"
+    click.echo(f"📁 Huérfanos {accion}: {huerfanos} ({bytes_huerfanos / (1024 * 1024):.1f} MB); "
+               f"{recientes} más recientes que {min_edad:g} h sin tocar")
+    click.echo(f"🗂️ Documentos sin archivo {accion}: {colgantes}")
+    if simulacion and (huerfanos or colgantes):
+        click.echo("Simulación: vuelve a ejecutar con --borrar para eliminarlos")
+
+
+def init_app(app):
+    app.cli.add_command(reconciliar_archivos)
@@ -0,0 +1,139 @@
+from sqlalchemy import and_, delete, select, true
+
+from database import db, insert_con_conflictos
+from eventos import publicar
+from models import Documento, PlantillaDocumento
+from versiones import subir_version
+
+MAX_TABLAS_LOTE = 500
+MAX_DOCUMENTOS = 100
+FILAS_POR_INSERT = 500
+
+
+class RequisitosInvalidos(Exception):
+    pass
+
+
+def limpiar_nombres(nombres, campo="documentos"):
+    """ Lista de nombres de documento sin espacios sobrantes ni repetidos, en su orden. """
+    if nombres is None:
+        return []
+    if not isinstance(nombres, list) or not all(isinstance(n, str) for n in nombres):
+        raise RequisitosInvalidos(f"'{campo}' debe ser una lista de nombres")
+    limpios = []
+    for nombre in nombres:
+        nombre = nombre.strip()
+        if not nombre:
+            raise RequisitosInvalidos(f"Hay un nombre vacío en '{campo}'")
+        if len(nombre) > 255:
+            raise RequisitosInvalidos(f"Nombre demasiado largo en '{campo}': {nombre[:30]}...")
+        if nombre not in limpios:
+            limpios.append(nombre)
+    if len(limpios) > MAX_DOCUMENTOS:
+        raise RequisitosInvalidos(f"Como mucho {MAX_DOCUMENTOS} documentos en '{campo}'")
+    return limpios
+
+
+def serializar_plantilla(plantilla):
+    return {
+        "id": plantilla.id,
+        "nombre": plantilla.nombre,
+        "admin_id": plantilla.admin_id,
+        "documentos": [d.nombre for d in plantilla.documentos],
+        "fecha_creacion": plantilla.fecha_creacion.isoformat() if plantilla.fecha_creacion else None,
+    }
+
+
+def fijar_documentos_plantilla(plantilla, nombres):
+    """
+    Deja en la plantilla exactamente `nombres`, en ese orden. Reutiliza las
+    filas de los nombres que ya estaban: borrar y volver a insertar el mismo
+    nombre en un flush choca con la restricción única.
+    """
+    existentes = {d.nombre: d for d in plantilla.documentos}
+    documentos = []
+    for orden, nombre in enumerate(nombres):
+        documento = existentes.pop(nombre, None) or PlantillaDocumento(nombre=nombre)
+        documento.orden = orden
+        documentos.append(documento)
+    plantilla.documentos = documentos
+
+
+def aplicar_requisitos(tabla_ids, añadir=(), quitar=(), reemplazar=False):
+    """
+    Añade los documentos requeridos `añadir` a todas las tablas y quita
+    `quitar`; con reemplazar, quita además todos los que no estén en
+    `añadir`. Son un DELETE y unos INSERT ... ON CONFLICT DO NOTHING sobre el
+    índice único (tabla_id, nombre) de los requeridos, sin cargar nada en el
+    ORM; hace falta el commit del llamador. Devuelve (añadidos, eliminados),
+    listas de filas (id, tabla_id, nombre).
+    """
+    documentos = Documento.__table__
+    requeridos = and_(documentos.c.tabla_id.in_(tabla_ids), documentos.c.alumno_id.is_(None))
+
+    condicion = None
+    if reemplazar:
+        condicion = ~documentos.c.nombre.in_(añadir) if añadir else true()
+    elif quitar:
+        condicion = documentos.c.nombre.in_(quitar)
+
+    eliminados = []
+    if condicion is not None:
+        eliminados = db.session.execute(
+            delete(documentos)
+            .where(requeridos, condicion)
+            .returning(documentos.c.id, documentos.c.tabla_id, documentos.c.nombre)
+        ).all()
+
+    filas = [
+        {"nombre": nombre, "tabla_id": tabla_id, "alumno_id": None, "estado": "pendiente"}
+        for tabla_id in tabla_ids for nombre in añadir
+    ]
+    insert = insert_con_conflictos(db.session.get_bind())
+    añadidos = []
+    for i in range(0, len(filas), FILAS_POR_INSERT):
+        añadidos.extend(db.session.execute(
+            insert(documentos)
+            .values(filas[i:i + FILAS_POR_INSERT])
+            .on_conflict_do_nothing(
+                index_elements=["tabla_id", "nombre"],
+                index_where=documentos.c.alumno_id.is_(None)
+            )
+            .returning(documentos.c.id, documentos.c.tabla_id, documentos.c.nombre)
+        ).all())
+
+    # Sin ORM no saltan los eventos: versión y avisos SSE se hacen aquí
+    for tipo, filas_cambiadas in (("documento_requerido_eliminado", eliminados),
+                                  ("documento_requerido_añadido", añadidos)):
+        for fila in filas_cambiadas:
+            subir_version(fila.tabla_id)
+            publicar(fila.tabla_id, tipo, {"id": fila.id, "nombre": fila.nombre})
+    return añadidos, eliminados
+
+
+def preparar_documentos_requeridos():
+    """
+    Migración para bases de datos anteriores a las plantillas: los
+    requeridos dejan de tener un nombre_archivo inventado, se quitan los
+    repetidos (mismo nombre en la misma tabla, queda el más antiguo) y se
+    borra el índice no único que sustituye uq_documentos_requeridos.
+    Devuelve cuántos repetidos se borraron.
+    """
+    documentos = Documento.__table__
+    otro = documentos.alias("otro")
+    repetido = select(otro.c.id).where(
+        otro.c.alumno_id.is_(None),
+        otro.c.tabla_id == documentos.c.tabla_id,
+        otro.c.nombre == documentos.c.nombre,
+        otro.c.id < documentos.c.id,
+    ).exists()
+
+    with db.engine.begin() as conn:
+        conn.execute(
+            documentos.update()
+            .where(documentos.c.alumno_id.is_(None), documentos.c.nombre_archivo.isnot(None))
+            .values(nombre_archivo=None)
+        )
+        borrados = conn.execute(delete(documentos).where(documentos.c.alumno_id.is_(None), repetido)).rowcount
+        conn.exec_driver_sql("DROP INDEX IF EXISTS ix_documentos_requeridos")
+    return borrados
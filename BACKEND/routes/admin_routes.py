@@ -1,18 +1,41 @@
 import os
+import hashlib
+import uuid
 import jwt
 from datetime import datetime, timedelta, timezone
-from flask import Blueprint, request, jsonify, g, send_file, current_app as app
+from flask import Blueprint, request, jsonify, g, send_file, Response, current_app as app
 from werkzeug.security import generate_password_hash, check_password_hash
 
-from models import db, Tabla, Documento, Administrador, Alumno
+from models import db, Tabla, Documento, Administrador, Alumno, Plantilla
 from decoradores import token_required, superadmin_token_required
+from auth import verificar_token, firmar_token
+from cache_admins import cache_admins
 from utils import generar_hash_credencial, normalizar
+from consultas import query_tablas_completas, serializar_tabla, resumen_tablas, CAMPOS_TABLA, CAMPOS_RESUMEN
+from importacion_alumnos import leer_filas, importar_alumnos, MAX_FILAS_IMPORTACION
+from exportacion_zip import EntradaZip, ZipEnStreaming, parsear_range
+from almacenamiento import almacenamiento, respuesta_archivo
+from eventos import bus_eventos, flujo_sse
+from versiones import respuesta_versionada, respuesta_versionada_en_streaming, cache_respuestas
+from limite_login import comprobar_login
+from busqueda_alumnos import buscar_alumnos, LIMITE_BUSQUEDA
+from requisitos import (
+    aplicar_requisitos, limpiar_nombres, serializar_plantilla, fijar_documentos_plantilla,
+    RequisitosInvalidos, MAX_TABLAS_LOTE
+)
+from perfiles import listar_perfiles, ruta_perfil, resumen_perfil, ORDENES
 from dotenv import load_dotenv
+from sqlalchemy import func
 from sqlalchemy.exc import IntegrityError
 import mimetypes
+from urllib.parse import quote
 
 admin_bp = Blueprint("admin_bp", __name__)
 
+LIMITE_PAGINA_TABLAS = 200
+# Tablas completas que se cargan a la vez al generar el panel en streaming
+LOTE_PANEL = 50
+
 
 @admin_bp.route("/api/login", methods=["POST"])
 def api_login_admin():
@@ -20,6 +43,10 @@ def api_login_admin():
     usuario = data.get("usuario", "").strip().lower()
     contrasena = data.get("contrasena", "").strip()
 
+    rechazo = comprobar_login("admin", usuario)
+    if rechazo:
+        return rechazo
+
     admin = Administrador.query.filter_by(usuario=usuario).first()
     if admin and admin.check_password(contrasena):
         payload = {
@@ -28,7 +55,7 @@ def api_login_admin():
             "es_superadmin": admin.es_superadmin,
             "exp": datetime.now(timezone.utc) + timedelta(hours=12)
         }
-        token = jwt.encode(payload, os.getenv("JWT_SECRET_KEY"), algorithm="HS256")
+        token = firmar_token(payload)
         return jsonify({
             "token": token,
             "es_superadmin": admin.es_superadmin,
@@ -88,6 +115,43 @@ def api_crear_alumno(current_admin, id_tabla):
 
 
 
+@admin_bp.route("/api/admin/tabla/<int:id_tabla>/alumnos/bulk", methods=["POST"])
+@token_required
+def api_crear_alumnos_bulk(current_admin, id_tabla):
+    tabla = Tabla.query.get_or_404(id_tabla)
+
+    if current_admin.id != tabla.admin_id and not current_admin.es_superadmin:
+        return jsonify({"error": "Acceso denegado"}), 403
+
+    try:
+        filas = leer_filas(request)
+    except (ValueError, UnicodeDecodeError) as e:
+        return jsonify({"error": f"Formato no válido: {str(e)}"}), 400
+
+    if not filas:
+        return jsonify({"error": "No hay alumnos que importar"}), 400
+    if len(filas) > MAX_FILAS_IMPORTACION:
+        return jsonify({"error": f"Máximo {MAX_FILAS_IMPORTACION} alumnos por importación"}), 400
+
+    try:
+        informe = importar_alumnos(tabla.id, filas)
+    except Exception as e:
+        db.session.rollback()
+        app.logger.error(f"Error en importación masiva: {str(e)}")
+        return jsonify({"error": f"Error inesperado: {str(e)}"}), 500
+
+    creados = sum(1 for f in informe if f["estado"] == "creado")
+    return jsonify({
+        "mensaje": f"{creados} alumnos creados",
+        "creados": creados,
+        "duplicados": sum(1 for f in informe if f["estado"] == "duplicado"),
+        "invalidos": sum(1 for f in informe if f["estado"] == "invalido"),
+        "filas": informe
+    }), 201 if creados else 200
+
+
+
+
 @admin_bp.route("/api/admin/tabla/<int:id>", methods=["DELETE"])
 @token_required
 def api_eliminar_tabla(current_admin, id):
@@ -162,6 +226,55 @@ def api_eliminar_admin(id):
     db.session.commit()
     return jsonify({"mensaje": "Admin eliminado"}), 200
 
+@admin_bp.route("/api/superadmin/cache_admins", methods=["GET"])
+@superadmin_token_required
+def api_estado_cache_admins():
+    return jsonify(cache_admins.estadisticas()), 200
+
+@admin_bp.route("/api/superadmin/cache_respuestas", methods=["GET"])
+@superadmin_token_required
+def api_estado_cache_respuestas():
+    return jsonify(cache_respuestas.estadisticas()), 200
+
+
+@admin_bp.route("/api/superadmin/perfiles", methods=["GET"])
+@superadmin_token_required
+def api_listar_perfiles():
+    return jsonify({
+        "activo": app.config["PERFILADO"],
+        "max": app.config["PERFILES_MAX"],
+        "perfiles": listar_perfiles()
+    }), 200
+
+
+@admin_bp.route("/api/superadmin/perfiles/<id_perfil>", methods=["GET"])
+@superadmin_token_required
+def api_descargar_perfil(id_perfil):
+    # .prof de pstats: se abre con `python -m pstats`, snakeviz, etc.
+    ruta = ruta_perfil(id_perfil)
+    if ruta is None:
+        return jsonify({"error": "Perfil no encontrado"}), 404
+    return send_file(ruta, mimetype="application/octet-stream", as_attachment=True, download_name=f"{id_perfil}.prof")
+
+
+@admin_bp.route("/api/superadmin/perfiles/<id_perfil>/texto", methods=["GET"])
+@superadmin_token_required
+def api_resumen_perfil(id_perfil):
+    ruta = ruta_perfil(id_perfil)
+    if ruta is None:
+        return jsonify({"error": "Perfil no encontrado"}), 404
+
+    orden = request.args.get("orden", "cumulative")
+    if orden not in ORDENES:
+        return jsonify({"error": f"Orden no válido: {orden}"}), 400
+    try:
+        limite = max(1, min(int(request.args.get("limite", "40")), 500))
+    except ValueError:
+        return jsonify({"error": "Límite no válido"}), 400
+
+    return Response(resumen_perfil(ruta, orden, limite), mimetype="text/plain")
+
+
 @admin_bp.route("/api/admin/tabla/<int:tabla_id>/documento/<int:doc_id>", methods=["DELETE"])
 @token_required
 def api_eliminar_documento_tabla(current_admin, tabla_id, doc_id):
@@ -172,9 +285,7 @@ def api_eliminar_documento_tabla(current_admin, tabla_id, doc_id):
         return jsonify({"error": "Acceso denegado"}), 403
 
     try:
-        if documento.ruta and os.path.exists(documento.ruta):
-            os.remove(documento.ruta)
-
+        # El archivo (o su referencia en el almacén de blobs) se libera tras el commit
         db.session.delete(documento)
         db.session.commit()
         return jsonify({"mensaje": "Documento eliminado"}), 200
@@ -209,17 +320,14 @@ def api_añadir_documento(current_admin, id):
         tabla_id=tabla.id,
         alumno_id=None,
         estado="pendiente",
-        nombre_archivo=f"placeholder_{nombre_doc}_{datetime.utcnow().timestamp()}".replace(" ", "_"),
         ruta=None
     )
-    print("🧪 DEBUG DOC →", nuevo.nombre, nuevo.estado)
-
     try:
         db.session.add(nuevo)
         db.session.commit()
     except IntegrityError:
         db.session.rollback()
-        return jsonify({"error": "Error de integridad: documento duplicado o datos inválidos"}), 400
+        return jsonify({"error": "La tabla ya tiene un documento requerido con ese nombre"}), 400
     except Exception as e:
         import traceback
         traceback.print_exc()
@@ -230,48 +338,151 @@ def api_añadir_documento(current_admin, id):
     return jsonify({"mensaje": "Documento creado"}), 201
 
 
+def _plantilla_del_admin(current_admin, id):
+    plantilla = Plantilla.query.get_or_404(id)
+    if current_admin.id != plantilla.admin_id and not current_admin.es_superadmin:
+        return None
+    return plantilla
+
+
+@admin_bp.route("/api/admin/plantillas", methods=["GET"])
+@token_required
+def api_listar_plantillas(current_admin):
+    plantillas = (
+        Plantilla.query.filter_by(admin_id=current_admin.id)
+        .options(db.selectinload(Plantilla.documentos))
+        .order_by(Plantilla.nombre, Plantilla.id)
+        .all()
+    )
+    return jsonify([serializar_plantilla(p) for p in plantillas]), 200
+
+
+@admin_bp.route("/api/admin/plantillas", methods=["POST"])
+@token_required
+def api_crear_plantilla(current_admin):
+    data = request.get_json(silent=True) or {}
+    nombre = (data.get("nombre") or "").strip()
+    if not nombre:
+        return jsonify({"error": "Nombre de la plantilla requerido"}), 400
+    try:
+        documentos = limpiar_nombres(data.get("documentos"))
+    except RequisitosInvalidos as e:
+        return jsonify({"error": str(e)}), 400
+
+    plantilla = Plantilla(nombre=nombre[:100], admin_id=current_admin.id)
+    fijar_documentos_plantilla(plantilla, documentos)
+    db.session.add(plantilla)
+    db.session.commit()
+    return jsonify(serializar_plantilla(plantilla)), 201
+
+
+@admin_bp.route("/api/admin/plantillas/<int:id>", methods=["PUT"])
+@token_required
+def api_editar_plantilla(current_admin, id):
+    plantilla = _plantilla_del_admin(current_admin, id)
+    if plantilla is None:
+        return jsonify({"error": "Acceso denegado"}), 403
+
+    data = request.get_json(silent=True) or {}
+    if "nombre" in data:
+        nombre = (data.get("nombre") or "").strip()
+        if not nombre:
+            return jsonify({"error": "Nombre de la plantilla requerido"}), 400
+        plantilla.nombre = nombre[:100]
+    if "documentos" in data:
+        try:
+            fijar_documentos_plantilla(plantilla, limpiar_nombres(data.get("documentos")))
+        except RequisitosInvalidos as e:
+            return jsonify({"error": str(e)}), 400
+    db.session.commit()
+    return jsonify(serializar_plantilla(plantilla)), 200
+
+
+@admin_bp.route("/api/admin/plantillas/<int:id>", methods=["DELETE"])
+@token_required
+def api_eliminar_plantilla(current_admin, id):
+    plantilla = _plantilla_del_admin(current_admin, id)
+    if plantilla is None:
+        return jsonify({"error": "Acceso denegado"}), 403
+    db.session.delete(plantilla)
+    db.session.commit()
+    return jsonify({"mensaje": "Plantilla eliminada"}), 200
+
+
+@admin_bp.route("/api/admin/requisitos/lote", methods=["POST"])
+@token_required
+def api_requisitos_lote(current_admin):
+    """
+    Cambia los documentos requeridos de varias tablas en una transacción:
+    {"tablas": [ids], "plantilla_id": id, "añadir": [nombres],
+     "quitar": [nombres], "reemplazar": false}
+    Se añaden los de la plantilla y los de "añadir"; con "reemplazar" las
+    tablas se quedan exactamente con esos.
+    """
+    data = request.get_json(silent=True) or {}
+    tabla_ids = data.get("tablas")
+    if not isinstance(tabla_ids, list) or not tabla_ids or not all(isinstance(t, int) for t in tabla_ids):
+        return jsonify({"error": "'tablas' debe ser una lista de ids"}), 400
+    tabla_ids = sorted(set(tabla_ids))
+    if len(tabla_ids) > MAX_TABLAS_LOTE:
+        return jsonify({"error": f"Como mucho {MAX_TABLAS_LOTE} tablas por lote"}), 400
+
+    try:
+        añadir = limpiar_nombres(data.get("añadir"), "añadir")
+        quitar = limpiar_nombres(data.get("quitar"), "quitar")
+    except RequisitosInvalidos as e:
+        return jsonify({"error": str(e)}), 400
+
+    if data.get("plantilla_id") is not None:
+        if not isinstance(data["plantilla_id"], int):
+            return jsonify({"error": "'plantilla_id' inválido"}), 400
+        plantilla = _plantilla_del_admin(current_admin, data["plantilla_id"])
+        if plantilla is None:
+            return jsonify({"error": "Acceso denegado"}), 403
+        de_plantilla = [d.nombre for d in plantilla.documentos]
+        añadir = de_plantilla + [n for n in añadir if n not in de_plantilla]
+
+    reemplazar = bool(data.get("reemplazar"))
+    if set(añadir) & set(quitar):
+        return jsonify({"error": "Un documento no puede estar a la vez en 'añadir' y en 'quitar'"}), 400
+    if not añadir and not quitar and not reemplazar:
+        return jsonify({"error": "No hay nada que cambiar"}), 400
+
+    propietarios = dict(db.session.query(Tabla.id, Tabla.admin_id).filter(Tabla.id.in_(tabla_ids)).all())
+    faltan = [t for t in tabla_ids if t not in propietarios]
+    if faltan:
+        return jsonify({"error": f"Tablas no encontradas: {faltan}"}), 404
+    if not current_admin.es_superadmin and any(a != current_admin.id for a in propietarios.values()):
+        return jsonify({"error": "Acceso denegado"}), 403
+
+    try:
+        añadidos, eliminados = aplicar_requisitos(tabla_ids, añadir, quitar, reemplazar)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        app.logger.error(f"Error al aplicar requisitos en lote: {str(e)}")
+        return jsonify({"error": "Error al aplicar los requisitos"}), 500
+
+    return jsonify({"tablas": len(tabla_ids), "añadidos": len(añadidos), "eliminados": len(eliminados)}), 200
+
 @admin_bp.route("/api/admin/tabla/<int:id>", methods=["GET"])
 @token_required
 def api_ver_tabla(current_admin, id):
-    tabla = Tabla.query.get_or_404(id)
-    print("TABLA:", tabla.id, "ADMIN DE TABLA:", tabla.admin_id, "ADMIN LOGUEADO:", current_admin.id)
+    # Solo se lee la versión; los hijos se cargan si no hay 304 ni caché
+    admin_id, version = (
+        db.session.query(Tabla.admin_id, func.coalesce(Tabla.version, 0))
+        .filter(Tabla.id == id)
+        .first_or_404()
+    )
 
-    if current_admin.id != tabla.admin_id and not current_admin.es_superadmin:
-        print("❌ ACCESO DENEGADO")
+    if current_admin.id != admin_id and not current_admin.es_superadmin:
         return jsonify({"error": "Acceso denegado"}), 403
 
-    alumnos = [
-        {"id": a.id, "nombre": a.nombre, "apellidos": a.apellidos}
-        for a in tabla.alumnos
-    ]
-    print("📚 Alumnos encontrados:", alumnos)
-
-    documentos = [
-        {"id": d.id, "nombre": d.nombre}
-        for d in tabla.documentos if d.alumno_id is None
-    ]
-    print("📄 Documentos requeridos:", documentos)
-
-    documentos_subidos = Documento.query.filter_by(tabla_id=tabla.id).filter(Documento.alumno_id.isnot(None)).all()
-    print("📥 Subidos encontrados:", len(documentos_subidos))
-
-    subidos = []
-    for d in documentos_subidos:
-        subidos.append({
-            "id": d.id,
-            "nombre": d.nombre,
-            "alumno_id": d.alumno.id,
-            "alumno_nombre": f"{d.alumno.nombre} {d.alumno.apellidos}",
-            "estado": d.estado
-        })
+    return respuesta_versionada(("tabla", id, version, "admin"), lambda: _tabla_serializada(id))
 
-    return jsonify({
-        "id": tabla.id,
-        "nombre": tabla.nombre,
-        "alumnos": alumnos,
-        "documentos": documentos,
-        "subidos": subidos
-    }), 200
+
+def _tabla_serializada(id):
+    return serializar_tabla(query_tablas_completas().filter(Tabla.id == id).first_or_404())
 
 
 
@@ -288,57 +499,61 @@ def api_listar_tablas(current_admin):
     else:
         admin_id = current_admin.id
 
-    tablas = Tabla.query.filter_by(admin_id=admin_id).all()
+    # Paginación opcional por keyset: ?after=<id ultima tabla>&limit=<n>
+    try:
+        after = int(request.args["after"]) if request.args.get("after") else None
+        limit = int(request.args["limit"]) if request.args.get("limit") else None
+    except ValueError:
+        return jsonify({"error": "Parámetros de paginación inválidos"}), 400
+    if limit is not None:
+        limit = max(1, min(limit, LIMITE_PAGINA_TABLAS))
+
+    resultado = resumen_tablas(admin_id, after=after, limit=limit)
 
-    resultado = []
-    for tabla in tablas:
-        resultado.append({
-            "id": tabla.id,
-            "nombre": tabla.nombre,
-            "alumnos": len(tabla.alumnos)
-        })
+    if limit is not None:
+        siguiente = resultado[-1]["id"] if len(resultado) == limit else None
+        return jsonify({"tablas": resultado, "siguiente": siguiente}), 200
 
     return jsonify({"tablas": resultado}), 200
 
 
 
+@admin_bp.route("/api/admin/alumnos/search", methods=["GET"])
+@token_required
+def api_buscar_alumnos(current_admin):
+    """
+    Busca alumnos por nombre y apellidos (sin tildes ni mayúsculas) en las
+    tablas del admin; el superadmin en todas, o en las de ?admin_id=.
+    Pagina con ?after=<id del último alumno>&limit=<n>.
+    """
+    q = request.args.get("q", "")
+    if len(q) > 200:
+        return jsonify({"error": "Búsqueda demasiado larga"}), 400
+
+    admin_id = current_admin.id
+    try:
+        if current_admin.es_superadmin:
+            admin_id = int(request.args["admin_id"]) if request.args.get("admin_id") else None
+        after = uuid.UUID(request.args["after"]) if request.args.get("after") else None
+        limit = int(request.args.get("limit", 20))
+    except ValueError:
+        return jsonify({"error": "Parámetros de búsqueda inválidos"}), 400
+    limit = max(1, min(limit, LIMITE_BUSQUEDA))
+
+    alumnos = buscar_alumnos(q, admin_id=admin_id, after=after, limit=limit)
+    siguiente = alumnos[-1]["id"] if len(alumnos) == limit else None
+    return jsonify({"alumnos": alumnos, "siguiente": siguiente}), 200
+
+
 @admin_bp.route("/api/superadmin/tabla/<int:id>", methods=["GET"])
 @superadmin_token_required
 def api_ver_tabla_superadmin(id):
-    tabla = Tabla.query.get_or_404(id)
-
-    alumnos = [
-        {"id": a.id, "nombre": a.nombre, "apellidos": a.apellidos}
-        for a in tabla.alumnos
-    ]
-    print("📚 Alumnos encontrados (superadmin):", alumnos)
-
-    documentos = [
-        {"id": d.id, "nombre": d.nombre}
-        for d in tabla.documentos if d.alumno_id is None
-    ]
-    print("📄 Documentos requeridos (superadmin):", documentos)
-
-    documentos_subidos = Documento.query.filter_by(tabla_id=tabla.id).filter(Documento.alumno_id.isnot(None)).all()
-    print("📥 Subidos encontrados (superadmin):", len(documentos_subidos))
-
-    subidos = []
-    for d in documentos_subidos:
-        subidos.append({
-            "id": d.id,
-            "nombre": d.nombre,
-            "alumno_id": d.alumno.id,
-            "alumno_nombre": f"{d.alumno.nombre} {d.alumno.apellidos}",
-            "estado": d.estado
-        })
-
-    return jsonify({
-        "id": tabla.id,
-        "nombre": tabla.nombre,
-        "alumnos": alumnos,
-        "documentos": documentos,
-        "subidos": subidos
-    }), 200
+    version = (
+        db.session.query(func.coalesce(Tabla.version, 0))
+        .filter(Tabla.id == id)
+        .first_or_404()[0]
+    )
+    return respuesta_versionada(("tabla", id, version, "admin"), lambda: _tabla_serializada(id))
 
 
 
@@ -346,46 +561,86 @@ def api_ver_tabla_superadmin(id):
 @admin_bp.route("/api/superadmin/panel_admin/<int:admin_id>", methods=["GET"])
 @superadmin_token_required
 def api_panel_admin_completo(admin_id):
+    """
+    Tablas de un admin. Parámetros opcionales:
+      ?modo=resumen          solo contadores, calculados en SQL
+      ?fields=id,nombre,...  solo esos campos de cada tabla
+      ?after=<id>&limit=<n>  paginación por keyset, como en /api/admin/tablas
+    Sin limit, el modo completo se envía en streaming por lotes de tablas.
+    """
     admin = Administrador.query.get_or_404(admin_id)
-    tablas = Tabla.query.filter_by(admin_id=admin.id).all()
-
-    resultado = []
-    for tabla in tablas:
-        alumnos = [{
-            "id": a.id,
-            "nombre": a.nombre,
-            "apellidos": a.apellidos
-        } for a in tabla.alumnos]
-
-        documentos = [{
-            "id": d.id,
-            "nombre": d.nombre
-        } for d in tabla.documentos if d.alumno_id is None]
-
-        subidos = [{
-            "id": d.id,
-            "nombre": d.nombre,
-            "alumno_id": d.alumno.id,
-            "alumno_nombre": f"{d.alumno.nombre} {d.alumno.apellidos}",
-            "estado": d.estado
-        } for d in tabla.documentos if d.alumno_id is not None]
-
-        resultado.append({
-            "id": tabla.id,
-            "nombre": tabla.nombre,
-            "alumnos": alumnos,
-            "documentos": documentos,
-            "subidos": subidos
-        })
+    admin_id, admin_nombre = admin.id, admin.nombre
 
-    return jsonify({
-        "admin_id": admin.id,
-        "admin_nombre": admin.nombre,
-        "tablas": resultado
-    }), 200
-
-
-@admin_bp.route("/api/admin/tabla/<int:id_tabla>/alumno/<id_alumno>", methods=["DELETE", "OPTIONS"])
+    try:
+        after = int(request.args["after"]) if request.args.get("after") else None
+        limit = int(request.args["limit"]) if request.args.get("limit") else None
+    except ValueError:
+        return jsonify({"error": "Parámetros de paginación inválidos"}), 400
+    if limit is not None:
+        limit = max(1, min(limit, LIMITE_PAGINA_TABLAS))
+
+    modo = request.args.get("modo", "completo")
+    if modo not in ("completo", "resumen"):
+        return jsonify({"error": f"Modo desconocido: {modo}"}), 400
+
+    validos = CAMPOS_RESUMEN if modo == "resumen" else CAMPOS_TABLA
+    campos = [c.strip() for c in request.args.get("fields", "").split(",") if c.strip()] or list(validos)
+    desconocidos = [c for c in campos if c not in validos]
+    if desconocidos:
+        return jsonify({"error": f"Campos desconocidos: {', '.join(desconocidos)}"}), 400
+
+    # Versiones de las tablas de esta página: fijan el ETag y qué tablas se envían
+    consulta = (
+        db.session.query(Tabla.id, func.coalesce(Tabla.version, 0))
+        .filter(Tabla.admin_id == admin_id)
+        .order_by(Tabla.id)
+    )
+    if after is not None:
+        consulta = consulta.filter(Tabla.id > after)
+    if limit is not None:
+        consulta = consulta.limit(limit)
+    versiones = [tuple(v) for v in consulta]
+    ids = [tabla_id for tabla_id, _ in versiones]
+
+    huella = hashlib.sha1(
+        repr((admin_nombre, versiones, modo, campos, after, limit)).encode()
+    ).hexdigest()[:16]
+    clave = ("panel", admin_id, huella)
+
+    cabecera = {"admin_id": admin_id, "admin_nombre": admin_nombre}
+    if limit is not None:
+        cabecera["siguiente"] = ids[-1] if len(ids) == limit else None
+
+    if modo == "resumen":
+        def construir():
+            filas = resumen_tablas(admin_id, after=after, limit=limit)
+            return {**cabecera, "tablas": [{c: f[c] for c in campos} for f in filas]}
+        return respuesta_versionada(clave, construir)
+
+    if limit is not None:
+        def construir():
+            tablas = query_tablas_completas(campos).filter(Tabla.id.in_(ids)).order_by(Tabla.id).all()
+            return {**cabecera, "tablas": [serializar_tabla(t, campos) for t in tablas]}
+        return respuesta_versionada(clave, construir)
+
+    def generar():
+        # Se escribe a mano el JSON para no tener nunca el panel entero en memoria
+        yield app.json.dumps(cabecera)[:-1] + ', "tablas": ['
+        separador = ""
+        for n in range(0, len(ids), LOTE_PANEL):
+            lote = ids[n:n + LOTE_PANEL]
+            tablas = query_tablas_completas(campos).filter(Tabla.id.in_(lote)).order_by(Tabla.id).all()
+            for tabla in tablas:
+                yield separador + app.json.dumps(serializar_tabla(tabla, campos))
+                separador = ","
+            # Lo ya enviado no debe quedarse en el identity map de la sesión
+            db.session.expunge_all()
+        yield "]}"
+
+    return respuesta_versionada_en_streaming(clave, generar)
+
+
+@admin_bp.route("/api/admin/tabla/<int:id_tabla>/alumno/<uuid:id_alumno>", methods=["DELETE", "OPTIONS"])
 @token_required
 def eliminar_alumno_de_tabla(current_admin, id_tabla, id_alumno):
     try:
@@ -396,17 +651,17 @@ def eliminar_alumno_de_tabla(current_admin, id_tabla, id_alumno):
         if tabla.admin_id != current_admin.id:
             return jsonify({"error": "No tienes permiso para modificar esta tabla"}), 403
 
-        # Buscar y eliminar relación alumno-tabla
         alumno = Alumno.query.get(id_alumno)
-        if not alumno or alumno not in tabla.alumnos:
+        if not alumno or alumno.tabla_id != tabla.id:
             return jsonify({"error": "Alumno no pertenece a esta tabla"}), 404
 
-        tabla.alumnos.remove(alumno)
+        # Sus documentos los borra la base de datos; los archivos, la tarea limpiar_archivos
+        db.session.delete(alumno)
         db.session.commit()
         return jsonify({"mensaje": "Alumno eliminado de la tabla"}), 200
 
     except Exception as e:
-        print("Error eliminando alumno:", e)
+        app.logger.error(f"Error eliminando alumno: {str(e)}")
         return jsonify({"error": "Error eliminando alumno"}), 500
     
 @admin_bp.route('/api/admin/documento/<int:documento_id>', methods=['GET'])
@@ -414,18 +669,17 @@ def eliminar_alumno_de_tabla(current_admin, id_tabla, id_alumno):
 def descargar_documento(current_user, documento_id):
     doc = Documento.query.get_or_404(documento_id)
 
-    ruta_completa = os.path.join(os.getcwd(), doc.ruta)
-
-    print(f"🪵 Intentando enviar archivo: {ruta_completa}")
-
-    if not os.path.exists(ruta_completa):
-        print("❌ Archivo no encontrado")
-        return jsonify({'error': 'El archivo no se encuentra en el servidor'}), 404
-
     try:
-        return send_file(ruta_completa, as_attachment=True)
+        mimetype, _ = mimetypes.guess_type(doc.nombre_archivo or doc.ruta)
+        return respuesta_archivo(
+            doc.ruta, doc.nombre_archivo, mimetype or "application/octet-stream", adjunto=True,
+            etag=doc.sha256, modificado=doc.fecha_creacion
+        )
+    except FileNotFoundError:
+        app.logger.warning(f"Archivo no encontrado: {doc.ruta}")
+        return jsonify({'error': 'El archivo no se encuentra en el servidor'}), 404
     except Exception as e:
-        print(f"🔥 Error en send_file: {e}")
+        app.logger.error(f"Error enviando archivo {doc.ruta}: {str(e)}")
         return jsonify({
             'error': 'Error al descargar el archivo',
             'detalle': str(e)
@@ -440,7 +694,7 @@ def ver_documento_admin(documento_id):
         return jsonify({"error": "Token requerido"}), 401
 
     try:
-        payload = jwt.decode(token, os.getenv("JWT_SECRET_KEY"), algorithms=["HS256"])
+        payload = verificar_token(token)
         # Aquí podrías validar permisos si lo necesitas (ej: superadmin o admin)
     except jwt.ExpiredSignatureError:
         return jsonify({"error": "Token expirado"}), 401
@@ -448,28 +702,186 @@ def ver_documento_admin(documento_id):
         return jsonify({"error": "Token inválido"}), 403
 
     doc = Documento.query.get_or_404(documento_id)
-    ruta_completa = os.path.join(os.getcwd(), doc.ruta)
-
-    print(f"👁️ Intentando mostrar archivo: {ruta_completa}")
-
-    if not os.path.exists(ruta_completa):
-        return jsonify({'error': 'El archivo no se encuentra en el servidor'}), 404
 
     try:
-        mimetype, _ = mimetypes.guess_type(ruta_completa)
-        return send_file(
-            ruta_completa,
-            mimetype=mimetype or "application/octet-stream"
+        mimetype, _ = mimetypes.guess_type(doc.nombre_archivo or doc.ruta)
+        return respuesta_archivo(
+            doc.ruta, doc.nombre_archivo, mimetype or "application/octet-stream",
+            etag=doc.sha256, modificado=doc.fecha_creacion
         )
+    except FileNotFoundError:
+        return jsonify({'error': 'El archivo no se encuentra en el servidor'}), 404
     except Exception as e:
-        print(f"🔥 Error al mostrar archivo: {e}")
+        app.logger.error(f"Error al mostrar archivo {doc.ruta}: {str(e)}")
         return jsonify({
             'error': 'Error al mostrar el archivo',
             'detalle': str(e)
         }), 500
 
 
+@admin_bp.route('/api/admin/documento/<int:documento_id>/miniatura', methods=['GET'])
+def miniatura_documento_admin(documento_id):
+    # Token por query string, como en ver_documento_admin, para usarla en un <img>
+    token = request.args.get("token")
 
+    if not token:
+        return jsonify({"error": "Token requerido"}), 401
 
+    try:
+        payload = verificar_token(token)
+    except jwt.ExpiredSignatureError:
+        return jsonify({"error": "Token expirado"}), 401
+    except jwt.InvalidTokenError:
+        return jsonify({"error": "Token inválido"}), 403
+
+    # Los tokens de alumno se firman con la misma clave: hace falta un admin
+    if payload.get("id") is None:
+        return jsonify({"error": "Acceso denegado"}), 403
+
+    doc = Documento.query.get_or_404(documento_id)
+    if payload["id"] != doc.tabla.admin_id and not payload.get("es_superadmin"):
+        return jsonify({"error": "Acceso denegado"}), 403
+    if doc.blob is None or not doc.blob.miniatura:
+        return jsonify({"error": "Miniatura no disponible"}), 404
+
+    try:
+        return respuesta_archivo(
+            doc.blob.miniatura, f"{doc.nombre}.png", "image/png",
+            etag=f"{doc.sha256}-miniatura", modificado=doc.fecha_creacion
+        )
+    except FileNotFoundError:
+        return jsonify({"error": "Miniatura no disponible"}), 404
 
 
+
+
+
+
+
+
+@admin_bp.route('/api/admin/tabla/<int:id>/export.zip', methods=['GET'])
+def exportar_tabla_zip(id):
+    # El token llega por query string, igual que en ver_documento_admin, para
+    # que el navegador pueda descargar el ZIP directamente a disco
+    token = request.args.get("token") or request.headers.get("Authorization", "").replace("Bearer ", "")
+
+    if not token:
+        return jsonify({"error": "Token requerido"}), 401
+
+    try:
+        payload = verificar_token(token)
+    except jwt.ExpiredSignatureError:
+        return jsonify({"error": "Token expirado"}), 401
+    except jwt.InvalidTokenError:
+        return jsonify({"error": "Token inválido"}), 403
+
+    tabla = Tabla.query.get_or_404(id)
+    if payload.get("id") != tabla.admin_id and not payload.get("es_superadmin"):
+        return jsonify({"error": "Acceso denegado"}), 403
+
+    filas = (
+        db.session.query(Documento, Alumno)
+        .join(Alumno, Documento.alumno_id == Alumno.id)
+        .options(db.selectinload(Documento.blob))
+        .filter(Documento.tabla_id == tabla.id)
+        .order_by(Alumno.apellidos, Alumno.nombre, Alumno.id, Documento.nombre)
+        .all()
+    )
+
+    alm = almacenamiento()
+    entradas = []
+    usados = set()
+    for doc, alumno in filas:
+        if not doc.ruta:
+            continue
+        # Tamaño y fecha salen de la base de datos: info() es un HEAD por
+        # archivo en S3. Solo los documentos antiguos sin ellos lo necesitan;
+        # si falta un archivo, la descarga falla al llegar a él
+        tamano = doc.blob.tamano if doc.blob is not None and doc.blob.tamano is not None else doc.tamano
+        if tamano is not None and doc.fecha_creacion is not None:
+            mtime = doc.fecha_creacion.replace(tzinfo=timezone.utc).timestamp()
+        else:
+            try:
+                tamano, mtime = alm.info(doc.ruta)
+            except FileNotFoundError:
+                app.logger.warning(f"Exportación tabla {tabla.id}: falta el archivo {doc.ruta}")
+                continue
+
+        carpeta = f"{alumno.nombre} {alumno.apellidos}".replace("/", "_").replace("\\", "_")
+        extension = os.path.splitext(doc.nombre_archivo or doc.ruta)[1].lower()
+        base = f"{carpeta}/{doc.nombre.replace('/', '_')}"
+        nombre_zip = f"{base}{extension}"
+        n = 1
+        while nombre_zip in usados:
+            n += 1
+            nombre_zip = f"{base}_{n}{extension}"
+        usados.add(nombre_zip)
+        entradas.append(EntradaZip(
+            nombre_zip, tamano, mtime,
+            lambda inicio, clave=doc.ruta: alm.abrir(clave, inicio),
+            crc32=doc.blob.crc32 if doc.blob is not None else None
+        ))
+
+    zip_stream = ZipEnStreaming(entradas)
+    total = zip_stream.tamano_total
+    etag = zip_stream.etag
+
+    cabeceras = {
+        "Content-Disposition": f"attachment; filename*=UTF-8''{quote(tabla.nombre)}.zip",
+        "Accept-Ranges": "bytes",
+        "ETag": f'"{etag}"',
+        "Cache-Control": "private, no-cache",
+    }
+
+    rango = None
+    if_range = request.headers.get("If-Range")
+    if not if_range or if_range.strip('"') == etag:
+        try:
+            rango = parsear_range(request.headers.get("Range"), total)
+        except ValueError:
+            cabeceras["Content-Range"] = f"bytes */{total}"
+            return Response(status=416, headers=cabeceras)
+
+    if rango:
+        inicio, fin = rango
+        status = 206
+        cabeceras["Content-Range"] = f"bytes {inicio}-{fin}/{total}"
+    else:
+        inicio, fin = 0, total - 1
+        status = 200
+    cabeceras["Content-Length"] = str(fin - inicio + 1)
+
+    return Response(
+        zip_stream.generar(inicio, fin),
+        status=status,
+        headers=cabeceras,
+        mimetype="application/zip",
+        direct_passthrough=True
+    )
+
+
+@admin_bp.route('/api/admin/tabla/<int:id>/events', methods=['GET'])
+def eventos_tabla(id):
+    # EventSource no permite cabeceras: el token llega por query string
+    token = request.args.get("token") or request.headers.get("Authorization", "").replace("Bearer ", "")
+
+    if not token:
+        return jsonify({"error": "Token requerido"}), 401
+
+    try:
+        payload = verificar_token(token)
+    except jwt.ExpiredSignatureError:
+        return jsonify({"error": "Token expirado"}), 401
+    except jwt.InvalidTokenError:
+        return jsonify({"error": "Token inválido"}), 403
+
+    tabla = Tabla.query.get_or_404(id)
+    if payload.get("id") != tabla.admin_id and not payload.get("es_superadmin"):
+        return jsonify({"error": "Acceso denegado"}), 403
+
+    suscripcion = bus_eventos.suscribir(tabla.id)
+    return Response(
+        flujo_sse(suscripcion),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
@@ -1,11 +1,20 @@
 import os
 import jwt
 from datetime import datetime, timedelta
-from flask import Blueprint, request, jsonify, g, send_file, current_app as app
+from flask import Blueprint, request, jsonify, g, send_file, Response, current_app as app
 from models import Alumno, Documento, Tabla
 from decoradores import alumno_token_required
+from auth import verificar_token, firmar_token
 from utils import generar_hash_credencial, normalizar
 from models import db
+from almacen_blobs import clave_blob, añadir_referencia, colocar_blob
+from subidas import recibir_subida, limite_para, SubidaInvalida, ArchivoDemasiadoGrande
+from almacenamiento import respuesta_archivo
+from analisis_archivos import encolar_analisis
+from eventos import bus_eventos, flujo_sse
+from versiones import respuesta_versionada
+from limite_login import comprobar_login
+from sqlalchemy import func
 import mimetypes
 
 alumno_bp = Blueprint("alumno_bp", __name__)
@@ -13,17 +22,28 @@ alumno_bp = Blueprint("alumno_bp", __name__)
 @alumno_bp.route("/api/alumno/<uuid:alumno_id>/subir", methods=["POST"])
 @alumno_token_required
 def api_subir_documentos(alumno_id):
+    alumno = Alumno.query.get_or_404(alumno_id)
+    tabla = alumno.tabla
+
     try:
-        archivo = request.files.get('archivo')
-        doc_nombre = request.form.get('nombre_documento')
+        subida = recibir_subida(
+            request,
+            os.path.join(app.config['UPLOAD_FOLDER'], ".tmp"),
+            lambda tipo: limite_para(app.config, tipo)
+        )
+    except ArchivoDemasiadoGrande as e:
+        return jsonify({"error": str(e)}), 413
+    except SubidaInvalida as e:
+        return jsonify({"error": f"Faltan datos: {str(e)}"}), 400
 
-        if not archivo or not archivo.filename or not doc_nombre:
+    try:
+        doc_nombre = subida.campos.get('nombre_documento')
+        if not doc_nombre:
+            subida.descartar()
             return jsonify({"error": "Faltan datos"}), 400
 
-        alumno = Alumno.query.get_or_404(str(alumno_id))
-        tabla = alumno.tabla
-
         if not Documento.query.filter_by(tabla_id=tabla.id, nombre=doc_nombre, alumno_id=None).first():
+            subida.descartar()
             return jsonify({"error": "Documento no requerido para esta tabla"}), 400
 
         doc_existente = Documento.query.filter_by(
@@ -32,19 +52,16 @@ def api_subir_documentos(alumno_id):
             nombre=doc_nombre
         ).first()
 
-        extension = os.path.splitext(archivo.filename)[1].lower()
+        extension = os.path.splitext(subida.nombre_original)[1].lower()
         timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
         filename = f"{alumno.id}_{doc_nombre}_{timestamp}{extension}"
-        path_dir = os.path.join(app.config['UPLOAD_FOLDER'], str(tabla.id), str(alumno.id))
-        os.makedirs(path_dir, exist_ok=True)
-        ruta = os.path.join(path_dir, filename)
+        # El contenido se guarda una sola vez por hash; nombre_archivo conserva el nombre lógico
+        ruta = clave_blob(subida.sha256)
 
         if doc_existente:
-            if doc_existente.ruta and os.path.exists(doc_existente.ruta):
-                os.remove(doc_existente.ruta)
             db.session.delete(doc_existente)
-
-        archivo.save(ruta)
+            # El DELETE debe ir antes que el INSERT: si no, el mismo nombre_archivo choca
+            db.session.flush()
 
         nuevo_doc = Documento(
             nombre=doc_nombre,
@@ -52,62 +69,87 @@ def api_subir_documentos(alumno_id):
             alumno_id=alumno.id,
             nombre_archivo=filename,
             ruta=ruta,
-            estado='subido'
+            estado='subido',
+            sha256=subida.sha256,
+            tamano=subida.tamano
         )
         db.session.add(nuevo_doc)
+        añadir_referencia(subida.sha256, ruta, subida.tamano, subida.crc32)
+        # El archivo se coloca antes del commit, con la fila del blob ya
+        # bloqueada: si falla, el rollback conserva el documento anterior y
+        # ninguna fila confirmada apunta a un archivo que no existe
+        colocar_blob(subida, ruta)
         db.session.commit()
 
-        return jsonify({
-            "mensaje": "Documento subido correctamente",
-            "documento": {
-                "id": nuevo_doc.id,
-                "nombre": nuevo_doc.nombre,
-                "estado": nuevo_doc.estado
-            }
-        }), 200
-
     except Exception as e:
+        # Si el archivo ya estaba colocado se queda sin referencias; lo
+        # recoge reconciliar-archivos
         db.session.rollback()
+        subida.descartar()
         app.logger.error(f"Error en subida API: {str(e)}")
         return jsonify({"error": "Error interno al subir"}), 500
 
+    # Tipo real, páginas y miniatura se calculan en segundo plano
+    try:
+        encolar_analisis(subida.sha256)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        app.logger.error(f"Error encolando el análisis de {subida.sha256}: {str(e)}")
+
+    return jsonify({
+        "mensaje": "Documento subido correctamente",
+        "documento": {
+            "id": nuevo_doc.id,
+            "nombre": nuevo_doc.nombre,
+            "estado": nuevo_doc.estado
+        }
+    }), 200
+
 
 @alumno_bp.route("/api/alumno/<uuid:alumno_id>/documentos", methods=["GET"])
 @alumno_token_required
 def api_documentos_alumno(alumno_id):
-    alumno = Alumno.query.get_or_404(str(alumno_id))
-    tabla = alumno.tabla
+    tabla_id, version = (
+        db.session.query(Alumno.tabla_id, func.coalesce(Tabla.version, 0))
+        .join(Tabla, Alumno.tabla_id == Tabla.id)
+        .filter(Alumno.id == alumno_id)
+        .first_or_404()
+    )
+
+    def construir():
+        documentos_requeridos = Documento.query.filter_by(
+            tabla_id=tabla_id, 
+            alumno_id=None
+        ).all()
+
+        documentos_subidos = Documento.query.filter_by(
+            tabla_id=tabla_id, 
+            alumno_id=alumno_id
+        ).all()
+
+        subidos_dict = {doc.nombre: doc for doc in documentos_subidos}
+
+        documentos = []
+        for doc in documentos_requeridos:
+            doc_info = {
+                "nombre": doc.nombre,
+                "estado": "no_subido",
+                "subido": False,
+                "id": None
+            }
 
-    documentos_requeridos = Documento.query.filter_by(
-        tabla_id=tabla.id, 
-        alumno_id=None
-    ).all()
-
-    documentos_subidos = Documento.query.filter_by(
-        tabla_id=tabla.id, 
-        alumno_id=alumno.id
-    ).all()
-
-    subidos_dict = {doc.nombre: doc for doc in documentos_subidos}
-
-    documentos = []
-    for doc in documentos_requeridos:
-        doc_info = {
-            "nombre": doc.nombre,
-            "estado": "no_subido",
-            "subido": False,
-            "id": None
-        }
+            if doc.nombre in subidos_dict:
+                subido = subidos_dict[doc.nombre]
+                doc_info["estado"] = subido.estado
+                doc_info["subido"] = True
+                doc_info["id"] = subido.id
 
-        if doc.nombre in subidos_dict:
-            subido = subidos_dict[doc.nombre]
-            doc_info["estado"] = subido.estado
-            doc_info["subido"] = True
-            doc_info["id"] = subido.id
+            documentos.append(doc_info)
 
-        documentos.append(doc_info)
+        return {"documentos": documentos}
 
-    return jsonify({"documentos": documentos}), 200
+    return respuesta_versionada(("alumno", tabla_id, version, str(alumno_id)), construir)
 
 
 @alumno_bp.route("/api/alumno/<uuid:alumno_id>/documentos/<int:doc_id>/eliminar", methods=["DELETE"])
@@ -119,9 +161,7 @@ def api_eliminar_documento(alumno_id, doc_id):
         return jsonify({"error": "Este documento no te pertenece"}), 403
 
     try:
-        if doc.ruta and os.path.exists(doc.ruta):
-            os.remove(doc.ruta)
-
+        # El archivo (o su referencia en el almacén de blobs) se libera tras el commit
         db.session.delete(doc)
         db.session.commit()
         return jsonify({"mensaje": "Documento eliminado"}), 200
@@ -147,7 +187,6 @@ def api_ver_alumno(id):
 @alumno_bp.route("/api/login_alumno", methods=["POST"])
 def api_login_alumno():
     data = request.get_json()
-    print("📦 DATA RECIBIDA:", data)
 
     credencial_raw = data.get("credencial", "").strip()
 
@@ -162,19 +201,17 @@ def api_login_alumno():
     apellidos = normalizar(" ".join(partes[1:]))
     credencial_hash = generar_hash_credencial(nombre, apellidos)
 
-    print("---- DEBUG LOGIN ALUMNO API ----")
-    print(f"Credencial raw: {credencial_raw}")
-    print(f"Nombre normalizado: {nombre}")
-    print(f"Apellidos normalizados: {apellidos}")
-    print(f"Hash generado: {credencial_hash}")
+    rechazo = comprobar_login("alumno", credencial_hash)
+    if rechazo:
+        return rechazo
 
     alumno = Alumno.query.filter_by(credencial=credencial_hash).first()
     if alumno:
 
-        token = jwt.encode({
+        token = firmar_token({
             "alumno_id": str(alumno.id),
             "exp": datetime.utcnow() + timedelta(hours=12)
-        }, os.getenv("JWT_SECRET_KEY"), algorithm="HS256")
+        })
 
         return jsonify({"token": token, "alumno_id": str(alumno.id)})
 
@@ -189,7 +226,7 @@ def ver_documento_alumno(doc_id):
         return jsonify({"error": "Token requerido"}), 401
 
     try:
-        payload = jwt.decode(token, os.getenv("JWT_SECRET_KEY"), algorithms=["HS256"])
+        payload = verificar_token(token)
         alumno_id = payload.get("alumno_id")
     except jwt.ExpiredSignatureError:
         return jsonify({"error": "Token expirado"}), 401
@@ -200,11 +237,48 @@ def ver_documento_alumno(doc_id):
     if str(doc.alumno_id) != str(alumno_id):
         return jsonify({"error": "No tienes permiso para ver este documento"}), 403
 
-    if not os.path.exists(doc.ruta):
+    mimetype, _ = mimetypes.guess_type(doc.nombre_archivo or doc.ruta)
+    try:
+        return respuesta_archivo(
+            doc.ruta, doc.nombre_archivo, mimetype or "application/octet-stream",
+            etag=doc.sha256, modificado=doc.fecha_creacion
+        )
+    except FileNotFoundError:
         return jsonify({"error": "Archivo no encontrado"}), 404
 
-    mimetype, _ = mimetypes.guess_type(doc.ruta)
-    return send_file(doc.ruta, mimetype=mimetype or "application/octet-stream")
+@alumno_bp.route("/api/alumno/<uuid:alumno_id>/events")
+def eventos_alumno(alumno_id):
+    token = request.args.get("token")
+
+    if not token:
+        return jsonify({"error": "Token requerido"}), 401
+
+    try:
+        payload = verificar_token(token)
+    except jwt.ExpiredSignatureError:
+        return jsonify({"error": "Token expirado"}), 401
+    except jwt.InvalidTokenError:
+        return jsonify({"error": "Token inválido"}), 403
+
+    if str(payload.get("alumno_id")) != str(alumno_id):
+        return jsonify({"error": "No autorizado"}), 403
+
+    alumno = Alumno.query.get_or_404(alumno_id)
+    propio = str(alumno.id)
+
+    def es_del_alumno(evento):
+        # Cambios en los documentos requeridos de la tabla y en los suyos
+        datos = evento["datos"]
+        if evento["tipo"].startswith("documento_requerido") or evento["tipo"] == "tabla_eliminada":
+            return True
+        return isinstance(datos, dict) and propio in (datos.get("alumno_id"), datos.get("id"))
+
+    suscripcion = bus_eventos.suscribir(alumno.tabla_id, filtro=es_del_alumno)
+    return Response(
+        flujo_sse(suscripcion),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
 @alumno_bp.route("/api/public/alumno/<uuid:id>", methods=["GET"])
 def api_public_ver_alumno(id):
@@ -0,0 +1,173 @@
+import hashlib
+import os
+import tempfile
+import zlib
+
+from werkzeug.exceptions import RequestEntityTooLarge
+from werkzeug.http import parse_options_header
+from werkzeug.sansio.multipart import MultipartDecoder, Data, Epilogue, Field, File, NeedData
+
+from utils import normalizar
+
+TAM_BLOQUE = 64 * 1024
+MAX_TAMANO_CAMPO = 64 * 1024
+
+
+class SubidaInvalida(Exception):
+    pass
+
+
+class ArchivoDemasiadoGrande(Exception):
+    def __init__(self, limite):
+        super().__init__(f"El archivo supera el máximo de {limite // (1024 * 1024)} MB")
+        self.limite = limite
+
+
+def parsear_tamano(valor):
+    """ "20M" -> 20971520. Acepta bytes o sufijos K, M y G. """
+    valor = str(valor).strip().upper().rstrip("B")
+    multiplicadores = {"K": 1024, "M": 1024 ** 2, "G": 1024 ** 3}
+    if valor and valor[-1] in multiplicadores:
+        return int(float(valor[:-1]) * multiplicadores[valor[-1]])
+    return int(valor)
+
+
+def parsear_limites(texto):
+    """ "Foto=5M, DNI=10M" -> {"foto": 5242880, "dni": 10485760} """
+    limites = {}
+    for parte in (texto or "").split(","):
+        if "=" in parte:
+            nombre, tamano = parte.rsplit("=", 1)
+            limites[normalizar(nombre)] = parsear_tamano(tamano)
+    return limites
+
+
+def limite_para(config, nombre_documento):
+    por_defecto = config["MAX_TAMANO_DOCUMENTO"]
+    if nombre_documento is None:
+        # Aún no sabemos el tipo: vale el mayor de los límites configurados
+        return max([por_defecto, *config["LIMITES_DOCUMENTO"].values()])
+    return config["LIMITES_DOCUMENTO"].get(normalizar(nombre_documento), por_defecto)
+
+
+class SubidaTemporal:
+    """
+    Archivo recibido en un temporal dentro de la carpeta de subidas, con su
+    tamaño, SHA-256 y CRC-32 ya calculados. Se entrega al almacenamiento con
+    guardar_en() (en disco local es un os.replace atómico, al estar en el
+    mismo sistema de archivos) o se borra con descartar().
+    """
+
+    def __init__(self, ruta_temporal, nombre_original, tamano, sha256, campos, crc32=None):
+        self.ruta_temporal = ruta_temporal
+        self.nombre_original = nombre_original
+        self.tamano = tamano
+        self.sha256 = sha256
+        self.crc32 = crc32
+        self.campos = campos
+
+    def guardar_en(self, almacen, clave):
+        almacen.guardar(clave, self.ruta_temporal)
+        self.ruta_temporal = None
+
+    def descartar(self):
+        if self.ruta_temporal and os.path.exists(self.ruta_temporal):
+            os.remove(self.ruta_temporal)
+        self.ruta_temporal = None
+
+
+def recibir_subida(peticion, directorio_tmp, limite, campo_archivo="archivo", campo_tipo="nombre_documento"):
+    """
+    Lee el cuerpo multipart de `peticion` en bloques de TAM_BLOQUE y escribe
+    el archivo directamente a un temporal mientras calcula su SHA-256 (y el CRC-32 para los ZIP), sin
+    pasar por el buffer de formularios de werkzeug. `limite(tipo)` devuelve
+    el tamaño máximo para el tipo de documento; si el campo del tipo llega
+    antes que el archivo, el límite se aplica ya durante la lectura.
+    """
+    tipo_mime, opciones = parse_options_header(peticion.headers.get("Content-Type", ""))
+    if tipo_mime != "multipart/form-data" or "boundary" not in opciones:
+        raise SubidaInvalida("Se esperaba multipart/form-data")
+
+    os.makedirs(directorio_tmp, exist_ok=True)
+    # El decoder solo retiene lo que aún no ha entregado como eventos, así que
+    # su buffer nunca pasa de unos pocos bloques
+    decoder = MultipartDecoder(opciones["boundary"].encode("latin-1"), max_form_memory_size=4 * TAM_BLOQUE)
+
+    campos = {}
+    parte = None
+    trozos_campo = []
+    destino = None
+    ruta_tmp = None
+    nombre_original = None
+    tamano = 0
+    sha = hashlib.sha256()
+    crc = 0
+    maximo = None
+    terminado = False
+
+    try:
+        while not terminado:
+            bloque = peticion.stream.read(TAM_BLOQUE)
+            decoder.receive_data(bloque or None)
+
+            evento = decoder.next_event()
+            while not isinstance(evento, (Epilogue, NeedData)):
+                if isinstance(evento, File):
+                    parte = evento
+                    if evento.name == campo_archivo and ruta_tmp is None:
+                        fd, ruta_tmp = tempfile.mkstemp(dir=directorio_tmp, prefix="subida_")
+                        destino = os.fdopen(fd, "wb")
+                        nombre_original = evento.filename
+                        maximo = limite(campos.get(campo_tipo))
+                elif isinstance(evento, Field):
+                    parte = evento
+                    trozos_campo = []
+                elif isinstance(evento, Data):
+                    if isinstance(parte, Field):
+                        trozos_campo.append(evento.data)
+                        if sum(len(t) for t in trozos_campo) > MAX_TAMANO_CAMPO:
+                            raise SubidaInvalida(f"El campo {parte.name} es demasiado largo")
+                        if not evento.more_data:
+                            campos[parte.name] = b"".join(trozos_campo).decode("utf-8", "replace")
+                    elif parte is not None and parte.name == campo_archivo and destino is not None and not destino.closed:
+                        tamano += len(evento.data)
+                        if tamano > maximo:
+                            raise ArchivoDemasiadoGrande(maximo)
+                        sha.update(evento.data)
+                        crc = zlib.crc32(evento.data, crc)
+                        destino.write(evento.data)
+                        if not evento.more_data:
+                            destino.close()
+                evento = decoder.next_event()
+
+            if isinstance(evento, Epilogue) or not bloque:
+                terminado = True
+
+        if ruta_tmp is None or not nombre_original:
+            raise SubidaInvalida("Falta el archivo")
+        if destino is not None and not destino.closed:
+            raise SubidaInvalida("Cuerpo multipart incompleto")
+
+        # Si el tipo llegó después del archivo, su límite se comprueba ahora
+        maximo_tipo = limite(campos.get(campo_tipo))
+        if tamano > maximo_tipo:
+            raise ArchivoDemasiadoGrande(maximo_tipo)
+
+    except RequestEntityTooLarge:
+        _limpiar(destino, ruta_tmp)
+        raise ArchivoDemasiadoGrande(peticion.max_content_length or 0)
+    except ValueError as e:
+        _limpiar(destino, ruta_tmp)
+        raise SubidaInvalida(str(e))
+    except BaseException:
+        _limpiar(destino, ruta_tmp)
+        raise
+
+    return SubidaTemporal(ruta_tmp, nombre_original, tamano, sha.hexdigest(), campos, crc)
+
+
+def _limpiar(destino, ruta_tmp):
+    if destino is not None and not destino.closed:
+        destino.close()
+    if ruta_tmp and os.path.exists(ruta_tmp):
+        os.remove(ruta_tmp)
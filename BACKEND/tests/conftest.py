@@ -0,0 +1,35 @@
+import os
+import sys
+
+import pytest
+
+# Los módulos del backend se importan sin paquete (como en app.py)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ.setdefault("SUPERADMIN_USUARIO", "root")
+os.environ.setdefault("SUPERADMIN_CONTRASENA", "root")
+os.environ.setdefault("JWT_SECRET_KEY", "clave-de-pruebas-con-longitud-suficiente")
+os.environ.setdefault("TRABAJOS_WORKERS", "0")
+
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    monkeypatch.setenv("SQLALCHEMY_DATABASE_URI", f"sqlite:///{tmp_path / 'academia.db'}")
+    from almacenamiento import AlmacenamientoLocal
+    from app import create_app
+    from models import db
+
+    app = create_app()
+    app.config["TESTING"] = True
+    app.config["UPLOAD_FOLDER"] = str(tmp_path / "uploads")
+    app.extensions["almacenamiento"] = AlmacenamientoLocal(app.config["UPLOAD_FOLDER"])
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.engine.dispose()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
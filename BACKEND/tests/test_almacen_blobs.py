@@ -0,0 +1,173 @@
+import io
+import os
+
+import pytest
+
+import almacen_blobs
+from almacen_blobs import clave_blob, limpiar_lote
+from almacenamiento import almacenamiento, AlmacenamientoLocal
+from auth import firmar_token
+from models import db, Administrador, Alumno, Blob, Documento, Tabla
+
+
+@pytest.fixture
+def alumnos(app):
+    admin = Administrador(nombre="admin", usuario="admin", password_hash="-")
+    db.session.add(admin)
+    db.session.flush()
+    tabla = Tabla(nombre="Grupo", admin_id=admin.id)
+    db.session.add(tabla)
+    db.session.flush()
+    db.session.add(Documento(nombre="DNI", tabla_id=tabla.id, estado="pendiente"))
+    lista = [
+        Alumno(nombre=f"N{i}", apellidos=f"A{i}", tabla_id=tabla.id, credencial=f"c{i}", password_hash="-")
+        for i in range(2)
+    ]
+    db.session.add_all(lista)
+    db.session.commit()
+    return [a.id for a in lista]
+
+
+def subir(client, alumno_id, contenido, nombre="DNI"):
+    token = firmar_token({"alumno_id": str(alumno_id)})
+    return client.post(
+        f"/api/alumno/{alumno_id}/subir",
+        data={"nombre_documento": nombre, "archivo": (io.BytesIO(contenido), "dni.pdf")},
+        headers={"Authorization": f"Bearer {token}"},
+        content_type="multipart/form-data"
+    )
+
+
+def documento_de(alumno_id):
+    db.session.expire_all()
+    return Documento.query.filter_by(alumno_id=alumno_id, nombre="DNI").one_or_none()
+
+
+def referencias(sha256):
+    db.session.expire_all()
+    blob = db.session.get(Blob, sha256)
+    return None if blob is None else blob.referencias
+
+
+def existe(sha256):
+    return almacenamiento().existe(clave_blob(sha256))
+
+
+def temporales(app):
+    directorio = os.path.join(app.config["UPLOAD_FOLDER"], ".tmp")
+    return os.listdir(directorio) if os.path.isdir(directorio) else []
+
+
+def test_contenido_identico_se_guarda_una_vez(client, alumnos):
+    uno, dos = alumnos
+    assert subir(client, uno, b"igual").status_code == 200
+    assert subir(client, dos, b"igual").status_code == 200
+
+    sha = documento_de(uno).sha256
+    assert documento_de(dos).sha256 == sha
+    assert referencias(sha) == 2
+    assert existe(sha)
+
+
+def test_resubir_el_mismo_contenido(client, alumnos):
+    uno, _ = alumnos
+    subir(client, uno, b"igual")
+    assert subir(client, uno, b"igual").status_code == 200
+
+    nuevo = documento_de(uno)
+    assert Documento.query.filter_by(alumno_id=uno).count() == 1
+    assert referencias(nuevo.sha256) == 1
+    assert existe(nuevo.sha256)
+
+
+def test_sustituir_por_otro_contenido(client, alumnos):
+    uno, dos = alumnos
+    subir(client, uno, b"viejo")
+    subir(client, dos, b"viejo")
+    viejo = documento_de(uno).sha256
+
+    assert subir(client, uno, b"nuevo").status_code == 200
+    nuevo = documento_de(uno).sha256
+    assert referencias(viejo) == 1 and existe(viejo)
+    assert referencias(nuevo) == 1 and existe(nuevo)
+
+    # La última referencia se lleva la fila y el archivo
+    assert subir(client, dos, b"nuevo").status_code == 200
+    assert referencias(viejo) is None
+    assert not existe(viejo)
+    assert referencias(nuevo) == 2
+
+
+def test_borrar_la_ultima_referencia(client, alumnos):
+    uno, _ = alumnos
+    subir(client, uno, b"contenido")
+    doc = documento_de(uno)
+    token = firmar_token({"alumno_id": str(uno)})
+
+    respuesta = client.delete(
+        f"/api/alumno/{uno}/documentos/{doc.id}/eliminar", headers={"Authorization": f"Bearer {token}"}
+    )
+    assert respuesta.status_code == 200
+    assert referencias(doc.sha256) is None
+    assert not existe(doc.sha256)
+
+
+def test_si_falla_el_almacenamiento_se_conserva_el_documento_anterior(app, client, alumnos, monkeypatch):
+    uno, _ = alumnos
+    subir(client, uno, b"bueno")
+    anterior = documento_de(uno)
+
+    def sin_espacio(self, clave, ruta_local):
+        raise OSError("No queda espacio en el dispositivo")
+
+    monkeypatch.setattr(AlmacenamientoLocal, "guardar", sin_espacio)
+    assert subir(client, uno, b"otro").status_code == 500
+
+    doc = documento_de(uno)
+    assert doc.id == anterior.id and doc.sha256 == anterior.sha256
+    assert referencias(anterior.sha256) == 1 and existe(anterior.sha256)
+    assert db.session.query(Blob).count() == 1
+    assert temporales(app) == []
+
+
+def test_resubida_mientras_se_libera_el_blob(client, alumnos, monkeypatch):
+    # A confirma que el blob se queda sin referencias; antes de que borre el
+    # archivo, B sube el mismo contenido y lo encuentra ya guardado
+    uno, dos = alumnos
+    subir(client, uno, b"disputado")
+    sha = documento_de(uno).sha256
+
+    aplazados = []
+    monkeypatch.setattr(almacen_blobs, "_borrar_archivos", aplazados.extend)
+    doc = documento_de(uno)
+    db.session.delete(doc)
+    db.session.commit()
+    assert aplazados == [(sha, None)]
+    assert referencias(sha) == 0
+
+    assert subir(client, dos, b"disputado").status_code == 200
+    monkeypatch.undo()
+    almacen_blobs._borrar_archivos(aplazados)
+
+    assert referencias(sha) == 1
+    assert existe(sha)
+
+
+def test_borrado_en_cascada_libera_los_blobs_en_segundo_plano(client, alumnos):
+    uno, dos = alumnos
+    subir(client, uno, b"compartido")
+    subir(client, dos, b"compartido")
+    sha = documento_de(uno).sha256
+
+    db.session.delete(db.session.get(Alumno, uno))
+    db.session.commit()
+    while limpiar_lote():
+        pass
+    assert referencias(sha) == 1 and existe(sha)
+
+    db.session.delete(db.session.get(Alumno, dos))
+    db.session.commit()
+    while limpiar_lote():
+        pass
+    assert referencias(sha) is None
+    assert not existe(sha)
@@ -0,0 +1,99 @@
+import os
+
+import pytest
+
+from almacenamiento import Almacenamiento, AlmacenamientoLocal, AlmacenamientoS3
+
+moto = pytest.importorskip("moto")
+boto3 = pytest.importorskip("boto3")
+requests = pytest.importorskip("requests")
+
+BUCKET = "academia-pruebas"
+
+
+def test_backend_incompleto_no_se_instancia():
+    class SinBorrar(AlmacenamientoLocal):
+        borrar = Almacenamiento.borrar
+
+    with pytest.raises(TypeError):
+        SinBorrar("/tmp")
+
+
+@pytest.fixture
+def s3(monkeypatch):
+    for variable, valor in (("AWS_ACCESS_KEY_ID", "pruebas"), ("AWS_SECRET_ACCESS_KEY", "pruebas"),
+                            ("AWS_DEFAULT_REGION", "us-east-1")):
+        monkeypatch.setenv(variable, valor)
+    with moto.mock_aws():
+        boto3.client("s3", region_name="us-east-1").create_bucket(Bucket=BUCKET)
+        yield AlmacenamientoS3(BUCKET, prefijo="academia/", region="us-east-1")
+
+
+@pytest.fixture
+def temporal(tmp_path):
+    def crear(datos):
+        ruta = tmp_path / f"subida_{len(datos)}"
+        ruta.write_bytes(datos)
+        return str(ruta)
+    return crear
+
+
+def test_guardar_existe_info_y_borrar(s3, temporal):
+    datos = os.urandom(100000)
+    ruta = temporal(datos)
+    s3.guardar("blobs/ab/cd/abcd", ruta)
+
+    assert not os.path.exists(ruta)
+    assert s3.existe("blobs/ab/cd/abcd")
+    assert not s3.existe("blobs/ab/cd/otro")
+    assert s3.info("blobs/ab/cd/abcd")[0] == len(datos)
+    # El prefijo va delante de la clave en el bucket
+    objetos = boto3.client("s3", region_name="us-east-1").list_objects_v2(Bucket=BUCKET)["Contents"]
+    assert [o["Key"] for o in objetos] == ["academia/blobs/ab/cd/abcd"]
+
+    s3.borrar("blobs/ab/cd/abcd")
+    assert not s3.existe("blobs/ab/cd/abcd")
+    with pytest.raises(FileNotFoundError):
+        s3.info("blobs/ab/cd/abcd")
+
+
+def test_abrir_en_streaming_y_por_rangos(s3, temporal):
+    datos = os.urandom(300000)
+    s3.guardar("blobs/x", temporal(datos))
+
+    f = s3.abrir("blobs/x")
+    trozos = []
+    while True:
+        bloque = f.read(64 * 1024)
+        if not bloque:
+            break
+        trozos.append(bloque)
+    f.close()
+    assert len(trozos) > 1
+    assert b"".join(trozos) == datos
+
+    f = s3.abrir("blobs/x", 1000, 1999)
+    assert f.read() == datos[1000:2000]
+    f.close()
+    f = s3.abrir("blobs/x", 299990)
+    assert f.read() == datos[299990:]
+    f.close()
+
+    with pytest.raises(FileNotFoundError):
+        s3.abrir("blobs/no-existe")
+
+
+def test_url_firmada(s3, temporal):
+    datos = b"%PDF-1.4 contenido"
+    s3.guardar("blobs/doc", temporal(datos))
+
+    url = s3.url_descarga("blobs/doc", "DNI José.pdf", "application/pdf", adjunto=True)
+    assert "Signature=" in url and "/academia/blobs/doc?" in url
+    respuesta = requests.get(url)
+    assert respuesta.status_code == 200
+    assert respuesta.content == datos
+    assert respuesta.headers["Content-Type"] == "application/pdf"
+    assert respuesta.headers["Content-Disposition"] == "attachment; filename*=UTF-8''DNI%20Jos%C3%A9.pdf"
+
+    s3.presignar = False
+    assert s3.url_descarga("blobs/doc", "DNI.pdf", "application/pdf") is None
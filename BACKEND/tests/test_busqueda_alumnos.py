@@ -0,0 +1,86 @@
+import uuid
+
+import pytest
+from sqlalchemy import func
+
+from busqueda_alumnos import buscar_alumnos, indice_ngramas, nombre_busqueda
+from models import db, Administrador, Alumno, Tabla
+
+
+@pytest.fixture
+def tabla_id(app):
+    # El índice es global del proceso: cada prueba tiene su propia base de datos
+    indice_ngramas.__init__()
+    admin = Administrador(nombre="A", usuario="a", password_hash="-")
+    db.session.add(admin)
+    db.session.flush()
+    tabla = Tabla(nombre="Grupo", admin_id=admin.id)
+    db.session.add(tabla)
+    db.session.flush()
+    db.session.add(Alumno(nombre="José", apellidos="Pérez", tabla_id=tabla.id, credencial="c1", password_hash="-"))
+    db.session.commit()
+    return tabla.id
+
+
+def en_otro_worker(*sentencias):
+    """ Escribe como lo haría otro proceso: sin pasar por la sesión ni por sus eventos. """
+    with db.engine.begin() as conn:
+        for sentencia in sentencias:
+            conn.execute(sentencia)
+
+
+def subir_version(tabla_id):
+    tablas = Tabla.__table__
+    return tablas.update().where(tablas.c.id == tabla_id).values(version=func.coalesce(tablas.c.version, 0) + 1)
+
+
+def nombres(q):
+    return [a["nombre"] for a in buscar_alumnos(q)]
+
+
+def test_ve_alumnos_de_otros_workers(tabla_id):
+    assert nombres("perez") == ["José"]
+    alumnos = Alumno.__table__
+    en_otro_worker(
+        alumnos.insert().values(
+            id=uuid.uuid4(), nombre="María", apellidos="Pérez", tabla_id=tabla_id, credencial="c2",
+            password_hash="-", nombre_busqueda=nombre_busqueda("María", "Pérez")
+        ),
+        subir_version(tabla_id),
+    )
+    assert nombres("perez") == ["José", "María"]
+
+    en_otro_worker(
+        alumnos.update().where(alumnos.c.credencial == "c1").values(
+            apellidos="Gómez", nombre_busqueda=nombre_busqueda("José", "Gómez")
+        ),
+        subir_version(tabla_id),
+    )
+    assert nombres("perez") == ["María"]
+    assert nombres("gomez") == ["José"]
+
+    en_otro_worker(alumnos.delete(), Tabla.__table__.delete())
+    assert nombres("perez") == []
+
+
+def test_cambios_durante_la_carga(tabla_id, monkeypatch):
+    # Un commit justo después de leer las versiones y antes de leer los
+    # alumnos: la siguiente búsqueda lo recoge
+    original = db.session.execute
+    llamadas = []
+
+    def execute(consulta, *args, **kwargs):
+        llamadas.append(consulta)
+        if len(llamadas) == 2:
+            en_otro_worker(
+                Alumno.__table__.update().where(Alumno.__table__.c.credencial == "c1").values(
+                    apellidos="Ruiz", nombre_busqueda=nombre_busqueda("José", "Ruiz")
+                ),
+                subir_version(tabla_id),
+            )
+        return original(consulta, *args, **kwargs)
+
+    monkeypatch.setattr(db.session, "execute", execute)
+    nombres("jose")
+    monkeypatch.undo()
+    assert nombres("ruiz") == ["José"]
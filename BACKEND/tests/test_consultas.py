@@ -0,0 +1,112 @@
+import hashlib
+from contextlib import contextmanager
+
+import pytest
+from sqlalchemy import event
+
+from auth import firmar_token
+from cache_admins import cache_admins
+from models import db, Administrador, Alumno, Blob, Documento, Tabla
+from versiones import cache_respuestas
+
+
+def crear_admin(usuario, es_superadmin=False):
+    # Sin hashear contraseñas: aquí no se hace login y scrypt es lento
+    admin = Administrador(nombre=usuario, usuario=usuario, es_superadmin=es_superadmin, password_hash="-")
+    db.session.add(admin)
+    db.session.commit()
+    return admin
+
+
+def crear_tabla(admin, n_alumnos, requeridos=("DNI", "Foto")):
+    tabla = Tabla(nombre=f"Grupo {n_alumnos}", admin_id=admin.id)
+    db.session.add(tabla)
+    db.session.flush()
+    for nombre in requeridos:
+        db.session.add(Documento(nombre=nombre, tabla_id=tabla.id, estado="pendiente"))
+    for i in range(n_alumnos):
+        alumno = Alumno(
+            nombre=f"N{i}", apellidos=f"A{i}", tabla_id=tabla.id, credencial=f"{tabla.id}-{i}", password_hash="-"
+        )
+        db.session.add(alumno)
+        db.session.flush()
+        for nombre in requeridos:
+            # Cada subido con su blob: el análisis del archivo también se serializa
+            sha = hashlib.sha256(f"{tabla.id}-{i}-{nombre}".encode()).hexdigest()
+            ruta = f"blobs/{sha[:2]}/{sha[2:4]}/{sha}"
+            db.session.add(Blob(sha256=sha, ruta=ruta, tamano=1, referencias=1))
+            db.session.add(Documento(
+                nombre=nombre, tabla_id=tabla.id, alumno_id=alumno.id, estado="subido",
+                nombre_archivo=f"{tabla.id}-{i}-{nombre}.pdf", ruta=ruta, sha256=sha
+            ))
+    db.session.commit()
+    return tabla.id
+
+
+def cabeceras(admin):
+    token = firmar_token({"id": admin.id, "usuario": admin.usuario, "es_superadmin": admin.es_superadmin})
+    return {"Authorization": f"Bearer {token}"}
+
+
+@contextmanager
+def contar_consultas():
+    sentencias = []
+
+    def contar(conn, cursor, sql, parametros, contexto, executemany):
+        sentencias.append(sql)
+
+    motor = db.engine
+    event.listen(motor, "before_cursor_execute", contar)
+    try:
+        yield sentencias
+    finally:
+        event.remove(motor, "before_cursor_execute", contar)
+
+
+def consultas_de(client, url, headers):
+    # Sin cachés en marcha: se cuenta el trabajo completo de cada petición
+    cache_respuestas.limpiar()
+    cache_admins.limpiar()
+    db.session.remove()
+    with contar_consultas() as sentencias:
+        respuesta = client.get(url, headers=headers)
+        assert respuesta.status_code == 200, respuesta.get_data(as_text=True)
+        respuesta.get_data()  # las respuestas en streaming consultan al generarse
+    return len(sentencias)
+
+
+@pytest.fixture
+def datos(app):
+    admin = crear_admin("admin")
+    otro = crear_admin("otro")
+    superadmin = crear_admin("root-test", es_superadmin=True)
+    return {
+        "admin": cabeceras(admin),
+        "superadmin": cabeceras(superadmin),
+        "admin_id": admin.id,
+        "otro_id": otro.id,
+        "tabla_1": crear_tabla(admin, 1),
+        "tabla_n": crear_tabla(admin, 25),
+        "tablas_otro": [crear_tabla(otro, 25) for _ in range(3)],
+    }
+
+
+def test_ver_tabla_no_depende_de_los_alumnos(client, datos):
+    con_1 = consultas_de(client, f"/api/admin/tabla/{datos['tabla_1']}", datos["admin"])
+    con_n = consultas_de(client, f"/api/admin/tabla/{datos['tabla_n']}", datos["admin"])
+    assert con_1 == con_n
+
+
+def test_ver_tabla_superadmin_no_depende_de_los_alumnos(client, datos):
+    con_1 = consultas_de(client, f"/api/superadmin/tabla/{datos['tabla_1']}", datos["superadmin"])
+    con_n = consultas_de(client, f"/api/superadmin/tabla/{datos['tabla_n']}", datos["superadmin"])
+    assert con_1 == con_n
+
+
+@pytest.mark.parametrize("parametros", ["", "?limit=10"])
+def test_panel_admin_no_depende_de_tablas_ni_alumnos(client, datos, parametros):
+    # admin: una tabla de 1 alumno y otra de 25; otro: tres tablas de 25
+    url = "/api/superadmin/panel_admin/{}" + parametros
+    con_pocos = consultas_de(client, url.format(datos["admin_id"]), datos["superadmin"])
+    con_muchos = consultas_de(client, url.format(datos["otro_id"]), datos["superadmin"])
+    assert con_pocos == con_muchos
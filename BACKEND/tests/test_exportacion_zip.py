@@ -0,0 +1,137 @@
+import io
+import os
+import random
+import tempfile
+import zipfile
+import zlib
+
+import pytest
+
+from almacen_blobs import clave_blob
+from almacenamiento import almacenamiento, AlmacenamientoLocal
+from auth import firmar_token
+from exportacion_zip import EntradaZip, ZipEnStreaming, parsear_range
+from models import db, Administrador, Alumno, Blob, Documento, Tabla
+
+
+def crear_entradas(contenidos, con_crc, abiertos):
+    def abridor(nombre, datos):
+        def abrir(inicio):
+            abiertos.append((nombre, inicio))
+            f = io.BytesIO(datos)
+            f.seek(inicio)
+            return f
+        return abrir
+
+    return [
+        EntradaZip(
+            nombre, len(datos), 1700000000, abridor(nombre, datos),
+            crc32=zlib.crc32(datos) if con_crc else None
+        )
+        for nombre, datos in contenidos.items()
+    ]
+
+
+@pytest.fixture
+def contenidos():
+    aleatorio = random.Random(1)
+    return {f"alumno {i}/doc_{i}.pdf": aleatorio.randbytes(aleatorio.randint(0, 50000)) for i in range(8)}
+
+
+@pytest.mark.parametrize("con_crc", [True, False])
+def test_zip_completo_valido(contenidos, con_crc):
+    zip_stream = ZipEnStreaming(crear_entradas(contenidos, con_crc, []), tam_bloque=4096)
+    datos = b"".join(zip_stream.generar())
+    assert len(datos) == zip_stream.tamano_total
+
+    with zipfile.ZipFile(io.BytesIO(datos)) as z:
+        assert z.testzip() is None
+        assert {n: z.read(n) for n in z.namelist()} == contenidos
+
+
+@pytest.mark.parametrize("con_crc", [True, False])
+def test_rangos_coinciden_con_el_zip_completo(contenidos, con_crc):
+    completo = b"".join(ZipEnStreaming(crear_entradas(contenidos, True, []), tam_bloque=4096).generar())
+    aleatorio = random.Random(2)
+    for _ in range(50):
+        inicio = aleatorio.randrange(len(completo))
+        fin = aleatorio.randrange(inicio, len(completo))
+        zip_stream = ZipEnStreaming(crear_entradas(contenidos, con_crc, []), tam_bloque=4096)
+        assert b"".join(zip_stream.generar(inicio, fin)) == completo[inicio:fin + 1]
+
+
+def test_reanudar_no_relee_lo_enviado(contenidos):
+    abiertos = []
+    zip_stream = ZipEnStreaming(crear_entradas(contenidos, True, abiertos), tam_bloque=4096)
+    ultima = zip_stream.entradas[-1]
+    # A mitad del último archivo: solo se abre ese, y desde donde toca
+    inicio = ultima.offset + len(ultima.cabecera_local()) + ultima.tamano // 2
+    b"".join(zip_stream.generar(inicio))
+    assert abiertos == [(ultima.nombre_zip, ultima.tamano // 2)]
+
+
+def test_reanudar_en_el_directorio_central_no_abre_nada(contenidos):
+    abiertos = []
+    zip_stream = ZipEnStreaming(crear_entradas(contenidos, True, abiertos), tam_bloque=4096)
+    b"".join(zip_stream.generar(zip_stream.inicio_central))
+    assert abiertos == []
+
+
+def test_parsear_range():
+    assert parsear_range(None, 100) is None
+    assert parsear_range("bytes=10-", 100) == (10, 99)
+    assert parsear_range("bytes=-10", 100) == (90, 99)
+    with pytest.raises(ValueError):
+        parsear_range("bytes=100-", 100)
+
+
+def test_exportar_tabla_no_consulta_el_almacenamiento_por_archivo(app, client, monkeypatch):
+    admin = Administrador(nombre="admin", usuario="admin", password_hash="-")
+    db.session.add(admin)
+    db.session.flush()
+    tabla = Tabla(nombre="Grupo", admin_id=admin.id)
+    db.session.add(tabla)
+    db.session.flush()
+    alm = almacenamiento()
+    esperados = {}
+    for i, datos in enumerate([b"primero", b"segundo"]):
+        alumno = Alumno(nombre=f"N{i}", apellidos=f"A{i}", tabla_id=tabla.id, credencial=f"c{i}", password_hash="-")
+        db.session.add(alumno)
+        db.session.flush()
+        sha = f"{i:064x}"
+        ruta = clave_blob(sha)
+        alm.guardar(ruta, _temporal(app, datos))
+        db.session.add(Blob(sha256=sha, ruta=ruta, tamano=len(datos), referencias=1, crc32=zlib.crc32(datos)))
+        db.session.add(Documento(
+            nombre="DNI", tabla_id=tabla.id, alumno_id=alumno.id, estado="subido",
+            nombre_archivo=f"{i}.pdf", ruta=ruta, sha256=sha, tamano=len(datos)
+        ))
+        esperados[f"N{i} A{i}/DNI.pdf"] = datos
+    # Documento anterior al almacén por hash: sin tamaño ni blob
+    alm.guardar("antiguo.pdf", _temporal(app, b"antiguo"))
+    db.session.add(Documento(
+        nombre="Foto", tabla_id=tabla.id, alumno_id=alumno.id, estado="subido",
+        nombre_archivo="antiguo.pdf", ruta="antiguo.pdf"
+    ))
+    esperados["N1 A1/Foto.pdf"] = b"antiguo"
+    db.session.commit()
+
+    consultados = []
+    info = AlmacenamientoLocal.info
+    monkeypatch.setattr(AlmacenamientoLocal, "info", lambda self, clave: consultados.append(clave) or info(self, clave))
+    token = firmar_token({"id": admin.id, "usuario": "admin", "es_superadmin": False})
+    respuesta = client.get(f"/api/admin/tabla/{tabla.id}/export.zip?token={token}")
+
+    assert respuesta.status_code == 200
+    with zipfile.ZipFile(io.BytesIO(respuesta.get_data())) as z:
+        assert z.testzip() is None
+        assert {n: z.read(n) for n in z.namelist()} == esperados
+    assert consultados == ["antiguo.pdf"]
+
+
+def _temporal(app, datos):
+    os.makedirs(app.config["UPLOAD_FOLDER"], exist_ok=True)
+    fd, ruta = tempfile.mkstemp(dir=app.config["UPLOAD_FOLDER"])
+    with os.fdopen(fd, "wb") as f:
+        f.write(datos)
+    return ruta
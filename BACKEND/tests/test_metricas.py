@@ -0,0 +1,49 @@
+import json
+import os
+
+from instantaneas_metricas import ARCHIVO_MUERTOS, leer_instantaneas, plegar_instantanea
+from metricas import _formatear
+
+PETICIONES = "academia_http_peticiones_total"
+
+
+def instantanea(pid, peticiones):
+    etiquetas = [["endpoint", "x"], ["estado", "200"], ["metodo", "GET"]]
+    return {
+        "pid": pid,
+        "instancia": f"i{pid}",
+        "contadores": [[PETICIONES, etiquetas, peticiones]],
+        "histogramas": [["academia_http_duracion_segundos", etiquetas[:1], [0.1, 1], [peticiones, 0], 0.5, peticiones]],
+        "indicadores": [["academia_sse_suscripciones", [], 3]],
+    }
+
+
+def guardar(directorio, inst):
+    with open(os.path.join(directorio, f"{inst['pid']}.json"), "w") as f:
+        json.dump(inst, f)
+
+
+def total(directorio):
+    lineas = _formatear(leer_instantaneas(str(directorio))).splitlines()
+    return [l for l in lineas if l.startswith(PETICIONES) or l.startswith("academia_http_duracion_segundos_count")]
+
+
+def test_plegar_conserva_los_totales(tmp_path):
+    for pid, n in ((101, 5), (102, 7), (103, 11)):
+        guardar(tmp_path, instantanea(pid, n))
+    antes = total(tmp_path)
+
+    plegar_instantanea(str(tmp_path), 101)
+    plegar_instantanea(str(tmp_path), 102)
+
+    assert sorted(os.listdir(tmp_path)) == ["103.json", ARCHIVO_MUERTOS]
+    assert total(tmp_path) == antes
+
+
+def test_instantanea_ya_plegada_no_cuenta_dos_veces(tmp_path):
+    guardar(tmp_path, instantanea(101, 5))
+    antes = total(tmp_path)
+    plegar_instantanea(str(tmp_path), 101)
+    # Un scrape que la vea todavía en disco justo después de plegarla
+    guardar(tmp_path, instantanea(101, 5))
+    assert total(tmp_path) == antes
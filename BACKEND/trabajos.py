@@ -0,0 +1,184 @@
+import logging
+import os
+import threading
+from datetime import datetime, timedelta
+
+from sqlalchemy import event, select, or_, and_
+from sqlalchemy.orm import Session
+
+from models import db, Trabajo
+
+logger = logging.getLogger(__name__)
+
+MAX_INTENTOS = 3
+# Un trabajo "en_curso" más antiguo que esto se da por abandonado (worker caído)
+TIMEOUT_TRABAJO = timedelta(minutes=10)
+
+_tareas = {}
+
+
+def tarea(tipo):
+    """ Registra la función que ejecuta los trabajos de `tipo`; recibe la clave. """
+    def registrar(funcion):
+        _tareas[tipo] = funcion
+        return funcion
+    return registrar
+
+
+def encolar(tipo, clave):
+    """
+    Añade un trabajo en la sesión actual. Se guarda con el commit de quien lo
+    encola y, tras ese commit, se despierta a los workers de este proceso.
+    """
+    db.session.add(Trabajo(tipo=tipo, clave=clave))
+    db.session.info["hay_trabajos_nuevos"] = True
+
+
+class ColaTrabajos:
+    """
+    Pool de hilos que ejecuta los trabajos guardados en la tabla `trabajos`,
+    sin broker externo. Cada hilo reclama un trabajo con un UPDATE atómico
+    (con SKIP LOCKED en PostgreSQL), así que varios procesos de gunicorn
+    pueden compartir la cola. Entre trabajos espera a que alguien encole en
+    este proceso o, como mucho, `intervalo` segundos.
+    """
+
+    def __init__(self, workers=2, intervalo=5):
+        self.workers = workers
+        self.intervalo = intervalo
+        self.app = None
+        self._aviso = threading.Event()
+        self._parar = threading.Event()
+        self._hilos = []
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def configurar(self, app, workers, intervalo):
+        self.app = app
+        self.workers = workers
+        self.intervalo = intervalo
+
+    def arrancar(self):
+        # Los hilos no sobreviven a un fork: cada proceso arranca los suyos
+        if self._pid == os.getpid() or self.workers <= 0 or self.app is None:
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._parar.clear()
+            self._hilos = [
+                threading.Thread(target=self._bucle, name=f"trabajos-{i}", daemon=True)
+                for i in range(self.workers)
+            ]
+            for hilo in self._hilos:
+                hilo.start()
+            self._pid = os.getpid()
+
+    def parar(self):
+        self._parar.set()
+        self._aviso.set()
+        for hilo in self._hilos:
+            hilo.join()
+        self._hilos = []
+        self._pid = None
+
+    def despertar(self):
+        self._aviso.set()
+
+    def _bucle(self):
+        while not self._parar.is_set():
+            try:
+                with self.app.app_context():
+                    hecho = self.procesar_siguiente()
+            except Exception as e:
+                logger.error(f"Error en la cola de trabajos: {str(e)}")
+                hecho = False
+            if not hecho:
+                self._aviso.wait(self.intervalo)
+                self._aviso.clear()
+
+    def reclamar(self):
+        t = Trabajo.__table__
+        ahora = datetime.utcnow()
+        candidato = (
+            select(t.c.id)
+            .where(
+                or_(
+                    t.c.estado == 'pendiente',
+                    and_(t.c.estado == 'en_curso', t.c.fecha_inicio < ahora - TIMEOUT_TRABAJO)
+                ),
+                t.c.intentos < MAX_INTENTOS
+            )
+            .order_by(t.c.id)
+            .limit(1)
+        )
+        if db.engine.dialect.name == "postgresql":
+            candidato = candidato.with_for_update(skip_locked=True)
+
+        with db.engine.begin() as conn:
+            return conn.execute(
+                t.update()
+                .where(t.c.id == candidato.scalar_subquery())
+                .values(estado='en_curso', intentos=t.c.intentos + 1, fecha_inicio=ahora)
+                .returning(t.c.id, t.c.tipo, t.c.clave, t.c.intentos)
+            ).first()
+
+    def procesar_siguiente(self):
+        """ Ejecuta un trabajo si hay alguno. Devuelve False si la cola está vacía. """
+        trabajo = self.reclamar()
+        if trabajo is None:
+            return False
+
+        t = Trabajo.__table__
+        try:
+            funcion = _tareas.get(trabajo.tipo)
+            if funcion is None:
+                raise RuntimeError(f"Tipo de trabajo desconocido: {trabajo.tipo}")
+            funcion(trabajo.clave)
+            db.session.commit()
+            with db.engine.begin() as conn:
+                conn.execute(t.delete().where(t.c.id == trabajo.id))
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Trabajo {trabajo.id} ({trabajo.tipo} {trabajo.clave}) falló: {str(e)}")
+            with db.engine.begin() as conn:
+                conn.execute(
+                    t.update()
+                    .where(t.c.id == trabajo.id)
+                    .values(
+                        estado='pendiente' if trabajo.intentos < MAX_INTENTOS else 'error',
+                        error=str(e)
+                    )
+                )
+        finally:
+            db.session.remove()
+        return True
+
+
+cola_trabajos = ColaTrabajos()
+
+
+@event.listens_for(Session, "after_commit")
+def _despertar_tras_commit(sesion):
+    if sesion.info.pop("hay_trabajos_nuevos", False):
+        cola_trabajos.despertar()
+
+
+@event.listens_for(Session, "after_rollback")
+def _olvidar_tras_rollback(sesion):
+    sesion.info.pop("hay_trabajos_nuevos", None)
+
+
+def init_app(app):
+    """
+    TRABAJOS_WORKERS hilos por proceso (0 desactiva los workers en este
+    proceso; los trabajos esperan en la tabla a otro que sí los tenga).
+    Arrancan con la primera petición, no al importar la app, para que los
+    scripts como crear_tablas.py no lancen hilos.
+    """
+    cola_trabajos.configurar(
+        app,
+        workers=int(os.getenv("TRABAJOS_WORKERS", "2")),
+        intervalo=float(os.getenv("TRABAJOS_INTERVALO", "5"))
+    )
+    app.before_request(cola_trabajos.arrancar)
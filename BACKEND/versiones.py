@@ -0,0 +1,175 @@
+import os
+import threading
+from collections import OrderedDict
+
+from flask import request, jsonify, current_app, stream_with_context, g
+from sqlalchemy import event, func
+from sqlalchemy.orm import Session, object_session
+
+from models import db, Tabla, Alumno, Documento
+
+# Cambia si cambia el formato de las respuestas, para que los ETag que
+# tengan los navegadores de antes de un despliegue dejen de valer
+FORMATO_RESPUESTAS = 1
+
+
+def subir_version(tabla_id, sesion=None, connection=None):
+    """
+    Incrementa Tabla.version dentro de la transacción actual, una sola vez
+    por tabla y transacción (los lectores solo ven el cambio con el commit).
+    """
+    sesion = sesion if sesion is not None else db.session()
+    hechas = sesion.info.setdefault("tablas_versionadas", set())
+    if tabla_id is None or tabla_id in hechas:
+        return
+    hechas.add(tabla_id)
+
+    tabla = Tabla.__table__
+    (connection if connection is not None else sesion).execute(
+        tabla.update()
+        .where(tabla.c.id == tabla_id)
+        .values(version=func.coalesce(tabla.c.version, 0) + 1)
+    )
+
+
+# Toda escritura que cambia lo que devuelven las vistas de una tabla sube su
+# versión: documentos (requeridos y subidos), alumnos y la propia tabla. Los
+# INSERT en bloque y el análisis de archivos, que no pasan por aquí, llaman a
+# subir_version() directamente.
+def _hijo_modificado(mapper, connection, obj):
+    sesion = object_session(obj)
+    if sesion is not None:
+        subir_version(obj.tabla_id, sesion, connection)
+
+
+def _tabla_modificada(mapper, connection, tabla):
+    sesion = object_session(tabla)
+    if sesion is not None:
+        subir_version(tabla.id, sesion, connection)
+
+
+for _modelo in (Documento, Alumno):
+    for _evento in ("after_insert", "after_update", "after_delete"):
+        event.listen(_modelo, _evento, _hijo_modificado)
+event.listen(Tabla, "after_update", _tabla_modificada)
+
+
+@event.listens_for(Session, "after_commit")
+def _olvidar_tras_commit(sesion):
+    sesion.info.pop("tablas_versionadas", None)
+
+
+@event.listens_for(Session, "after_rollback")
+def _olvidar_tras_rollback(sesion):
+    sesion.info.pop("tablas_versionadas", None)
+
+
+class CacheRespuestas:
+    """
+    Caché LRU de cuerpos JSON ya serializados. Las claves llevan la versión
+    de la tabla, así que nunca hay que invalidar: una escritura cambia la
+    versión y las entradas viejas acaban saliendo por LRU. Es local al
+    proceso, limitada en entradas y en bytes.
+    """
+
+    def __init__(self, max_entradas=2048, max_bytes=32 * 1024 * 1024):
+        self.max_entradas = max_entradas
+        self.max_bytes = max_bytes
+        self._datos = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.aciertos = 0
+        self.fallos = 0
+
+    def obtener(self, clave, construir):
+        """ Devuelve el cuerpo cacheado para `clave` o lo genera con construir(). """
+        with self._lock:
+            cuerpo = self._datos.get(clave)
+            if cuerpo is not None:
+                self._datos.move_to_end(clave)
+                self.aciertos += 1
+                return cuerpo
+            self.fallos += 1
+
+        cuerpo = construir()
+        if len(cuerpo) > self.max_bytes // 4:
+            # Una respuesta enorme no debe vaciar la caché entera
+            return cuerpo
+
+        with self._lock:
+            anterior = self._datos.pop(clave, None)
+            if anterior is not None:
+                self._bytes -= len(anterior)
+            self._datos[clave] = cuerpo
+            self._bytes += len(cuerpo)
+            while len(self._datos) > self.max_entradas or self._bytes > self.max_bytes:
+                _, viejo = self._datos.popitem(last=False)
+                self._bytes -= len(viejo)
+        return cuerpo
+
+    def limpiar(self):
+        with self._lock:
+            self._datos.clear()
+            self._bytes = 0
+
+    def estadisticas(self):
+        with self._lock:
+            return {
+                "entradas": len(self._datos),
+                "bytes": self._bytes,
+                "aciertos": self.aciertos,
+                "fallos": self.fallos,
+                "max_entradas": self.max_entradas,
+                "max_bytes": self.max_bytes
+            }
+
+
+cache_respuestas = CacheRespuestas(
+    max_entradas=int(os.getenv("RESPUESTAS_CACHE_MAX", "2048")),
+    max_bytes=int(os.getenv("RESPUESTAS_CACHE_MAX_MB", "32")) * 1024 * 1024
+)
+
+
+def _etag(clave):
+    return ".".join(str(parte) for parte in (FORMATO_RESPUESTAS, *clave))
+
+
+def respuesta_versionada(clave, construir):
+    """
+    Respuesta JSON con ETag débil derivado de `clave` (que debe incluir las
+    versiones de las tablas implicadas). Si el cliente ya la tiene, 304 sin
+    construir nada; si no, el cuerpo sale de la caché o de construir(), que
+    devuelve el objeto a serializar.
+    """
+    etag = _etag(clave)
+
+    if g.get("sin_cache_respuestas"):
+        # Petición perfilada (perfiles.py): se construye siempre
+        respuesta = jsonify(construir())
+    elif request.if_none_match.contains_weak(etag):
+        respuesta = current_app.response_class(status=304)
+    else:
+        cuerpo = cache_respuestas.obtener(clave, lambda: jsonify(construir()).get_data())
+        respuesta = current_app.response_class(cuerpo, mimetype="application/json")
+
+    respuesta.set_etag(etag, weak=True)
+    respuesta.headers["Cache-Control"] = "private, no-cache"
+    return respuesta
+
+
+def respuesta_versionada_en_streaming(clave, generar):
+    """
+    Como respuesta_versionada(), pero el cuerpo se envía a trozos según lo
+    produce generar() y no pasa por la caché: para respuestas demasiado
+    grandes para tenerlas enteras en memoria.
+    """
+    etag = _etag(clave)
+
+    if request.if_none_match.contains_weak(etag) and not g.get("sin_cache_respuestas"):
+        respuesta = current_app.response_class(status=304)
+    else:
+        respuesta = current_app.response_class(stream_with_context(generar()), mimetype="application/json")
+
+    respuesta.set_etag(etag, weak=True)
+    respuesta.headers["Cache-Control"] = "private, no-cache"
+    return respuesta
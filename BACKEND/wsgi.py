@@ -0,0 +1,20 @@
+"""
+Punto de entrada WSGI de producción:
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+(app.py con `python app.py` es solo el servidor de desarrollo.) Los logs de
+la app y de los módulos (trabajos, eventos...) salen por el mismo sitio que
+los de gunicorn, con el nivel de LOG_LEVEL.
+"""
+import logging
+import os
+
+from app import create_app
+
+logging.basicConfig(
+    level=os.getenv("LOG_LEVEL", "INFO").upper(),
+    format="%(asctime)s [%(process)d] [%(levelname)s] %(name)s: %(message)s"
+)
+
+app = create_app()
@@ -151,6 +151,9 @@ function AdminHome() {
             >
               📁 {tabla.nombre}
             </div>
+            <div className="text-sm text-gray-600 mb-3">
+              👥 {tabla.alumnos} alumnos · 📄 {tabla.documentos_subidos} subidos · ⏳ {tabla.documentos_pendientes} pendientes
+            </div>
             <div>
               <button
                 onClick={() => eliminarTabla(tabla.id)}
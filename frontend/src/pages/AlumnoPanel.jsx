@@ -1,5 +1,5 @@
 import { useParams, useNavigate } from "react-router-dom"
-import { useEffect, useState } from "react"
+import { useEffect, useRef, useState } from "react"
 
 
 function AlumnoPanel() {
@@ -11,6 +11,7 @@ function AlumnoPanel() {
   const [alumnoCargando, setAlumnoCargando] = useState(true)
   const [alumnoError, setAlumnoError] = useState("")
   const navigate = useNavigate()
+  const eventosActivos = useRef(false)
 
   useEffect(() => {
     const token = localStorage.getItem("token_alumno")
@@ -67,6 +68,43 @@ function AlumnoPanel() {
     }
     
     cargarDocumentos()
+
+    // Cambios en vivo de sus documentos y de los requeridos de la tabla
+    const fuente = new EventSource(`${import.meta.env.VITE_BACKEND_URL}/api/alumno/${id}/events?token=${token}`)
+    let reconectando = false
+    fuente.onopen = () => {
+      eventosActivos.current = true
+      if (reconectando) cargarDocumentos()
+    }
+    fuente.onerror = () => {
+      eventosActivos.current = false
+      reconectando = true
+    }
+
+    const escuchar = (tipo, aplicar) =>
+      fuente.addEventListener(tipo, (e) => setDocumentos(prev => aplicar(prev, JSON.parse(e.data))))
+
+    escuchar("documento_subido", (prev, d) =>
+      prev.map(doc => (doc.nombre === d.nombre ? { ...doc, id: d.id, estado: d.estado, subido: true } : doc))
+    )
+    escuchar("documento_eliminado", (prev, d) =>
+      prev.map(doc => (doc.id === d.id ? { ...doc, id: null, estado: "no_subido", subido: false } : doc))
+    )
+    escuchar("documento_actualizado", (prev, d) =>
+      prev.map(doc => (doc.id === d.id && d.estado ? { ...doc, estado: d.estado } : doc))
+    )
+    escuchar("documento_requerido_añadido", (prev, d) =>
+      prev.some(doc => doc.nombre === d.nombre)
+        ? prev
+        : [...prev, { nombre: d.nombre, estado: "no_subido", subido: false, id: null }]
+    )
+    escuchar("documento_requerido_eliminado", (prev, d) => prev.filter(doc => doc.nombre !== d.nombre))
+    fuente.addEventListener("recargar", () => cargarDocumentos())
+
+    return () => {
+      eventosActivos.current = false
+      fuente.close()
+    }
     }, [id, navigate])
     
     const handleFileChange = (nombre, archivo) => {
@@ -97,8 +135,9 @@ function AlumnoPanel() {
         }
     
         const formData = new FormData()
-        formData.append("archivo", archivo)
+        // El tipo va primero para que el backend aplique su límite mientras recibe el archivo
         formData.append("nombre_documento", nombre)
+        formData.append("archivo", archivo)
     
         const token = localStorage.getItem("token_alumno")
         const res = await fetch(`${import.meta.env.VITE_BACKEND_URL}/api/alumno/${id}/subir`, {
@@ -113,7 +152,7 @@ function AlumnoPanel() {
         }
     
         setMensaje("✅ Documento subido correctamente.")
-        await actualizarDocumentos()
+        if (!eventosActivos.current) await actualizarDocumentos()
     
       } catch (err) {
         console.error("Error en subida:", err)
@@ -134,7 +173,7 @@ function AlumnoPanel() {
           throw new Error(data.error || "Error al eliminar")
         }
     
-        await actualizarDocumentos()
+        if (!eventosActivos.current) await actualizarDocumentos()
         setMensaje("🗑️ Documento eliminado.")
     
       } catch (err) {
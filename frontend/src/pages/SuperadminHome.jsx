@@ -59,7 +59,7 @@ function SuperadminHome() {
   
   const verPanelDeAdmin = async (adminId) => {
     try {
-      const res = await fetch(`${import.meta.env.VITE_BACKEND_URL}/api/superadmin/panel_admin/${adminId}`, {
+      const res = await fetch(`${import.meta.env.VITE_BACKEND_URL}/api/superadmin/panel_admin/${adminId}?modo=resumen&limit=1`, {
         headers: { Authorization: `Bearer ${token}` },
       })
   
@@ -1,7 +1,6 @@
 // TablaView.jsx
-import { useEffect, useState } from "react"
+import { useEffect, useRef, useState } from "react"
 import { useParams, useNavigate } from "react-router-dom"
-import JSZip from 'jszip'
 
 function TablaView() {
   const { id } = useParams()
@@ -51,6 +50,75 @@ function TablaView() {
   useEffect(() => {
     cargarTabla()
   }, [id, token])
+
+  // Cambios en vivo: el backend envía solo lo que cambia y se aplica sobre el estado
+  const eventosActivos = useRef(false)
+
+  useEffect(() => {
+    const fuente = new EventSource(`${import.meta.env.VITE_BACKEND_URL}/api/admin/tabla/${id}/events?token=${token}`)
+    let reconectando = false
+
+    fuente.onopen = () => {
+      eventosActivos.current = true
+      // Tras un corte se pueden haber perdido eventos: se recarga una vez
+      if (reconectando) cargarTabla()
+    }
+    fuente.onerror = () => {
+      eventosActivos.current = false
+      reconectando = true
+    }
+
+    const escuchar = (tipo, aplicar) =>
+      fuente.addEventListener(tipo, (e) => setTabla(prev => aplicar(prev, JSON.parse(e.data))))
+
+    escuchar("documento_subido", (prev, d) => {
+      const alumno = prev.alumnos.find(a => a.id === d.alumno_id)
+      const subidos = prev.subidos.filter(s => s.id !== d.id && !(s.alumno_id === d.alumno_id && s.nombre === d.nombre))
+      return {
+        ...prev,
+        subidos: [...subidos, { ...d, alumno_nombre: alumno ? `${alumno.nombre} ${alumno.apellidos}` : "" }]
+      }
+    })
+    escuchar("documento_actualizado", (prev, d) => ({
+      ...prev,
+      subidos: prev.subidos.map(s => (s.id === d.id ? { ...s, ...d } : s))
+    }))
+    escuchar("documento_eliminado", (prev, d) => ({
+      ...prev,
+      subidos: prev.subidos.filter(s => s.id !== d.id)
+    }))
+    escuchar("documento_requerido_añadido", (prev, d) => ({
+      ...prev,
+      documentos: prev.documentos.some(x => x.id === d.id) ? prev.documentos : [...prev.documentos, d]
+    }))
+    escuchar("documento_requerido_eliminado", (prev, d) => ({
+      ...prev,
+      documentos: prev.documentos.filter(x => x.id !== d.id)
+    }))
+    escuchar("alumno_añadido", (prev, a) => ({
+      ...prev,
+      alumnos: prev.alumnos.some(x => x.id === a.id) ? prev.alumnos : [...prev.alumnos, a]
+    }))
+    escuchar("alumnos_añadidos", (prev, lista) => ({
+      ...prev,
+      alumnos: [...prev.alumnos, ...lista.filter(a => !prev.alumnos.some(x => x.id === a.id))]
+    }))
+    escuchar("alumno_eliminado", (prev, a) => ({
+      ...prev,
+      alumnos: prev.alumnos.filter(x => x.id !== a.id),
+      subidos: prev.subidos.filter(s => s.alumno_id !== a.id)
+    }))
+    fuente.addEventListener("recargar", () => cargarTabla())
+    fuente.addEventListener("tabla_eliminada", () => {
+      fuente.close()
+      navigate("/admin")
+    })
+
+    return () => {
+      eventosActivos.current = false
+      fuente.close()
+    }
+  }, [id, token])
   
   const documentosMap = tabla.subidos.reduce((acc, d) => {
     acc[d.alumno_id] = acc[d.alumno_id] || {}
@@ -88,7 +156,7 @@ function TablaView() {
       if (res.ok) {
         setMensaje("✅ Documento añadido")
         setNuevoDoc("")
-        await cargarTabla()
+        if (!eventosActivos.current) await cargarTabla()
       } else {
         setMensaje(`❌ Error: ${data.error}`)
       }
@@ -110,7 +178,7 @@ function TablaView() {
   
       if (!res.ok) throw new Error("Error del servidor")
       setMensaje("✅ Documento eliminado")
-      await cargarTabla()
+      if (!eventosActivos.current) await cargarTabla()
     } catch (err) {
       setMensaje(`❌ Error: ${err.message}`)
     }
@@ -133,7 +201,7 @@ function TablaView() {
       }
   
       setMensaje("✅ Alumno eliminado exitosamente")
-      await cargarTabla()
+      if (!eventosActivos.current) await cargarTabla()
   
     } catch (err) {
       console.error("Error en eliminación:", err)
@@ -170,7 +238,7 @@ function TablaView() {
       if (res.ok) {
         setMensaje("✅ Alumno añadido")
         setNuevoAlumno({ nombre: "", apellidos: "" })
-        await cargarTabla()
+        if (!eventosActivos.current) await cargarTabla()
       } else {
         setMensaje(`❌ Error: ${data.error}`)
       }
@@ -208,48 +276,14 @@ function TablaView() {
     window.open(url, "_blank")
   }
   
-  const descargarTabla = async () => {
-    try {
-      const zip = new JSZip()
-      
-      // Create a folder for each student
-      for (const alumno of tabla.alumnos) {
-        const alumnoFolder = zip.folder(`${alumno.nombre} ${alumno.apellidos}`)
-        
-        // Get all documents for this student
-        const documentosAlumno = tabla.subidos.filter(d => d.alumno_id === alumno.id)
-        
-        // Download and add each document to the zip
-        for (const doc of documentosAlumno) {
-          try {
-            const res = await fetch(`${import.meta.env.VITE_BACKEND_URL}/api/admin/documento/${doc.id}`, {
-              headers: { Authorization: `Bearer ${token}` },
-            })
-            
-            if (!res.ok) throw new Error(`Error al descargar ${doc.nombre}`)
-            
-            const blob = await res.blob()
-            alumnoFolder.file(`${doc.nombre}.pdf`, blob)
-          } catch (err) {
-            console.error(`Error descargando ${doc.nombre}:`, err)
-          }
-        }
-      }
-      
-      // Generate and download the zip file
-      const content = await zip.generateAsync({ type: "blob" })
-      const url = window.URL.createObjectURL(content)
-      const a = document.createElement("a")
-      a.href = url
-      a.download = `${tabla.nombre}.zip`
-      a.click()
-      window.URL.revokeObjectURL(url)
-      
-      setMensaje("✅ Tabla descargada exitosamente")
-    } catch (err) {
-      console.error("Error al descargar la tabla:", err)
-      setMensaje("❌ Error al descargar la tabla")
-    }
+  const descargarTabla = () => {
+    // El backend genera el ZIP en streaming; el navegador lo guarda directamente a disco
+    const url = `${import.meta.env.VITE_BACKEND_URL}/api/admin/tabla/${id}/export.zip?token=${token}`
+    const a = document.createElement("a")
+    a.href = url
+    a.download = `${tabla.nombre}.zip`
+    a.click()
+    setMensaje("✅ Descarga de la tabla iniciada")
   }
 
   return (
@@ -309,6 +343,16 @@ function TablaView() {
                               {d.estado === "aceptado" ? "✅ Validado" : d.estado === "subido" ? "✅ Subido" : "❌ Rechazado"}
                             </span>
                             <br />
+                            {d.miniatura && (
+                              <img
+                                src={`${import.meta.env.VITE_BACKEND_URL}/api/admin/documento/${d.id}/miniatura?token=${token}`}
+                                alt={doc.nombre}
+                                loading="lazy"
+                                onClick={() => verDocumento(d.id)}
+                                className="mx-auto mt-1 max-h-24 cursor-pointer border rounded"
+                              />
+                            )}
+                            {d.paginas && <span className="text-xs text-gray-500">{d.paginas} pág.</span>}
                             <div className="flex flex-col items-center gap-1 mt-1">
                               <button
                                 onClick={() => verDocumento(d.id)}